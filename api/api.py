@@ -1,90 +1,243 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List
+import time
+_IMPORT_START = time.perf_counter()
+
+from fastapi import BackgroundTasks, FastAPI, Header, HTTPException, Response
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional
 import sys
 import os
 import contextlib
+import logging
 
 # Add root to path so we can import recommender
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from recommender.admission import AdmissionController, Overloaded
+from recommender.metrics import REGISTRY, REQUEST_SECONDS, STAGE_SECONDS, Gauge
+from recommender.query_processor import ANALYZER_MODES
 from recommender.recommendation_engine import RecommendationEngine
+from recommender.timing import PhaseTimer
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# LOG_LEVEL=DEBUG shows per-query analysis details; debug calls cost nothing at the default INFO
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger("api")
+
+# TIMING_HEADER=1 attaches per-stage timings to /recommend responses as a Server-Timing header
+TIMING_HEADER = os.environ.get("TIMING_HEADER", "0") == "1"
+
+# Heavy dependencies (torch, Gemini SDK) are imported lazily, so this should stay small
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
+
 # Global Engine
 engine = None
 
+# Dedicated pool for the blocking engine calls. RECOMMEND_WORKERS run at once and up to
+# RECOMMEND_MAX_QUEUE wait; beyond that requests get 429 with Retry-After.
+admission = AdmissionController(
+    max_workers=int(os.environ.get("RECOMMEND_WORKERS", os.cpu_count() or 4)),
+    max_queue=int(os.environ.get("RECOMMEND_MAX_QUEUE", 32))
+)
+
+# Largest /recommend/batch request; each query takes one admission slot, like a /recommend call
+BATCH_MAX_QUERIES = int(os.environ.get("BATCH_MAX_QUERIES", 32))
+
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI):
     global engine
     try:
-        print("Starting up... Loading Recommendation Engine...")
+        logger.info("Starting up (imports took %.2fs)... Loading Recommendation Engine...", IMPORT_SECONDS)
+        start = time.perf_counter()
         engine = RecommendationEngine()
-        print("Engine loaded successfully.")
+        logger.info("Engine loaded successfully in %.2fs.", time.perf_counter() - start)
+        # INDEX_WATCH_INTERVAL (seconds) enables hot reload when data/indexes/CURRENT changes
+        watch_interval = os.environ.get("INDEX_WATCH_INTERVAL")
+        if watch_interval:
+            engine.start_index_watcher(float(watch_interval))
     except Exception as e:
-        print(f"CRITICAL ERROR initializing engine: {e}")
+        logger.critical("Error initializing engine: %s", e)
         engine = None
     yield
-    # Cleanup if needed
-    print("Shutting down...")
+    logger.info("Shutting down...")
+    admission.shutdown()
+    if engine is not None:
+        engine.shutdown()
 
 app = FastAPI(lifespan=lifespan)
 
+# Point-in-time values read at scrape time
+REGISTRY.register(Gauge(
+    "shl_queue_requests", "Recommend requests running or waiting for a worker.",
+    lambda: {k: v for k, v in admission.stats().items() if k in ("running", "queued")}, label_name="state"
+))
+REGISTRY.register(Gauge(
+    "shl_rejected_requests_total", "Requests rejected with 429 since startup.",
+    lambda: admission.rejected, metric_type="counter"
+))
+REGISTRY.register(Gauge(
+    "shl_gemini_in_flight", "Gemini calls in flight.",
+    lambda: engine.processor.llm_in_flight if engine is not None else None
+))
+REGISTRY.register(Gauge(
+    "shl_cache_hit_rate", "Hit rate of each cache.",
+    lambda: None if engine is None else {
+        name: stats["hit_rate"] if stats else None
+        for name, stats in {"analysis": engine.analysis_cache.stats(), **engine.retriever.cache_stats(),
+                            **({"cross_encoder": engine.cross_encoder.cache.stats()} if engine.cross_encoder else {})}.items()
+    },
+    label_name="cache"
+))
+
 class RecommendationInput(BaseModel):
     query: str
+    # Optional per-request analyzer: 'gemini', 'local' or 'auto'
+    analyzer: Optional[str] = None
 
 class RecommendationItem(BaseModel):
     url: str
     name: str
-    adaptive_support: str
+    adaptive_support: str # "Yes", "No" or "Unknown"
     description: str
-    duration: int
+    duration: Optional[int] = None # minutes; None when the catalogue does not say
     remote_support: str
     test_type: List[str]
 
 class RecommendationOutput(BaseModel):
     recommended_assessments: List[RecommendationItem]
 
+class BatchRecommendationInput(BaseModel):
+    queries: List[str] = Field(..., max_length=BATCH_MAX_QUERIES)
+    analyzer: Optional[str] = None
+
+class BatchRecommendationOutput(BaseModel):
+    results: List[RecommendationOutput]
+
 @app.get("/health")
 def health_check():
     if engine is None:
         # Check if it was a startup error or just slow
         return {"status": "starting_or_failed", "detail": "Engine not ready"}
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "queue": admission.stats(),
+        "gemini": engine.processor.llm_stats(),
+        "batching": engine.search_batcher.stats() if engine.search_batcher is not None else None,
+        "cross_encoder": engine.cross_encoder.stats() if engine.cross_encoder is not None else None
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Prometheus text exposition: stage/request latency histograms, batch sizes, queue and cache gauges.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def check_admin_token(token):
+    # Admin endpoints are disabled unless ADMIN_TOKEN is set
+    expected = os.environ.get("ADMIN_TOKEN")
+    if not expected or token != expected:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.get("/admin/index")
+def index_info(x_admin_token: Optional[str] = Header(None)):
+    check_admin_token(x_admin_token)
+    if engine is None:
+        raise HTTPException(status_code=503, detail="Engine not initialized")
+    return {
+        "version": engine.index_version,
+        "assessments": len(engine.retriever.metadata),
+        "index_config": engine.retriever.index_config,
+        "caches": {"analysis": engine.analysis_cache.stats(), **engine.retriever.cache_stats()}
+    }
+
+@app.post("/admin/reload", status_code=202)
+def reload_index(background_tasks: BackgroundTasks, x_admin_token: Optional[str] = Header(None)):
+    """
+    Loads the version named by data/indexes/CURRENT in the background; requests keep being
+    served from the current index until the new one is fully loaded and swapped in.
+    """
+    check_admin_token(x_admin_token)
+    if engine is None:
+        raise HTTPException(status_code=503, detail="Engine not initialized")
+    background_tasks.add_task(engine.reload_index)
+    return {"status": "reloading", "current_version": engine.index_version}
+
+def format_results(results):
+    # Every field was extracted at index build time; this is a plain lookup
+    return RecommendationOutput(recommended_assessments=[
+        RecommendationItem(
+            url=res['assessment_url'],
+            name=res['assessment_name'],
+            adaptive_support=res['adaptive_support'],
+            description=res['description'],
+            duration=res['duration'],
+            remote_support=res['remote_support'],
+            test_type=res['test_types']
+        )
+        for res in results
+    ])
+
+def overloaded(e):
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def finish_request(endpoint, timer, start, response):
+    REQUEST_SECONDS.observe(endpoint, time.perf_counter() - start)
+    if TIMING_HEADER:
+        response.headers["Server-Timing"] = timer.server_timing()
 
 @app.post("/recommend", response_model=RecommendationOutput)
-def recommend(input_data: RecommendationInput):
+async def recommend(input_data: RecommendationInput, response: Response):
+    if engine is None:
+        raise HTTPException(status_code=503, detail="Engine not initialized")
+    
+    if input_data.analyzer is not None and input_data.analyzer not in ANALYZER_MODES:
+        raise HTTPException(status_code=422, detail=f"analyzer must be one of {list(ANALYZER_MODES)}")
+
+    start = time.perf_counter()
+    timer = PhaseTimer(STAGE_SECONDS)
+    try:
+        # The budget starts on arrival, so time spent queued for admission counts against it
+        results = await admission.run(
+            engine.recommend, input_data.query, analyzer_mode=input_data.analyzer, timer=timer,
+            request_deadline=engine.request_deadline()
+        )
+        with timer.phase("serialize"):
+            output = format_results(results)
+        finish_request("/recommend", timer, start, response)
+        return output
+    except Overloaded as e:
+        raise overloaded(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/recommend/batch", response_model=BatchRecommendationOutput)
+async def recommend_batch(input_data: BatchRecommendationInput, response: Response):
     if engine is None:
         raise HTTPException(status_code=503, detail="Engine not initialized")
     
+    if input_data.analyzer is not None and input_data.analyzer not in ANALYZER_MODES:
+        raise HTTPException(status_code=422, detail=f"analyzer must be one of {list(ANALYZER_MODES)}")
+
+    start = time.perf_counter()
+    timer = PhaseTimer(STAGE_SECONDS)
     try:
-        results = engine.recommend(input_data.query)
-        
-        filtered_results = []
-        for res in results:
-            # Map Test Type
-            tt = res.get('test_type', 'K')
-            type_list = ["Knowledge & Skills"] if tt == 'K' else ["Personality & Behavior"]
-            
-            # Extract Duration (dummy logic or regex)
-            import re
-            desc = res.get('description', '')
-            dur_match = re.search(r'(\d+)\s*(?:min|minute)', desc, re.IGNORECASE)
-            duration = int(dur_match.group(1)) if dur_match else 30 # Default to 30 if not found
-            
-            filtered_results.append(RecommendationItem(
-                url=res.get('assessment_url', ''),
-                name=res['assessment_name'],
-                adaptive_support="Yes", # Defaulting as data not available
-                description=desc,
-                duration=duration,
-                remote_support="Yes", # Defaulting
-                test_type=type_list
-            ))
-            
-        return RecommendationOutput(recommended_assessments=filtered_results)
+        batch_results = await admission.run(
+            engine.recommend_batch, input_data.queries, analyzer_mode=input_data.analyzer, timer=timer,
+            analysis_timeout=engine.analysis_timeout, request_deadline=engine.request_deadline(),
+            slots=len(input_data.queries)
+        )
+        with timer.phase("serialize"):
+            output = BatchRecommendationOutput(results=[format_results(r) for r in batch_results])
+        finish_request("/recommend/batch", timer, start, response)
+        return output
+    except Overloaded as e:
+        raise overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
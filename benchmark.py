@@ -0,0 +1,317 @@
+"""
+Latency benchmarks for query encoding, FAISS search, re-ranking and the /recommend endpoint.
+Runs offline: query analysis is stubbed, and catalogues are scaled up synthetically from the
+cleaned SHL catalogue (real rows plus perturbed copies of their vectors). Results are saved as
+JSON so runs can be compared.
+
+    python benchmark.py --scales 1000,10000,100000 --index-types flat,ivf_flat,hnsw
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import faiss
+from recommender.build_index import assessment_ids, build_chunks, build_sparse_index, load_catalogue, metadata_store
+from recommender.encoder import load_encoder
+from recommender.index_factory import build_ann_index, search_params
+from recommender.local_analyzer import K_CUES, P_CUES, STOPWORDS, tokenize
+from recommender.query_processor import QueryProcessor
+from recommender.recommendation_engine import RecommendationEngine
+from recommender.search_service import ENCODER_DIR, MODEL_NAME, SHLRetriever, artifact_paths
+from recommender.timing import PhaseTimer
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+QUERIES_FILE = os.path.join(BASE_DIR, "data", "test_queries.csv")
+OUTPUT_DIR = os.path.join(BASE_DIR, "evaluation", "benchmarks")
+
+DEFAULT_QUERIES = [
+    "Java developer who can collaborate with business teams",
+    "entry level sales role with good communication",
+    "data analyst with python and sql skills",
+    "personality test for a customer service manager",
+    "numerical reasoning for graduate finance hires",
+]
+
+
+class StubQueryProcessor(QueryProcessor):
+    """
+    Network-free analysis with no model: non-stopword tokens as skills, test types from intent cues.
+    Keeps the analysis cost out of the retrieval and ranking numbers.
+    """
+    def __init__(self):
+        super().__init__(api_key="benchmark", mode="local")
+
+    def analyze(self, query, mode=None):
+        tokens = tokenize(query)
+        types = [t for t, cues in (('K', K_CUES), ('P', P_CUES)) if cues & set(tokens)]
+        return {
+            "skills": [t for t in tokens if t not in STOPWORDS and len(t) > 2],
+            "required_test_types": types or ['K', 'P']
+        }
+
+    def warm_up(self):
+        return None
+
+
+def latency_summary(samples):
+    """
+    Latency distribution in milliseconds for a list of durations in seconds.
+    """
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "n": int(len(ms)),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def timed(fn, args_list, repeat=1):
+    samples = []
+    for _ in range(repeat):
+        for args in args_list:
+            start = time.perf_counter()
+            fn(*args)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def load_queries(limit):
+    queries = DEFAULT_QUERIES
+    if os.path.exists(QUERIES_FILE):
+        queries = pd.read_csv(QUERIES_FILE).iloc[:, 0].dropna().astype(str).tolist() or DEFAULT_QUERIES
+    return (queries * (limit // len(queries) + 1))[:limit]
+
+
+def synthetic_catalogue(df, embeddings, num_rows, noise=0.02, seed=0):
+    """
+    The real catalogue followed by perturbed copies of random real rows (unique names/urls,
+    vectors jittered and re-normalized), truncated or extended to num_rows.
+    """
+    rng = np.random.default_rng(seed)
+    base = np.arange(min(num_rows, len(df)))
+    extra = rng.integers(len(df), size=max(0, num_rows - len(df)))
+    source = np.concatenate([base, extra])
+
+    scaled = df.iloc[source].reset_index(drop=True)
+    copy = np.arange(num_rows) >= len(base)
+    suffix = pd.Series(np.arange(num_rows)).astype(str)
+    scaled.loc[copy, 'assessment_name'] = scaled.loc[copy, 'assessment_name'] + " (" + suffix[copy] + ")"
+    scaled.loc[copy, 'assessment_url'] = scaled.loc[copy, 'assessment_url'] + "#" + suffix[copy]
+
+    vectors = embeddings[source].copy()
+    vectors[copy] += noise * rng.standard_normal((int(copy.sum()), embeddings.shape[1])).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return scaled, vectors
+
+
+def write_index_dir(path, df, vectors, index_type, with_bm25=False, nprobe=None, ef_search=None):
+    """
+    Writes the same artifacts as build_index.py for precomputed vectors, so SHLRetriever loads them as usual.
+    nprobe / ef_search are recorded as the index's default search parameters, as build_index.py does.
+    """
+    paths = artifact_paths(path)
+    os.makedirs(path, exist_ok=True)
+    ids = assessment_ids(df)
+
+    start = time.perf_counter()
+    index, spec = build_ann_index(vectors, index_type, ids=ids)
+    build_s = time.perf_counter() - start
+
+    faiss.write_index(index, paths["index"])
+    with open(paths["config"], 'w') as f:
+        json.dump({"index_type": index_type, "factory": spec, "nprobe": nprobe, "ef_search": ef_search}, f)
+    metadata_store(df, ids).save(paths["meta_store"])
+    if with_bm25:
+        build_sparse_index(build_chunks(df), paths["bm25"])
+    return spec, build_s
+
+
+def bench_encode(encoder, queries, batch_sizes, repeat):
+    results = {}
+    for batch_size in batch_sizes:
+        batches = [(queries[i:i + batch_size],) for i in range(0, len(queries), batch_size)]
+        samples = timed(lambda b: encoder.encode(b, batch_size=batch_size, normalize_embeddings=True), batches, repeat)
+        summary = latency_summary(samples)
+        summary["per_query_ms"] = summary["mean_ms"] / batch_size
+        results[f"batch_{batch_size}"] = summary
+        print(f"  encode batch={batch_size}: {summary['per_query_ms']:.2f} ms/query")
+    return results
+
+
+def bench_search(retriever, query_vectors, top_ks, repeat):
+    """
+    FAISS search latency on pre-encoded queries, with the search parameters SHLRetriever serves with.
+    """
+    params = search_params(retriever.index, nprobe=retriever.index_config.get("nprobe"),
+                           ef_search=retriever.index_config.get("ef_search"))
+    results = {}
+    for top_k in top_ks:
+        single = timed(lambda q: retriever.index.search(q[None], top_k, params=params),
+                       [(q,) for q in query_vectors], repeat)
+        start = time.perf_counter()
+        retriever.index.search(query_vectors, top_k, params=params)
+        batch_s = time.perf_counter() - start
+        summary = latency_summary(single)
+        summary["batch_per_query_ms"] = batch_s * 1000 / len(query_vectors)
+        results[f"top_{top_k}"] = summary
+        print(f"  search top_k={top_k}: p50 {summary['p50_ms']:.3f} ms, p99 {summary['p99_ms']:.3f} ms")
+    return results
+
+
+def bench_rerank(engine, retriever, queries, pool_sizes, repeat):
+    results = {}
+    analyses = [engine.processor.analyze(q) for q in queries]
+    for pool in pool_sizes:
+        candidates = retriever.search_batch(queries, top_k=pool)
+        samples = []
+        for _ in range(repeat):
+            for cands, analysis in zip(candidates, analyses):
+                # _rank annotates candidates in place, so each run gets fresh copies
+                fresh = [dict(c) for c in cands]
+                start = time.perf_counter()
+                engine._rank(fresh, analysis, retriever=retriever, timer=PhaseTimer())
+                samples.append(time.perf_counter() - start)
+        results[f"pool_{pool}"] = latency_summary(samples)
+        print(f"  rerank pool={pool}: p50 {results[f'pool_{pool}']['p50_ms']:.3f} ms")
+    return results
+
+
+async def _load(client, queries, concurrency, num_requests):
+    latencies, statuses = [], {}
+    cursor = iter(range(num_requests))
+
+    async def worker():
+        for i in cursor:
+            start = time.perf_counter()
+            response = await client.post("/recommend", json={"query": queries[i % len(queries)]})
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.perf_counter() - start
+    return latencies, statuses, wall
+
+
+def bench_endpoint(engine, queries, concurrency_levels, num_requests, url=None):
+    """
+    Closed-loop load on /recommend: `concurrency` clients each send their next request as soon
+    as the previous one returns. In-process through ASGI by default, or against a running server with url.
+    """
+    import httpx
+    import api.api as api
+
+    async def run():
+        if url:
+            client = httpx.AsyncClient(base_url=url, timeout=60)
+        else:
+            api.engine = engine
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://benchmark")
+        results = {}
+        async with client:
+            await _load(client, queries, 1, min(10, num_requests)) # warm-up
+            for concurrency in concurrency_levels:
+                latencies, statuses, wall = await _load(client, queries, concurrency, num_requests)
+                summary = latency_summary(latencies)
+                summary.update({"qps": num_requests / wall, "status_codes": statuses})
+                results[f"concurrency_{concurrency}"] = summary
+                print(f"  /recommend c={concurrency}: {summary['qps']:.1f} qps, "
+                      f"p50 {summary['p50_ms']:.1f} ms, p99 {summary['p99_ms']:.1f} ms, status {statuses}")
+        return results
+
+    return asyncio.run(run())
+
+
+def parse_list(value, cast=int):
+    return [cast(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval, re-ranking and /recommend latency.")
+    parser.add_argument("--scales", default="1000,10000", help="Catalogue sizes, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--index-types", default="flat,ivf_flat,hnsw")
+    parser.add_argument("--top-k", default="5,10,20,50")
+    parser.add_argument("--pool-sizes", default="10,20,50,100")
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument("--queries", type=int, default=100, help="Distinct benchmark queries")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--nprobe", type=int, default=None, help="IVF lists probed per query (default: the index's own)")
+    parser.add_argument("--ef-search", type=int, default=None, help="HNSW efSearch (default: the index's own)")
+    parser.add_argument("--hybrid", action="store_true", help="Also build BM25 for the synthetic catalogues")
+    parser.add_argument("--url", default=None, help="Benchmark a running API instead of the in-process app")
+    parser.add_argument("--skip-endpoint", action="store_true")
+    parser.add_argument("--output", default=None, help=f"JSON output (default {os.path.relpath(OUTPUT_DIR, BASE_DIR)}/<timestamp>.json)")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    df = load_catalogue()
+
+    # load_encoder() has no query cache, so repeated benchmark queries still pay for the forward pass
+    encoder = load_encoder(MODEL_NAME, ENCODER_DIR, backend=os.environ.get("ENCODER_BACKEND", "auto"),
+                           quantized=os.environ.get("ENCODER_QUANTIZED", "0") == "1")
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count(),
+                    "faiss": faiss.__version__},
+        "encoder": type(encoder).__name__,
+        "args": vars(args),
+        "encode": {},
+        "scales": {}
+    }
+
+    print("Benchmarking query encoding...")
+    report["encode"] = bench_encode(encoder, queries, parse_list(args.batch_sizes), args.repeat)
+    query_vectors = np.asarray(encoder.encode(queries, normalize_embeddings=True), dtype=np.float32)
+
+    print("Encoding the catalogue once for the synthetic copies...")
+    embeddings = np.asarray(encoder.encode(build_chunks(df), batch_size=64, normalize_embeddings=True), dtype=np.float32)
+
+    workdir = tempfile.mkdtemp(prefix="shl_benchmark_")
+    try:
+        for scale in parse_list(args.scales):
+            print(f"\n=== {scale} assessments ===")
+            scaled_df, vectors = synthetic_catalogue(df, embeddings, scale)
+            scale_report = {}
+            for n, index_type in enumerate(parse_list(args.index_types, str)):
+                index_dir = os.path.join(workdir, f"{scale}_{index_type}")
+                spec, build_s = write_index_dir(index_dir, scaled_df, vectors, index_type, with_bm25=args.hybrid,
+                                                nprobe=args.nprobe, ef_search=args.ef_search)
+                print(f"[{spec}] built in {build_s:.1f}s")
+                retriever = SHLRetriever.from_dir(index_dir, model=encoder)
+
+                entry = {"factory": spec, "build_s": build_s, "nprobe": args.nprobe, "ef_search": args.ef_search,
+                         "search": bench_search(retriever, query_vectors, parse_list(args.top_k), args.repeat)}
+
+                # Ranking and the endpoint do not depend on the ANN structure; run them on the first type only
+                if n == 0:
+                    engine = RecommendationEngine(retriever=retriever, processor=StubQueryProcessor())
+                    entry["rerank"] = bench_rerank(engine, retriever, queries, parse_list(args.pool_sizes), args.repeat)
+                    if not args.skip_endpoint:
+                        entry["endpoint"] = bench_endpoint(engine, queries, parse_list(args.concurrency),
+                                                           args.requests, args.url)
+                    engine.shutdown()
+                scale_report[index_type] = entry
+            report["scales"][str(scale)] = scale_report
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(OUTPUT_DIR, f"benchmark_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nBenchmark results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
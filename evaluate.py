@@ -1,95 +1,168 @@
 import pandas as pd
+import argparse
 import json
 import os
+import time
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from predict import CACHE_DB
+from recommender.cache import LRUCache
 from recommender.recommendation_engine import RecommendationEngine
-from recommender.search_service import SHLRetriever
 
-LABELED_DATA = r"c:\Users\safal\Desktop\shl_assignment\data\labeled\train.csv"
-OUTPUT_DIR = r"c:\Users\safal\Desktop\shl_assignment\evaluation"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LABELED_DATA = os.path.join(BASE_DIR, "data", "labeled", "train.csv")
+OUTPUT_DIR = os.path.join(BASE_DIR, "evaluation")
 OUTPUT_FILE = os.path.join(OUTPUT_DIR, "results.json")
 
-def calculate_recall_at_k(retrieved_items, relevant_items, k=10):
-    k = min(k, len(retrieved_items))
-    top_k = retrieved_items[:k]
-    
-    hits = 0
-    for item in top_k:
-        if item in relevant_items:
-            hits += 1
-            
-    if not relevant_items:
-        return 0.0
-        
-    return hits / len(relevant_items)
-
-def evaluate():
+KS = (1, 3, 5, 10)
+
+def relevance_matrix(ranked_lists, relevant_lists, depth):
+    """
+    (num_queries, depth) 0/1 matrix: whether the item at each rank is relevant. Short lists are zero-padded.
+    """
+    rel = np.zeros((len(ranked_lists), depth), dtype=np.float64)
+    for i, (ranked, relevant) in enumerate(zip(ranked_lists, relevant_lists)):
+        relevant = set(relevant)
+        for j, item in enumerate(ranked[:depth]):
+            rel[i, j] = item in relevant
+    return rel
+
+def ranking_metric_arrays(rel, num_relevant, ks=KS):
+    """
+    Per-query recall, MAP, nDCG and MRR at each k, computed on the whole relevance matrix at once.
+    rel may carry leading axes (e.g. one per configuration); ranks are always the last axis.
+    Recall@k is hits in the top k over the number of relevant items (as before).
+    """
+    num_relevant = np.asarray(num_relevant, dtype=np.float64)
+    has_relevant = num_relevant > 0
+    safe_relevant = np.maximum(num_relevant, 1)
+
+    ranks = np.arange(1, rel.shape[-1] + 1)
+    hits = np.cumsum(rel, axis=-1)
+    precision = hits / ranks
+    discounts = 1.0 / np.log2(ranks + 1)
+    first_hit = np.where(rel.any(axis=-1), rel.argmax(axis=-1) + 1, 0)
+
+    metrics = {}
+    for k in ks:
+        k_eff = min(k, rel.shape[-1])
+        ap = (precision[..., :k_eff] * rel[..., :k_eff]).sum(axis=-1) / np.minimum(safe_relevant, k)
+        dcg = (rel[..., :k_eff] * discounts[:k_eff]).sum(axis=-1)
+        ideal = np.cumsum(discounts)[np.minimum(safe_relevant, k_eff).astype(int) - 1]
+        metrics[f"recall@{k}"] = np.where(has_relevant, hits[..., k_eff - 1] / safe_relevant, 0.0)
+        metrics[f"map@{k}"] = np.where(has_relevant, ap, 0.0)
+        metrics[f"ndcg@{k}"] = np.where(has_relevant, dcg / ideal, 0.0)
+        metrics[f"mrr@{k}"] = np.where((first_hit > 0) & (first_hit <= k), 1.0 / np.maximum(first_hit, 1), 0.0)
+    return metrics
+
+def ranking_metrics(rel, num_relevant, ks=KS):
+    """
+    Mean of each metric over all queries, plus the per-query recall@10.
+    """
+    arrays = ranking_metric_arrays(rel, num_relevant, tuple(ks) + (10,))
+    return {name: float(arrays[name].mean()) for name in arrays if int(name.split("@")[1]) in ks}, arrays["recall@10"]
+
+def collect(engine, queries, max_pool, workers=16, analyzer_mode=None):
+    """
+    Everything the rankings need, computed once: analyses (concurrent, through the analysis cache)
+    overlapping with one batched encode + search of all queries at the largest pool size.
+    Returns (unfiltered candidate lists, analyses, raw dense top lists for the baseline);
+    engine.candidate_pools / rank_candidates turn the candidates into a given pool size's.
+    """
+    retriever = engine.retriever
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="eval-analysis") as pool:
+        futures = [pool.submit(engine.processor.analyze, q, analyzer_mode) for q in queries]
+
+        depth = max(max_pool, max(KS))
+        dense = retriever.search_batch(queries, top_k=depth, mode="dense")
+        if engine.retrieval_mode == "dense":
+            candidates = dense
+        else:
+            candidates = retriever.search_batch(queries, top_k=max_pool, mode=engine.retrieval_mode)
+
+        analyses = [f.result() for f in futures]
+    return candidates, analyses, dense
+
+def evaluate(labeled_path=LABELED_DATA, pool_sizes=None, workers=16, analyzer_mode=None):
     print("Initializing systems...")
-    # Initialize both (Engine initializes its own retriever, but for baseline we want raw retriever)
+    # One engine; its retriever doubles as the raw vector-search baseline
     try:
-        engine = RecommendationEngine()
-        retriever = SHLRetriever()
+        analysis_cache = LRUCache(max_size=10000, db_path=CACHE_DB, table="analysis")
+        engine = RecommendationEngine(analysis_cache=analysis_cache)
     except Exception as e:
         print(f"Error checking initialization: {e}")
         return
 
-    if not os.path.exists(LABELED_DATA):
-        print(f"Labeled data not found at {LABELED_DATA}")
+    if not os.path.exists(labeled_path):
+        print(f"Labeled data not found at {labeled_path}")
         return
 
     print("Loading labeled data...")
-    df = pd.read_csv(LABELED_DATA)
-    
-    baseline_recalls = []
-    model_recalls = []
-    
-    print(f"Evaluating {len(df)} queries...")
-    for index, row in df.iterrows():
-        query = row['query']
-        # relevant_assessments is pipe separated
-        relevant = [x.strip() for x in str(row['relevant_assessments']).split('|')]
-        
-        print(f"Query: {query}")
-        
-        # 1. Baseline (Raw Vector Search)
-        # Search returns list of dicts with 'assessment_name'
-        base_results = retriever.search(query, top_k=10)
-        base_names = [r['assessment_name'] for r in base_results]
-        rec_base = calculate_recall_at_k(base_names, relevant, k=10)
-        baseline_recalls.append(rec_base)
-        print(f"  Baseline Recall@10: {rec_base:.2f}")
-
-        # 2. Model (Re-ranked & Balanced)
-        # Engine returns list of dicts with 'assessment_name'
-        model_results = engine.recommend(query) # Defults to max 10
-        model_names = [r['assessment_name'] for r in model_results]
-        rec_model = calculate_recall_at_k(model_names, relevant, k=10)
-        model_recalls.append(rec_model)
-        print(f"  Model Recall@10:    {rec_model:.2f}")
-        
-    # Aggregate
-    mean_recall_baseline = np.mean(baseline_recalls) if baseline_recalls else 0.0
-    mean_recall_model = np.mean(model_recalls) if model_recalls else 0.0
-    
+    df = pd.read_csv(labeled_path)
+    queries = df['query'].tolist()
+    # relevant_assessments is pipe separated
+    relevant_lists = [[x.strip() for x in str(r).split('|')] for r in df['relevant_assessments']]
+    num_relevant = [len(r) for r in relevant_lists]
+
+    pool_sizes = sorted(set(pool_sizes or [engine.candidate_pool]))
+    print(f"Evaluating {len(df)} queries (pool sizes {pool_sizes})...")
+    start = time.perf_counter()
+    candidates, analyses, dense = collect(engine, queries, max(pool_sizes), workers, analyzer_mode)
+    collect_s = time.perf_counter() - start
+
+    # 1. Baseline (Raw Vector Search)
+    depth = max(KS)
+    base_names = [[r['assessment_name'] for r in results[:depth]] for results in dense]
+    baseline_metrics, baseline_recalls = ranking_metrics(relevance_matrix(base_names, relevant_lists, depth), num_relevant)
+
+    # 2. Model (Re-ranked & Balanced), once per pool size on the same candidates
+    sweep = {}
+    for pool_size in pool_sizes:
+        model_batch = engine.rank_candidates(queries, candidates, analyses, pool_size, max_results=depth)
+        model_names = [[r['assessment_name'] for r in results] for results in model_batch]
+        metrics, recalls = ranking_metrics(relevance_matrix(model_names, relevant_lists, depth), num_relevant)
+        sweep[pool_size] = (metrics, recalls)
+
+    model_metrics, model_recalls = sweep[engine.candidate_pool] if engine.candidate_pool in sweep else sweep[pool_sizes[-1]]
+    elapsed = time.perf_counter() - start
+
     results = {
-        "baseline_mean_recall_at_10": float(mean_recall_baseline),
-        "model_mean_recall_at_10": float(mean_recall_model),
+        "baseline_mean_recall_at_10": baseline_metrics["recall@10"],
+        "model_mean_recall_at_10": model_metrics["recall@10"],
+        "metrics": {"baseline": baseline_metrics, "model": model_metrics},
+        "pool_sweep": {str(p): m for p, (m, _) in sweep.items()},
         "details": {
             "num_queries": len(df),
-            "baseline_recalls": baseline_recalls,
-            "model_recalls": model_recalls
+            "baseline_recalls": baseline_recalls.tolist(),
+            "model_recalls": model_recalls.tolist(),
+            "seconds": {"retrieval_and_analysis": collect_s, "total": elapsed}
         }
     }
-    
+
     print("\n--- Evaluation Results ---")
-    print(f"Baseline Mean Recall@10: {mean_recall_baseline:.4f}")
-    print(f"Model Mean Recall@10:    {mean_recall_model:.4f}")
-    
+    print(f"{'metric':<10} {'baseline':>9} {'model':>9}")
+    for name in model_metrics:
+        print(f"{name:<10} {baseline_metrics[name]:>9.4f} {model_metrics[name]:>9.4f}")
+    if len(sweep) > 1:
+        print("\nPool size sweep (model):")
+        for p, (m, _) in sweep.items():
+            print(f"  pool={p:<4} recall@10={m['recall@10']:.4f} map@10={m['map@10']:.4f} ndcg@10={m['ndcg@10']:.4f}")
+    print(f"\nEvaluated in {elapsed:.2f}s")
+
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     with open(OUTPUT_FILE, 'w') as f:
         json.dump(results, f, indent=2)
-        
+
     print(f"Results saved to {OUTPUT_FILE}")
+    print(f"Analysis cache: {analysis_cache.stats()}")
+    return results
 
 if __name__ == "__main__":
-    evaluate()
+    parser = argparse.ArgumentParser(description="Evaluate retrieval and re-ranking against labeled queries.")
+    parser.add_argument("--labeled", default=LABELED_DATA, help="CSV with 'query' and pipe-separated 'relevant_assessments'")
+    parser.add_argument("--pool-sizes", default=None, help="Comma-separated rerank pool sizes to compare, e.g. 10,20,50")
+    parser.add_argument("--workers", type=int, default=16, help="Concurrent query analyses")
+    parser.add_argument("--analyzer", default=None, help="Analyzer mode override: gemini, local or auto")
+    args = parser.parse_args()
+    pools = [int(p) for p in args.pool_sizes.split(",")] if args.pool_sizes else None
+    evaluate(args.labeled, pools, args.workers, args.analyzer)
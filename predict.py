@@ -1,55 +1,216 @@
 import pandas as pd
+import argparse
 import csv
 import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from recommender.cache import LRUCache
 from recommender.recommendation_engine import RecommendationEngine
 from dotenv import load_dotenv
 
 load_dotenv()
 
-INPUT_FILE = r"c:\Users\safal\Desktop\shl_assignment\data\test_queries.csv"
-OUTPUT_FILE = r"c:\Users\safal\Desktop\shl_assignment\predictions.csv"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INPUT_FILE = os.path.join(BASE_DIR, "data", "test_queries.csv")
+OUTPUT_FILE = os.path.join(BASE_DIR, "predictions.csv")
+# Persistent Gemini analysis cache, also used by evaluate.py and tune.py
+CACHE_DB = os.path.join(BASE_DIR, "data", "cache", "analysis_cache.sqlite")
+HEADER = ["Query", "Assessment_url"]
+PREDICTED_CACHE_SIZE = 100000 # Distinct queries whose URLs are kept for repeats later in the input
 
-def generate_predictions():
-    if not os.path.exists(INPUT_FILE):
-        print(f"Error: {INPUT_FILE} not found.")
-        return
+def load_checkpoint(path):
+    """
+    Input rows completed by a previous run, as {row position: output rows written for it}.
+    One "<row>\t<count>" line per row, so the keys never depend on the query text.
+    A crash can leave a torn last line; it is dropped (and cut from the file) so the row is redone.
+    """
+    if not os.path.exists(path):
+        return {}
+    done = {}
+    valid_bytes = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            fields = line.split()
+            if not line.endswith(b"\n") or len(fields) != 2 or not all(x.isdigit() for x in fields):
+                print(f"Ignoring incomplete checkpoint entry {line!r} and anything after it")
+                break
+            done[int(fields[0])] = int(fields[1])
+            valid_bytes += len(line)
+    if valid_bytes < os.path.getsize(path):
+        with open(path, 'r+b') as f:
+            f.truncate(valid_bytes)
+    return done
 
-    print("Initializing engine...")
-    try:
-        engine = RecommendationEngine()
-    except Exception as e:
-        print(f"Error initializing engine: {e}")
+def drop_unfinished_rows(output_file, written):
+    """
+    A crash between writing a batch's rows and checkpointing it leaves rows for input rows
+    that will be predicted again. Output rows are appended in checkpoint order, so only the
+    first `written` are complete; rewrite the output without the rest (only if there are any).
+    """
+    with open(output_file, newline='', encoding='utf-8') as f:
+        rows = list(csv.reader(f))[1:]
+    if len(rows) <= written:
+        return 0
+    tmp = output_file + ".tmp"
+    with open(tmp, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        writer.writerows(rows[:written])
+    os.replace(tmp, output_file)
+    return len(rows) - written
+
+def iter_batches(input_file, done, chunk_size, batch_size):
+    """
+    Streams the query column in chunks and yields batches of (row position, query) for the
+    input rows not completed yet. Queries are passed on exactly as read.
+    """
+    batch = []
+    for chunk in pd.read_csv(input_file, chunksize=chunk_size, usecols=["Query"]):
+        for row, query in chunk['Query'].dropna().astype(str).items():
+            if row in done:
+                continue
+            batch.append((row, query))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+def generate_predictions(input_file=INPUT_FILE, output_file=OUTPUT_FILE, checkpoint_file=None,
+                         chunk_size=1000, batch_size=32, workers=2, restart=False):
+    if not os.path.exists(input_file):
+        print(f"Error: {input_file} not found.")
         return
 
-    print(f"Loading queries from {INPUT_FILE}...")
+    checkpoint_file = checkpoint_file or output_file + ".done"
+    if restart:
+        for path in (output_file, checkpoint_file):
+            if os.path.exists(path):
+                os.remove(path)
+
     try:
-        queries_df = pd.read_csv(INPUT_FILE)
-        if 'Query' not in queries_df.columns:
+        if 'Query' not in pd.read_csv(input_file, nrows=0).columns:
             print("Error: Input CSV must have a 'Query' column.")
             return
-        queries = queries_df['Query'].tolist()
     except Exception as e:
         print(f"Error reading input file: {e}")
         return
 
-    print(f"Processing {len(queries)} queries...")
-    
-    # Open output file for writing
-    with open(OUTPUT_FILE, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(["Query", "Assessment_url"])
-        
-        for q in queries:
-            print(f"Predicting for: {q}")
+    done = load_checkpoint(checkpoint_file)
+    if done and os.path.exists(output_file):
+        dropped = drop_unfinished_rows(output_file, sum(done.values()))
+        print(f"Resuming: {len(done)} queries already done" + (f" ({dropped} partial rows dropped)" if dropped else ""))
+    else:
+        # Output without a checkpoint (or the reverse) cannot be resumed; start over
+        for path in (output_file, checkpoint_file):
+            if os.path.exists(path):
+                os.remove(path)
+        done = {}
+
+    print("Initializing engine...")
+    try:
+        analysis_cache = LRUCache(max_size=10000, db_path=CACHE_DB, table="analysis")
+        engine = RecommendationEngine(analysis_cache=analysis_cache)
+    except Exception as e:
+        print(f"Error initializing engine: {e}")
+        return
+
+    print(f"Streaming queries from {input_file} (batches of {batch_size}, {workers} workers)...")
+    completed = failed = 0
+    start = last_report = time.perf_counter()
+
+    with open(output_file, 'a', newline='', encoding='utf-8') as out, \
+         open(checkpoint_file, 'a', encoding='utf-8') as checkpoint, \
+         ThreadPoolExecutor(max_workers=workers, thread_name_prefix="predict") as pool:
+        writer = csv.writer(out)
+        if out.tell() == 0:
+            writer.writerow(HEADER)
+
+        # Batches are submitted ahead (bounded, so memory stays flat) and written back in input order.
+        # Each distinct query is predicted once: repeats reuse the URLs of an earlier batch, or
+        # wait on the batch that is still computing them.
+        pending = deque()
+        predicted = LRUCache(max_size=PREDICTED_CACHE_SIZE, ttl=None) # query -> URLs, from written batches
+        in_flight = {} # query -> (future, position in its batch) for submitted, unwritten batches
+
+        def write_next():
+            nonlocal completed, failed
+            batch, queries, future, sources = pending.popleft()
             try:
-                results = engine.recommend(q)
-                for res in results:
-                    url = res.get('assessment_url', '')
-                    writer.writerow([q, url])
+                if future is not None:
+                    for q, results in zip(queries, future.result()):
+                        predicted.set(q, [res.get('assessment_url', '') for res in results])
+                urls = [
+                    source if source_future is None
+                    else [res.get('assessment_url', '') for res in source_future.result()[source]]
+                    for source_future, source in sources
+                ]
             except Exception as e:
-                print(f"Error processing query '{q}': {e}")
-                
-    print(f"Predictions saved to {OUTPUT_FILE}")
+                # Left out of the checkpoint, so a rerun retries them
+                print(f"Error processing batch of {len(batch)} queries: {e}")
+                failed += len(batch)
+                return
+            finally:
+                for q in queries:
+                    in_flight.pop(q, None)
+            for (_, q), row_urls in zip(batch, urls):
+                for url in row_urls:
+                    writer.writerow([q, url])
+            out.flush()
+            os.fsync(out.fileno())
+            # Checkpoint only after the rows are on disk
+            checkpoint.write("".join(f"{row}\t{len(row_urls)}\n" for (row, _), row_urls in zip(batch, urls)))
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+            completed += len(batch)
+
+        for batch in iter_batches(input_file, done, chunk_size, batch_size):
+            # Per input row: (None, URLs) when already predicted, else (future, position in its batch)
+            sources, new = [], {}
+            for _, q in batch:
+                urls = predicted.get(q)
+                if urls is not None:
+                    sources.append((None, urls))
+                elif q in in_flight:
+                    sources.append(in_flight[q])
+                else:
+                    sources.append((new, new.setdefault(q, len(new))))
+            queries = list(new)
+            future = pool.submit(engine.recommend_batch, queries) if queries else None
+            sources = [(future, i) if source is new else (source, i) for source, i in sources]
+            in_flight.update((q, (future, i)) for q, i in new.items())
+            pending.append((batch, queries, future, sources))
+            if len(pending) > workers * 2:
+                write_next()
+            now = time.perf_counter()
+            if now - last_report >= 10:
+                last_report = now
+                print(f"  {completed} queries done, {completed / (now - start):.1f} queries/s")
+        while pending:
+            write_next()
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {completed} queries in {elapsed:.1f}s ({completed / elapsed if elapsed else 0:.1f} queries/s)"
+          + (f", {failed} failed (rerun to retry)" if failed else ""))
+    print(f"Predictions saved to {output_file}")
+    print(f"Analysis cache: {analysis_cache.stats()}")
+    engine.shutdown()
 
 if __name__ == "__main__":
-    generate_predictions()
+    parser = argparse.ArgumentParser(description="Generate predictions for a CSV of queries (column 'Query').")
+    parser.add_argument("--input", default=INPUT_FILE, help="Input CSV with a 'Query' column")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="Output CSV (Query, Assessment_url)")
+    parser.add_argument("--checkpoint", default=None, help="Completed-query log used to resume (default <output>.done)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Rows read from the input at a time")
+    parser.add_argument("--batch-size", type=int, default=32, help="Queries per encoder/search batch")
+    parser.add_argument("--workers", type=int, default=2, help="Batches processed concurrently")
+    parser.add_argument("--gemini-concurrency", type=int, default=None, help="Max concurrent Gemini calls (GEMINI_MAX_CONCURRENCY)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from scratch")
+    args = parser.parse_args()
+    if args.gemini_concurrency is not None:
+        os.environ["GEMINI_MAX_CONCURRENCY"] = str(args.gemini_concurrency)
+    # Batch jobs would rather wait for a Gemini slot than fall back to the local analysis
+    os.environ.setdefault("GEMINI_QUEUE_TIMEOUT", "60")
+    generate_predictions(args.input, args.output, args.checkpoint, args.chunk_size, args.batch_size,
+                         args.workers, args.restart)
@@ -0,0 +1,95 @@
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is rejected because the worker pool and its queue are full.
+    """
+    def __init__(self, retry_after):
+        super().__init__(f"Server busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Runs blocking work on a dedicated, sized thread pool for async endpoints.
+    At most max_workers jobs run and max_queue wait; anything beyond that is rejected
+    immediately (Overloaded) instead of piling up and timing out together.
+    A job may take several slots (e.g. one per query of a batch request).
+    """
+    def __init__(self, max_workers, max_queue, thread_name_prefix="recommend"):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._lock = threading.Lock()
+        self.in_flight = 0 # running + queued slots
+        self.completed = 0
+        self.rejected = 0
+        self._avg_latency = None # EWMA of job latency per slot in seconds
+
+    @property
+    def capacity(self):
+        return self.max_workers + self.max_queue
+
+    def _admit(self, slots):
+        with self._lock:
+            if self.in_flight + slots > self.capacity:
+                self.rejected += 1
+                raise Overloaded(self.retry_after())
+            self.in_flight += slots
+
+    def _done(self, latency, slots):
+        with self._lock:
+            self.in_flight -= slots
+            self.completed += 1
+            latency /= slots
+            self._avg_latency = latency if self._avg_latency is None else 0.9 * self._avg_latency + 0.1 * latency
+
+    def retry_after(self):
+        """
+        Seconds until the current backlog should have drained (at least 1).
+        """
+        latency = self._avg_latency or 1.0
+        return max(1, math.ceil(self.in_flight * latency / self.max_workers))
+
+    async def run(self, fn, *args, slots=1, **kwargs):
+        # A job larger than the whole capacity is admitted only when nothing else is in flight
+        slots = max(1, min(slots, self.capacity))
+        self._admit(slots)
+
+        # Accounting happens on the worker, so a cancelled (disconnected) request
+        # still counts until its job has actually finished
+        def job():
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._done(time.perf_counter() - start, slots)
+
+        try:
+            future = self.executor.submit(job)
+        except RuntimeError:
+            # Executor already shut down
+            self._done(0.0, slots)
+            raise
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        with self._lock:
+            running = min(self.in_flight, self.max_workers)
+            return {
+                "workers": self.max_workers,
+                "running": running,
+                "queued": self.in_flight - running,
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_latency_ms": (self._avg_latency or 0.0) * 1000
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,77 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-item calls into batched calls of fn(key, items) -> results.
+    A dispatcher thread takes the first waiting item, collects whatever else arrives within
+    window_ms (up to max_batch_size), runs one call per distinct key and resolves each caller's future.
+    While a batch runs, new arrivals queue up and form the next batch.
+    """
+    def __init__(self, fn, max_batch_size=32, window_ms=2.0, name="micro-batcher", size_histogram=None):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.batch_sizes = Counter() # batch size -> number of batches
+        self.size_histogram = size_histogram
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, key, item):
+        """
+        Blocks until the batch containing item has run and returns item's result.
+        Items are only batched with items of the same key.
+        """
+        future = Future()
+        self._queue.put((key, item, future))
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            with self._lock:
+                self.batch_sizes[len(batch)] += 1
+            if self.size_histogram is not None:
+                self.size_histogram.observe(len(batch))
+
+            groups = {}
+            for key, item, future in batch:
+                groups.setdefault(key, []).append((item, future))
+            for key, entries in groups.items():
+                try:
+                    results = self.fn(key, [item for item, _ in entries])
+                    for (_, future), result in zip(entries, results):
+                        future.set_result(result)
+                except Exception as e:
+                    for _, future in entries:
+                        future.set_exception(e)
+
+    def stats(self):
+        with self._lock:
+            batches = sum(self.batch_sizes.values())
+            items = sum(size * n for size, n in self.batch_sizes.items())
+            return {
+                "window_ms": self.window * 1000,
+                "max_batch_size": self.max_batch_size,
+                "batches": batches,
+                "items": items,
+                "mean_batch_size": items / batches if batches else 0.0,
+                "batch_sizes": dict(sorted(self.batch_sizes.items()))
+            }
@@ -1,9 +1,22 @@
 import pandas as pd
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
 import pickle
 import os
+import json
+import hashlib
+import itertools
+import shutil
+import time
+import argparse
+from recommender.encoder import export_onnx
+from recommender.index_factory import INDEX_TYPES, build_ann_index, is_id_mapped, sweep
+from recommender.local_analyzer import LocalQueryAnalyzer, analyzer_text
+from recommender.metadata_store import MetadataStore
+from recommender.search_service import CURRENT_FILE, ENCODER_DIR, VERSIONS_DIR, artifact_paths, resolve_index_dir
+from recommender.sparse_index import BM25Index
+from recommender.test_types import type_masks
+from scraper.clean_shl import ATTRIBUTE_COLUMNS, attribute_arrays
 
 # Use relative paths for deployment compatibility
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__))) # go up from recommender/build_index.py to root
@@ -14,56 +27,270 @@ if os.path.basename(BASE_DIR) == 'recommender': # Safety check
 if not os.path.exists(os.path.join(BASE_DIR, 'data')):
     BASE_DIR = os.getcwd()
 
+# Cleaned catalogue from scraper/clean_shl.py; the Parquet output is preferred, the CSV is the legacy format
+PARQUET_FILE = os.path.join(BASE_DIR, "data", "processed", "shl_catalogue_clean.parquet")
 INPUT_FILE = os.path.join(BASE_DIR, "data", "processed", "shl_catalogue_clean.csv")
 INDEX_DIR = os.path.join(BASE_DIR, "data", "indexes")
-INDEX_FILE = os.path.join(INDEX_DIR, "shl_embeddings.index")
-META_FILE = os.path.join(INDEX_DIR, "shl_metadata.pkl")
+KEEP_VERSIONS = 3 # Older versioned builds are pruned after a new one is published
+SWEEP_FILE = os.path.join(BASE_DIR, "evaluation", "index_sweep.json")
 MODEL_NAME = 'all-MiniLM-L6-v2'
 
-def build_index():
+def catalogue_path():
+    return PARQUET_FILE if os.path.exists(PARQUET_FILE) else INPUT_FILE
+
+def load_catalogue(path=None):
+    path = path or catalogue_path()
+    return pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+
+def build_chunks(df):
+    # Format: "Assessment: <Name>. Type: <Type>. Description: <Desc>"
+    return df.apply(
+        lambda x: f"Assessment: {x['assessment_name']}. Type: {x['test_type']}. Description: {x['description']}", 
+        axis=1
+    ).tolist()
+
+def build_sparse_index(chunks, path):
+    print("Building BM25 index...")
+    bm25 = BM25Index.build(chunks)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    bm25.save(path)
+    print(f"BM25 index contains {len(bm25.terms)} terms.")
+    return bm25
+
+def assessment_ids(df):
+    """
+    Stable 60-bit id per assessment, derived from its URL (unique after cleaning).
+    """
+    ids = np.array(
+        [int(hashlib.sha1(str(url).encode("utf-8")).hexdigest()[:15], 16) for url in df['assessment_url']],
+        dtype=np.int64
+    )
+    if len(np.unique(ids)) != len(ids):
+        raise ValueError("Duplicate assessment ids; deduplicate assessment_url first.")
+    return ids
+
+def metadata_store(df, ids):
+    """
+    Columnar copy of the metadata that the retriever memory-maps, with the full category_tags
+    as a per-vector bitmask for filtered search and the structured attributes the API serves
+    (parsed here for catalogues cleaned without them).
+    """
+    tags = df['category_tags'] if 'category_tags' in df else [None] * len(df)
+    arrays = {"type_mask": type_masks(tags, df['test_type']), **attribute_arrays(df)}
+    columns = df.drop(columns=[c for c in ATTRIBUTE_COLUMNS if c in df])
+    return MetadataStore.from_frame(columns, ids=ids, arrays=arrays)
+
+def chunk_hashes(chunks):
+    return [hashlib.sha1(c.encode("utf-8")).hexdigest() for c in chunks]
+
+def load_embedding_cache(path):
+    """
+    Returns {chunk hash: embedding} from the previous build, or {} if there is none.
+    """
+    if not os.path.exists(path):
+        return {}
+    data = np.load(path, allow_pickle=False)
+    return dict(zip(data['hashes'].tolist(), data['vectors']))
+
+def save_embedding_cache(hashes, embeddings, path):
+    # Only current chunks are kept, so the cache never outgrows the catalogue
+    np.savez(path, hashes=np.array(hashes), vectors=embeddings)
+
+def embed_chunks(chunks, hashes, cache):
+    """
+    Embeds only chunks whose hash is not cached. Returns the full (n, dim) matrix in row order.
+    """
+    missing = [i for i, h in enumerate(hashes) if h not in cache]
+    print(f"Reusing {len(chunks) - len(missing)} cached embeddings, encoding {len(missing)}.")
+    if missing:
+        from sentence_transformers import SentenceTransformer
+        print(f"Loading model {MODEL_NAME}...")
+        model = SentenceTransformer(MODEL_NAME)
+        print("Generating embeddings...")
+        # Normalize embeddings to use Inner Product for Cosine Similarity
+        vectors = model.encode([chunks[i] for i in missing], show_progress_bar=True, normalize_embeddings=True)
+        for i, vector in zip(missing, np.array(vectors).astype('float32')):
+            cache[hashes[i]] = vector
+    return np.vstack([cache[h] for h in hashes]).astype('float32')
+
+def update_index(src, ids, hashes, embeddings):
+    """
+    Applies the catalogue diff to the previous id-mapped index (src artifact paths).
+    Returns None when there is no usable previous index or the index type cannot remove vectors.
+    """
+    if not os.path.exists(src["index"]) or not MetadataStore.exists(src["meta_store"]):
+        return None
+    previous = MetadataStore.load(src["meta_store"], mmap=False)
+    if previous.ids is None or 'chunk_hash' not in previous:
+        return None
+    index = faiss.read_index(src["index"])
+    if not is_id_mapped(index):
+        return None
+
+    old = dict(zip(previous.ids.tolist(), previous.column('chunk_hash')))
+    new = dict(zip(ids.tolist(), hashes))
+    stale = np.array([i for i, h in old.items() if new.get(i) != h], dtype=np.int64)
+    fresh = np.array([row for row, (i, h) in enumerate(zip(ids.tolist(), hashes)) if old.get(i) != h], dtype=np.int64)
+
+    try:
+        if len(stale):
+            index.remove_ids(stale)
+        if len(fresh):
+            index.add_with_ids(embeddings[fresh], ids[fresh])
+    except RuntimeError as e:
+        print(f"Index does not support in-place updates ({e}), rebuilding from cached embeddings.")
+        return None
+    print(f"Incremental update: removed {len(stale)} vectors, added {len(fresh)}.")
+    return index
+
+def new_version():
+    """
+    Claims a fresh versions/<timestamp> directory. Builds started in the same second get a
+    -01, -02, ... suffix (still sorting after the plain name) instead of sharing a directory.
+    """
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    os.makedirs(VERSIONS_DIR, exist_ok=True)
+    for n in itertools.count():
+        version = f"{stamp}-{n:02d}" if n else stamp
+        try:
+            os.mkdir(os.path.join(VERSIONS_DIR, version))
+            return version
+        except FileExistsError:
+            continue
+
+def publish_version(version):
+    """
+    Points CURRENT at a finished build with an atomic rename, then prunes old builds.
+    Running APIs pick the new version up through their index watcher or /admin/reload.
+    """
+    tmp = CURRENT_FILE + ".tmp"
+    with open(tmp, 'w') as f:
+        f.write(version)
+    os.replace(tmp, CURRENT_FILE)
+    print(f"Published index version {version}")
+
+    versions = sorted(v for v in os.listdir(VERSIONS_DIR) if v != version)
+    for old in versions[:max(0, len(versions) - (KEEP_VERSIONS - 1))]:
+        shutil.rmtree(os.path.join(VERSIONS_DIR, old), ignore_errors=True)
+
+def build_index(index_type=None, nlist=None, nprobe=None, ef_search=None, run_sweep=False, incremental=False,
+                versioned=False):
     print("Loading data...")
-    if not os.path.exists(INPUT_FILE):
-        print(f"Error: {INPUT_FILE} not found.")
+    input_file = catalogue_path()
+    if not os.path.exists(input_file):
+        print(f"Error: {input_file} not found.")
         return
 
-    df = pd.read_csv(INPUT_FILE)
+    df = load_catalogue(input_file)
     print(f"Loaded {len(df)} records.")
 
     # Create content for embedding
-    # Format: "Assessment: <Name>. Type: <Type>. Description: <Desc>"
     print("Preparing text chunks...")
-    chunks = df.apply(
-        lambda x: f"Assessment: {x['assessment_name']}. Type: {x['test_type']}. Description: {x['description']}", 
-        axis=1
-    ).tolist()
+    chunks = build_chunks(df)
+    hashes = chunk_hashes(chunks)
+    ids = assessment_ids(df)
 
-    print(f"Loading model {MODEL_NAME}...")
-    model = SentenceTransformer(MODEL_NAME)
+    # Previous build (if any) and where this one goes. Once a versioned build exists,
+    # every build is versioned so the live API never sees files being rewritten.
+    src = artifact_paths(resolve_index_dir())
+    versioned = versioned or os.path.exists(CURRENT_FILE)
+    version = new_version() if versioned else None
+    out_dir = os.path.join(VERSIONS_DIR, version) if versioned else INDEX_DIR
+    out = artifact_paths(out_dir)
 
-    print("Generating embeddings...")
-    # Normalize embeddings to use Inner Product for Cosine Similarity
-    embeddings = model.encode(chunks, show_progress_bar=True, normalize_embeddings=True)
-    embeddings = np.array(embeddings).astype('float32')
+    # The analyzer's training texts leave out the test type (its label); they share the embedding cache
+    texts = [analyzer_text(name, desc) for name, desc in zip(df['assessment_name'], df['description'])]
+    text_hashes = chunk_hashes(texts)
+
+    # A full build re-encodes everything; incremental reuses embeddings of unchanged chunks
+    cache = load_embedding_cache(src["embedding_cache"]) if incremental else {}
+    all_embeddings = embed_chunks(chunks + texts, hashes + text_hashes, cache)
+    embeddings, text_embeddings = all_embeddings[:len(chunks)], all_embeddings[len(chunks):]
 
     dimension = embeddings.shape[1]
     print(f"Embedding dimension: {dimension}")
 
-    print("Building FAISS index...")
-    # IndexFlatIP implements Inner Product (Cosine freq when normalized)
-    index = faiss.IndexFlatIP(dimension)
-    index.add(embeddings)
-    print(f"Index contains {index.ntotal} vectors.")
+    index = None
+    spec = None
+    if incremental:
+        config = None
+        if os.path.exists(src["config"]):
+            with open(src["config"]) as f:
+                config = json.load(f)
+        if config is not None and index_type not in (None, config["index_type"]):
+            # An explicit new type wins: full rebuild from the cached embeddings, with its own defaults
+            print(f"Index type {index_type} differs from the previous build's {config['index_type']}, rebuilding.")
+        else:
+            # The previous build's settings carry over, whether its index is updated in place or rebuilt
+            if config is not None:
+                index_type, spec = config["index_type"], config["factory"]
+                nprobe = nprobe if nprobe is not None else config.get("nprobe")
+                ef_search = ef_search if ef_search is not None else config.get("ef_search")
+            index = update_index(src, ids, hashes, embeddings)
+    index_type = index_type or "flat"
+
+    if index is None:
+        print(f"Building FAISS index ({spec or index_type})...")
+        # Inner Product on normalized vectors == Cosine similarity, for every index type.
+        # Vectors are keyed by stable assessment id so later runs can update them in place.
+        index, spec = build_ann_index(embeddings, index_type, ids=ids, factory=spec, nlist=nlist)
+    print(f"Index {spec} contains {index.ntotal} vectors.")
+
+    if run_sweep:
+        print("Sweeping index types (recall vs latency against Flat)...")
+        report = sweep(embeddings)
+        os.makedirs(os.path.dirname(SWEEP_FILE), exist_ok=True)
+        with open(SWEEP_FILE, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Sweep results saved to {SWEEP_FILE}")
 
     print("Saving index and metadata...")
-    os.makedirs(INDEX_DIR, exist_ok=True)
+    os.makedirs(out_dir, exist_ok=True)
     
-    faiss.write_index(index, INDEX_FILE)
+    faiss.write_index(index, out["index"])
+    save_embedding_cache(hashes + text_hashes, all_embeddings, out["embedding_cache"])
+
+    # Default search-time parameters picked up by SHLRetriever
+    with open(out["config"], 'w') as f:
+        json.dump({"index_type": index_type, "factory": spec, "nprobe": nprobe, "ef_search": ef_search}, f, indent=2)
     
     # Save metadata (the dataframe) so we can retrieve details by ID
-    with open(META_FILE, 'wb') as f:
+    df['chunk_hash'] = hashes
+    with open(out["meta"], 'wb') as f:
         pickle.dump(df, f)
 
+    # Columnar copy the retriever memory-maps
+    store = metadata_store(df, ids)
+    store.save(out["meta_store"])
+
+    # Offline query analyzer (vocabulary + K/P classifier over the type-free texts), loaded by the API as-is
+    print("Training local query analyzer...")
+    LocalQueryAnalyzer.train(store, text_embeddings).save(out["analyzer"])
+
+    # Sparse index over the same chunks, for hybrid retrieval
+    build_sparse_index(chunks, out["bm25"])
+
+    if versioned:
+        publish_version(version)
+
     print("Done.")
 
 if __name__ == "__main__":
-    build_index()
+    parser = argparse.ArgumentParser(description="Build the SHL assessment search index.")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=None,
+                        help="Default flat; with --incremental, the previous build's type unless given")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists (default ~4*sqrt(n))")
+    parser.add_argument("--nprobe", type=int, default=None, help="Default IVF lists probed per query")
+    parser.add_argument("--ef-search", type=int, default=None, help="Default HNSW efSearch")
+    parser.add_argument("--sweep", action="store_true", help="Report recall@10 and latency of every index type")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only embed new/changed rows and update the existing index in place")
+    parser.add_argument("--versioned", action="store_true",
+                        help="Write to data/indexes/versions/<timestamp> and publish it via data/indexes/CURRENT")
+    parser.add_argument("--export-onnx", action="store_true",
+                        help=f"Also export the query encoder to ONNX in {os.path.relpath(ENCODER_DIR, BASE_DIR)} for fast API startup")
+    parser.add_argument("--quantize", action="store_true", help="With --export-onnx, also write an int8-quantized encoder")
+    args = parser.parse_args()
+    build_index(args.index_type, args.nlist, args.nprobe, args.ef_search, args.sweep, args.incremental, args.versioned)
+    if args.export_onnx:
+        export_onnx(MODEL_NAME, ENCODER_DIR, quantize=args.quantize)
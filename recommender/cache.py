@@ -0,0 +1,134 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_SIZE = 1024
+DEFAULT_TTL = 24 * 60 * 60 # seconds
+PRUNE_INTERVAL = 256 # disk writes between purges of expired and least recently written rows
+
+
+def normalize_key(text):
+    """
+    Normalize free text for use as a cache key (case and whitespace insensitive).
+    """
+    return " ".join(str(text).lower().split())
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache with per-entry TTL.
+    If db_path is given, entries are also written to a SQLite table so they survive restarts.
+    The table is bounded like memory: every PRUNE_INTERVAL writes, expired rows are purged and
+    the oldest written rows beyond max_size dropped. Values must be JSON serializable then.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL, db_path=None, table="cache"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT, expires REAL)"
+            )
+            # Drop entries that expired while the process was down
+            self._prune_db()
+
+    def _expiry(self):
+        return time.time() + self.ttl if self.ttl else None
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, expires = json.loads(row[0]), row[1]
+                    if expires is None or expires > now:
+                        self._store(key, value, expires)
+                        self.hits += 1
+                        return value
+                    self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires = self._expiry()
+        with self._lock:
+            self._store(key, value, expires)
+            if self._db is not None:
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, expires) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires)
+                )
+                self._writes += 1
+                if self._writes % PRUNE_INTERVAL == 0:
+                    self._prune_db()
+                self._db.commit()
+
+    def _prune_db(self):
+        # REPLACE re-inserts a row, so rowid order is write order
+        self._db.execute(f"DELETE FROM {self.table} WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+        self._db.execute(
+            f"DELETE FROM {self.table} WHERE rowid IN (SELECT rowid FROM {self.table} ORDER BY rowid DESC "
+            f"LIMIT -1 OFFSET ?)",
+            (self.max_size,)
+        )
+        self._db.commit()
+
+    def _store(self, key, value, expires):
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            if self._db is not None:
+                self._db.execute(f"DELETE FROM {self.table}")
+                self._db.commit()
+
+    def __len__(self):
+        return len(self._data)
+
+    def items(self):
+        """
+        Live in-memory (key, value) pairs, least recently used first.
+        """
+        now = time.time()
+        with self._lock:
+            return [(k, v) for k, (v, expires) in self._data.items() if expires is None or expires > now]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
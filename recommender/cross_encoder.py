@@ -0,0 +1,149 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from recommender.cache import LRUCache, normalize_key
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+def query_hash(query):
+    return hashlib.sha1(normalize_key(query).encode("utf-8")).hexdigest()[:16]
+
+
+def candidate_text(cand):
+    return f"{cand['assessment_name']}. {cand.get('description') or ''}"
+
+
+class CrossEncoderReranker:
+    """
+    Re-scores the top candidates of a request with a cross-encoder, within a latency budget.
+    All uncached (query, candidate) pairs of a request go through one forward pass, and scores
+    are cached per (query hash, assessment URL). The number of candidates scored adapts to the
+    measured cost per pair, so a slow pass shrinks the next requests' N instead of blowing the budget.
+    """
+    def __init__(self, model, cache=None, budget_ms=50.0, max_candidates=20, min_candidates=3, smoothing=0.2):
+        self.model = model
+        self.cache = cache if cache is not None else LRUCache(max_size=50000, table="cross_encoder")
+        self.budget = budget_ms / 1000.0
+        self.max_candidates = max_candidates
+        self.min_candidates = min_candidates
+        self.smoothing = smoothing
+        # Seconds per scored pair: the latest slower pass, else a moving average of the faster ones
+        self.pair_cost = None
+        self.truncated = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Built from CROSS_ENCODER_* settings; None unless CROSS_ENCODER_MODEL is set ('default' picks DEFAULT_MODEL).
+        """
+        model_name = os.environ.get("CROSS_ENCODER_MODEL")
+        if not model_name:
+            return None
+        if model_name == "default":
+            model_name = DEFAULT_MODEL
+        from sentence_transformers import CrossEncoder
+        logger.info("Loading cross-encoder %s", model_name)
+        reranker = cls(
+            CrossEncoder(model_name, device="cpu"),
+            cache=LRUCache(max_size=int(os.environ.get("CROSS_ENCODER_CACHE_SIZE", 50000)), table="cross_encoder"),
+            budget_ms=float(os.environ.get("CROSS_ENCODER_BUDGET_MS", 50)),
+            max_candidates=int(os.environ.get("CROSS_ENCODER_TOP_N", 20))
+        )
+        reranker.warm_up()
+        return reranker
+
+    def warm_up(self):
+        # First pass pays for lazy initialization; the second one seeds the cost estimate
+        pairs = [("warm up", "warm up")] * self.max_candidates
+        self.model.predict(pairs[:1], show_progress_bar=False)
+        start = time.perf_counter()
+        self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        self.pair_cost = (time.perf_counter() - start) / len(pairs)
+
+    def top_n(self, budget=None):
+        """
+        How many uncached pairs fit in the budget (seconds, capped at the stage's own) at the current cost per pair.
+        """
+        budget = self.budget if budget is None else max(0.0, min(self.budget, budget))
+        if self.pair_cost is None:
+            return self.max_candidates
+        return min(self.max_candidates, int(budget / self.pair_cost))
+
+    def _observe(self, pairs, seconds):
+        cost = seconds / pairs
+        with self._lock:
+            # A slower pass cuts N right away; N grows back gradually as passes get faster
+            if self.pair_cost is None or cost > self.pair_cost:
+                self.pair_cost = cost
+            else:
+                self.pair_cost += self.smoothing * (cost - self.pair_cost)
+
+    def rerank(self, query, candidates, budget=None):
+        """
+        Reorders the head of the score-sorted candidates by cross-encoder score (stored as
+        'cross_score'). budget is the time the request has left; the stage uses at most that and
+        its own budget. Cached pairs are free and every uncached pair costs pair_cost (the unit it
+        is measured in), so the head is as long as the uncached pairs that fit allow.
+        The head keeps the original slots' final scores, best first, so the list stays sorted
+        for the later stages. Returns the candidate list.
+        """
+        prefix = query_hash(query)
+        head = candidates[:self.max_candidates]
+        keys = [f"{prefix}:{c.get('assessment_url') or c['assessment_name']}" for c in head]
+        scores = [self.cache.get(k) for k in keys]
+
+        affordable = self.top_n(budget)
+        n = uncached = 0
+        for score in scores:
+            if score is None:
+                if uncached == affordable:
+                    break
+                uncached += 1
+            n += 1
+
+        if n < self.min_candidates:
+            with self._lock:
+                self.skipped += 1
+                # No pass means no new measurement; let the estimate decay so the stage retries later
+                if self.pair_cost is not None:
+                    self.pair_cost *= 1 - self.smoothing
+            return candidates
+        if n < len(head):
+            with self._lock:
+                self.truncated += 1
+
+        head, keys, scores = head[:n], keys[:n], scores[:n]
+        missing = [i for i, s in enumerate(scores) if s is None]
+        if missing:
+            start = time.perf_counter()
+            fresh = self.model.predict(
+                [(query, candidate_text(head[i])) for i in missing], batch_size=len(missing), show_progress_bar=False
+            )
+            self._observe(len(missing), time.perf_counter() - start)
+            for i, score in zip(missing, fresh):
+                scores[i] = float(score)
+                self.cache.set(keys[i], scores[i])
+
+        slots = sorted((c['final_score'] for c in head), reverse=True)
+        order = sorted(range(n), key=lambda i: scores[i], reverse=True)
+        reranked = [head[i] for i in order]
+        for cand, i, slot in zip(reranked, order, slots):
+            cand['cross_score'] = scores[i]
+            cand['final_score'] = slot
+        return reranked + candidates[n:]
+
+    def stats(self):
+        return {
+            "pair_cost_ms": round(self.pair_cost * 1000, 3) if self.pair_cost is not None else None,
+            "top_n": self.top_n(),
+            "truncated": self.truncated,
+            "skipped": self.skipped,
+            "cache": self.cache.stats()
+        }
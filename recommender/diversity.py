@@ -0,0 +1,52 @@
+import numpy as np
+
+# Greedy MMR picks this many results per requested result; the tail keeps relevance order
+MMR_DEPTH_FACTOR = 3
+
+
+def mmr_order(relevance, similarity, lam, k=None):
+    """
+    Maximal marginal relevance ordering. Each step picks the candidate maximizing
+    lam * relevance - (1 - lam) * (max similarity to the already picked ones).
+    relevance is (..., n) and similarity (..., n, n); leading axes are batched (similarity
+    may omit axes that relevance has, e.g. one matrix per query shared by several weightings).
+    Only the first k positions are picked greedily, the rest follow in relevance order.
+    -inf relevance marks candidates that must come last. Returns (..., n) candidate indices.
+    """
+    relevance = np.asarray(relevance, dtype=np.float64)
+    n = relevance.shape[-1]
+    k = n if k is None else min(k, n)
+    batch = relevance.shape[:-1]
+    similarity = np.broadcast_to(similarity, batch + (n, n))
+    excluded = np.isneginf(relevance)
+    finite = np.where(excluded, 0.0, relevance)
+
+    selected = np.zeros(relevance.shape, dtype=bool)
+    penalty = np.zeros(relevance.shape)
+    order = np.empty(batch + (n,), dtype=np.int64)
+    for step in range(k):
+        score = np.where(excluded, -1e300, lam * finite - (1 - lam) * penalty)
+        score = np.where(selected, -np.inf, score)
+        # Ties (e.g. every candidate before the first pick when lam is 0) go to the more relevant one
+        tied = score == score.max(axis=-1, keepdims=True)
+        pick = np.where(tied, finite, -np.inf).argmax(axis=-1)
+        order[..., step] = pick
+        np.put_along_axis(selected, pick[..., None], True, axis=-1)
+        row = np.take_along_axis(similarity, np.broadcast_to(pick[..., None, None], batch + (1, n)), axis=-2)[..., 0, :]
+        penalty = row if step == 0 else np.maximum(penalty, row)
+
+    if k < n:
+        # Picked ones sort last, excluded ones just before them (in index order, as with a plain sort)
+        rest = np.argsort(np.where(selected, np.inf, np.where(excluded, 1e300, -finite)), axis=-1, kind="stable")
+        order[..., k:] = rest[..., :n - k]
+    return order
+
+
+def similarity_matrix(vectors):
+    """
+    Cosine similarity between every pair of rows, as one matrix product.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    vectors = vectors / np.where(norms > 0, norms, 1.0)
+    return vectors @ np.swapaxes(vectors, -1, -2)
@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+import numpy as np
+from recommender.cache import normalize_key
+
+logger = logging.getLogger(__name__)
+
+# Files of an exported encoder artifact (written by build_index.py --export-onnx)
+ONNX_FILE = "model.onnx"
+QUANTIZED_FILE = "model.int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+ENCODER_CONFIG_FILE = "encoder_config.json"
+
+# ENCODER_BACKEND values: 'auto' uses the ONNX artifact when it exists, 'onnx' requires it,
+# 'torch' always loads sentence-transformers
+ENCODER_BACKENDS = ("auto", "onnx", "torch")
+
+
+def export_onnx(model_name, out_dir, quantize=False, opset=17):
+    """
+    Exports the SentenceTransformer transformer + mean pooling to ONNX, with its fast tokenizer.
+    With quantize, also writes a dynamically int8-quantized copy of the graph.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer, pooling = st[0], st[1]
+    # Older sentence-transformers only expose the mode via get_pooling_mode_str()
+    pooling_mode = getattr(pooling, "pooling_mode", None) or pooling.get_pooling_mode_str()
+    if pooling_mode != "mean":
+        raise ValueError(f"Only mean pooling can be exported, {model_name} uses '{pooling_mode}'.")
+
+    class MeanPooled(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            hidden = self.model(input_ids=input_ids, attention_mask=attention_mask,
+                                token_type_ids=token_type_ids).last_hidden_state
+            mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+            return (hidden * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+
+    os.makedirs(out_dir, exist_ok=True)
+    transformer.tokenizer.save_pretrained(out_dir)
+
+    sample = transformer.tokenizer(["an example query", "a longer example sentence"], padding=True, return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    onnx_path = os.path.join(out_dir, ONNX_FILE)
+    print(f"Exporting {model_name} to {onnx_path}...")
+    torch.onnx.export(
+        MeanPooled(transformer.auto_model.eval()),
+        tuple(sample.get(name, torch.zeros_like(sample["input_ids"])) for name in input_names),
+        onnx_path,
+        input_names=input_names,
+        output_names=["sentence_embedding"],
+        dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in input_names},
+                      "sentence_embedding": {0: "batch"}},
+        opset_version=opset,
+        dynamo=False
+    )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        print("Quantizing encoder weights to int8...")
+        quantize_dynamic(onnx_path, os.path.join(out_dir, QUANTIZED_FILE), weight_type=QuantType.QInt8)
+
+    with open(os.path.join(out_dir, ENCODER_CONFIG_FILE), 'w') as f:
+        json.dump({
+            "model_name": model_name,
+            "dimension": transformer.auto_model.config.hidden_size,
+            "max_seq_length": st.max_seq_length,
+            "quantized": bool(quantize)
+        }, f, indent=2)
+
+
+def has_onnx_artifact(model_dir):
+    return all(os.path.exists(os.path.join(model_dir, f)) for f in (ONNX_FILE, TOKENIZER_FILE, ENCODER_CONFIG_FILE))
+
+
+class OnnxEncoder:
+    """
+    Drop-in for SentenceTransformer.encode() backed by ONNX Runtime and the Rust tokenizer.
+    Loads in well under a second and does not import torch.
+    """
+    def __init__(self, model_dir, quantized=False, num_threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, ENCODER_CONFIG_FILE)) as f:
+            self.config = json.load(f)
+
+        model_file = QUANTIZED_FILE if quantized and os.path.exists(os.path.join(model_dir, QUANTIZED_FILE)) else ONNX_FILE
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = int(num_threads)
+        self.session = ort.InferenceSession(os.path.join(model_dir, model_file), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.model_file = model_file
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.no_padding()
+
+    def get_sentence_embedding_dimension(self):
+        return self.config["dimension"]
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, show_progress_bar=False, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        embeddings = np.zeros((len(sentences), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        encodings = self.tokenizer.encode_batch(list(sentences))
+        # Length-sorted batches keep padding (and wasted compute) to a minimum
+        order = np.argsort([-len(e.ids) for e in encodings], kind="stable")
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            width = max(len(encodings[i].ids) for i in rows)
+            feed = {name: np.zeros((len(rows), width), dtype=np.int64) for name in self.input_names}
+            for j, i in enumerate(rows):
+                e = encodings[i]
+                n = len(e.ids)
+                feed["input_ids"][j, :n] = e.ids
+                feed["attention_mask"][j, :n] = e.attention_mask
+                if "token_type_ids" in feed:
+                    feed["token_type_ids"][j, :n] = e.type_ids
+            embeddings[rows] = self.session.run(None, feed)[0]
+
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings[0] if single else embeddings
+
+
+def load_encoder(model_name, model_dir=None, backend="auto", quantized=False):
+    """
+    Returns an object with SentenceTransformer's encode() API: the ONNX artifact in model_dir
+    when the backend allows it, otherwise sentence-transformers (imported only here).
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}'. Expected one of {ENCODER_BACKENDS}.")
+
+    if backend != "torch" and model_dir and has_onnx_artifact(model_dir):
+        try:
+            encoder = OnnxEncoder(model_dir, quantized=quantized)
+            logger.info("Loaded ONNX encoder %s from %s", encoder.model_file, model_dir)
+            return encoder
+        except ImportError as e:
+            if backend == "onnx":
+                raise
+            logger.warning("ONNX Runtime unavailable (%s), falling back to sentence-transformers.", e)
+    elif backend == "onnx":
+        raise FileNotFoundError(f"No ONNX encoder in {model_dir}. Run build_index.py --export-onnx first.")
+
+    from sentence_transformers import SentenceTransformer
+    logger.info("Loading model %s", model_name)
+    return SentenceTransformer(model_name)
+
+
+class CachedEncoder:
+    """
+    Wraps an encoder with an LRU cache of normalized query embeddings keyed on normalize_key(text),
+    so repeated and trivially different queries ("Java developer" / "java developer ") skip the forward pass.
+    Only normalize_embeddings=True calls are cached; anything else goes straight to the encoder.
+    """
+    def __init__(self, encoder, cache, model_name=None):
+        self.encoder = encoder
+        self.cache = cache
+        self.model_name = model_name
+
+    def get_sentence_embedding_dimension(self):
+        return self.encoder.get_sentence_embedding_dimension()
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, **kwargs):
+        if not normalize_embeddings:
+            return self.encoder.encode(sentences, batch_size=batch_size, normalize_embeddings=False, **kwargs)
+
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        keys = [normalize_key(s) for s in sentences]
+
+        vectors = [self.cache.get(k) for k in keys]
+        # Each distinct missing key is encoded once
+        missing = list(dict.fromkeys(k for k, v in zip(keys, vectors) if v is None))
+        if missing:
+            encoded = np.asarray(
+                self.encoder.encode(missing, batch_size=batch_size, normalize_embeddings=True, **kwargs),
+                dtype=np.float32
+            )
+            fresh = dict(zip(missing, encoded))
+            for k, v in fresh.items():
+                self.cache.set(k, v)
+            vectors = [fresh[k] if v is None else v for k, v in zip(keys, vectors)]
+
+        embeddings = np.vstack(vectors) if vectors else np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+    def stats(self):
+        return self.cache.stats()
+
+    def save_warm_set(self, path, limit=None):
+        """
+        Persists the most recently used embeddings so the next process starts warm.
+        """
+        entries = self.cache.items()[-limit:] if limit else self.cache.items()
+        if not entries:
+            return 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        keys, vectors = zip(*entries)
+        np.savez(path, keys=np.array(keys), vectors=np.vstack(vectors), model_name=np.array(self.model_name or ""))
+        return len(entries)
+
+    def load_warm_set(self, path):
+        """
+        Loads a warm set written by save_warm_set. Sets from a different model are ignored.
+        """
+        if not path or not os.path.exists(path):
+            return 0
+        data = np.load(path, allow_pickle=False)
+        if str(data['model_name']) != (self.model_name or ""):
+            logger.warning("Ignoring query embedding warm set %s: built with another model.", path)
+            return 0
+        for k, v in zip(data['keys'].tolist(), data['vectors']):
+            self.cache.set(k, v)
+        return len(data['keys'])
@@ -0,0 +1,245 @@
+import json
+import time
+import numpy as np
+import faiss
+
+# Supported index types and the FAISS factory string each one maps to.
+# All indexes use inner product on normalized vectors (cosine similarity).
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq", "opq_ivf_pq", "sq8", "ivf_sq8")
+
+DEFAULT_HNSW_M = 32
+DEFAULT_PQ_M = 48 # 384 / 48 = 8 dims per sub-quantizer for MiniLM
+MIN_POINTS_PER_CENTROID = 39 # FAISS k-means warns below this
+MAX_TRAIN_POINTS = 100000 # Quantizers are trained on a random sample of large corpora
+
+
+def default_nlist(num_vectors):
+    """
+    Rule of thumb: ~4 * sqrt(n) inverted lists, capped so every centroid has enough training points.
+    """
+    nlist = int(4 * np.sqrt(max(num_vectors, 1)))
+    return max(1, min(nlist, num_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def default_pq_nbits(num_vectors):
+    # 8 bits needs 256 * 39 training points; small corpora get smaller codebooks
+    for nbits in (8, 7, 6, 5, 4):
+        if num_vectors >= (1 << nbits) * MIN_POINTS_PER_CENTROID:
+            return nbits
+    return 4
+
+
+def factory_string(index_type, dim, num_vectors, nlist=None, hnsw_m=DEFAULT_HNSW_M, pq_m=DEFAULT_PQ_M, pq_nbits=None):
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Expected one of {INDEX_TYPES}.")
+    if "pq" in index_type and dim % pq_m != 0:
+        raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dim}.")
+
+    nlist = nlist or default_nlist(num_vectors)
+    pq_nbits = pq_nbits or default_pq_nbits(num_vectors)
+
+    return {
+        "flat": "Flat",
+        "ivf_flat": f"IVF{nlist},Flat",
+        "hnsw": f"HNSW{hnsw_m},Flat",
+        "ivf_pq": f"IVF{nlist},PQ{pq_m}x{pq_nbits}",
+        "opq_ivf_pq": f"OPQ{pq_m},IVF{nlist},PQ{pq_m}x{pq_nbits}",
+        "sq8": "SQ8",
+        "ivf_sq8": f"IVF{nlist},SQ8",
+    }[index_type]
+
+
+def build_ann_index(embeddings, index_type="flat", ids=None, max_train_points=MAX_TRAIN_POINTS, factory=None,
+                    **params):
+    """
+    Creates, trains (when needed) and fills an index of the given type.
+    With ids, vectors are keyed by those stable ids instead of their row position
+    (IVF indexes store ids natively, the others are wrapped in IndexIDMap2).
+    An explicit factory string (e.g. the one a previous build recorded) is used as-is.
+    Returns (index, factory_string).
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    num_vectors, dim = embeddings.shape
+    spec = factory or factory_string(index_type, dim, num_vectors, **params)
+    if ids is not None and "IVF" not in spec and not spec.startswith("IDMap"):
+        spec = "IDMap2," + spec
+
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        train = embeddings
+        if num_vectors > max_train_points:
+            sample = np.random.default_rng(0).choice(num_vectors, size=max_train_points, replace=False)
+            train = embeddings[np.sort(sample)]
+        print(f"Training {spec} on {len(train)} vectors...")
+        index.train(train)
+    if ids is None:
+        index.add(embeddings)
+    else:
+        index.add_with_ids(embeddings, np.asarray(ids, dtype=np.int64))
+    return index, spec
+
+
+def _unwrap(index):
+    """
+    Strips IDMap / PreTransform wrappers. Returns (inner_index, is_pretransform).
+    """
+    inner = faiss.downcast_index(index)
+    pretransform = False
+    while isinstance(inner, (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexPreTransform)):
+        pretransform = pretransform or isinstance(inner, faiss.IndexPreTransform)
+        inner = faiss.downcast_index(inner.index)
+    return inner, pretransform
+
+
+def is_id_mapped(index):
+    """
+    True when search results are stable ids rather than row positions.
+    """
+    outer = faiss.downcast_index(index)
+    if isinstance(outer, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return True
+    inner, _ = _unwrap(index)
+    if isinstance(inner, faiss.IndexIVF) and inner.ntotal:
+        # IVF keeps the ids it was given; sequential 0..n-1 means positional
+        return not np.array_equal(_ivf_ids(inner), np.arange(inner.ntotal))
+    return False
+
+
+def _ivf_ids(ivf):
+    invlists = ivf.invlists
+    ids = [faiss.rev_swig_ptr(invlists.get_ids(l), invlists.list_size(l)).copy() for l in range(ivf.nlist)]
+    return np.sort(np.concatenate(ids)) if ids else np.array([], dtype=np.int64)
+
+
+def flat_vectors(index):
+    """
+    Zero-copy (ntotal, d) view of the vectors stored in a Flat index (optionally IDMap-wrapped),
+    and the label at each position (None for positional indexes). Returns (None, None) for other
+    index types, which have to go through reconstruct.
+    """
+    outer = faiss.downcast_index(index)
+    labels = None
+    if isinstance(outer, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        labels = faiss.vector_to_array(outer.id_map)
+        outer = faiss.downcast_index(outer.index)
+    if not isinstance(outer, faiss.IndexFlat) or outer.ntotal == 0:
+        return None, None
+    vectors = faiss.rev_swig_ptr(outer.get_xb(), outer.ntotal * outer.d)
+    return vectors.reshape(outer.ntotal, outer.d), labels
+
+
+def enable_reconstruct(index):
+    """
+    IVF indexes need a direct map before reconstruct() works.
+    An array map covers sequential ids, a hashtable covers stable (sparse) ids.
+    """
+    inner, _ = _unwrap(index)
+    if not isinstance(inner, faiss.IndexIVF):
+        return
+    try:
+        inner.make_direct_map()
+    except RuntimeError:
+        inner.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+
+def search_params(index, nprobe=None, ef_search=None, sel=None):
+    """
+    Per-call FAISS SearchParameters (thread-safe, unlike setting nprobe on the shared index).
+    sel is an IDSelector restricting the search to some labels (ids for id-mapped indexes).
+    Returns None when no parameter applies to this index.
+    """
+    inner, wrapped = _unwrap(index)
+
+    params = None
+    if isinstance(inner, faiss.IndexIVF) and (nprobe is not None or sel is not None):
+        params = faiss.SearchParametersIVF(sel=sel) if sel is not None else faiss.SearchParametersIVF()
+        # SearchParameters default to nprobe=1, not the index's own setting
+        params.nprobe = int(nprobe) if nprobe is not None else inner.nprobe
+    elif isinstance(inner, faiss.IndexHNSW) and (ef_search is not None or sel is not None):
+        params = faiss.SearchParametersHNSW(sel=sel) if sel is not None else faiss.SearchParametersHNSW()
+        params.efSearch = int(ef_search) if ef_search is not None else inner.hnsw.efSearch
+    elif sel is not None:
+        params = faiss.SearchParameters(sel=sel)
+
+    if params is not None and wrapped:
+        params = faiss.SearchParametersPreTransform(index_params=params)
+    return params
+
+
+def exhaustive_params(index, sel, selected, ef_search=None):
+    """
+    SearchParameters that make a filtered search cover the selected labels when the normal
+    ones came back short: IVF probes every list, HNSW widens efSearch by the inverse of the
+    filter's selectivity (up to the whole graph). Other index types already scan every vector.
+    """
+    inner, _ = _unwrap(index)
+    if isinstance(inner, faiss.IndexIVF):
+        return search_params(index, nprobe=inner.nlist, sel=sel)
+    if isinstance(inner, faiss.IndexHNSW):
+        base = ef_search if ef_search is not None else inner.hnsw.efSearch
+        widened = min(inner.ntotal, int(base * inner.ntotal / max(selected, 1)))
+        return search_params(index, ef_search=max(base, widened), sel=sel)
+    return search_params(index, sel=sel)
+
+
+def sample_queries(embeddings, num_queries=200, noise=0.05, seed=0):
+    """
+    Synthetic queries: perturbed copies of random corpus vectors, re-normalized.
+    """
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(len(embeddings), size=min(num_queries, len(embeddings)), replace=False)
+    queries = embeddings[ids] + noise * rng.standard_normal((len(ids), embeddings.shape[1])).astype(np.float32)
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def _recall(ground_truth, retrieved):
+    k = ground_truth.shape[1]
+    hits = [len(set(gt) & set(rt[rt != -1])) for gt, rt in zip(ground_truth, retrieved)]
+    return float(np.sum(hits)) / (len(ground_truth) * k)
+
+
+def sweep(embeddings, queries=None, k=10, index_types=INDEX_TYPES, nprobes=(1, 4, 16, 64), ef_searches=(16, 64, 256)):
+    """
+    Builds each index type and reports recall@k against the exact Flat baseline
+    plus mean search latency per query for every nprobe / efSearch setting.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if queries is None:
+        queries = sample_queries(embeddings)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    k = min(k, len(embeddings))
+
+    flat, _ = build_ann_index(embeddings, "flat")
+    _, ground_truth = flat.search(queries, k)
+
+    report = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index, spec = build_ann_index(embeddings, index_type)
+        build_s = time.perf_counter() - start
+
+        settings = [{}]
+        if "IVF" in spec:
+            settings = [{"nprobe": n} for n in nprobes]
+        elif "HNSW" in spec:
+            settings = [{"ef_search": e} for e in ef_searches]
+
+        for setting in settings:
+            params = search_params(index, **setting)
+            start = time.perf_counter()
+            _, retrieved = index.search(queries, k, params=params)
+            latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+            row = {
+                "index_type": index_type,
+                "factory": spec,
+                **setting,
+                f"recall@{k}": _recall(ground_truth, retrieved),
+                "latency_ms_per_query": latency_ms,
+                "build_s": build_s
+            }
+            report.append(row)
+            print(json.dumps(row))
+
+    return report
@@ -0,0 +1,205 @@
+import os
+import re
+import time
+import numpy as np
+from collections import Counter
+from typing import Dict, Any
+
+# Words that never count as skills on their own
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "in", "is", "it",
+    "its", "of", "on", "or", "that", "the", "their", "this", "to", "was", "were", "will", "with",
+    "who", "what", "which", "need", "needs", "want", "looking", "seeking", "hire", "hiring", "role",
+    "position", "job", "candidate", "candidates", "test", "tests", "assessment", "assessments",
+    "solution", "new", "short", "form", "level", "i", "we", "our", "you", "your", "can", "good",
+    "strong", "skills", "skill", "also", "these", "those", "may", "such", "include", "includes",
+    "used", "using", "based", "other", "not", "but", "all", "any", "more", "most", "one", "two",
+}
+
+# Intent cues that decide the test type without the classifier
+K_CUES = {
+    "coding", "programming", "developer", "engineer", "technical", "aptitude", "knowledge",
+    "numerical", "verbal", "reasoning", "cognitive", "ability", "simulation", "excel", "sql",
+}
+P_CUES = {
+    "personality", "behavior", "behaviour", "behavioral", "behavioural", "culture", "leadership",
+    "leading", "teamwork", "collaboration", "communication", "motivation", "traits", "values",
+    "interpersonal", "attitude", "integrity", "soft",
+}
+
+TOKEN_RE = re.compile(r"[a-z0-9+#.]+")
+NAME_NOISE_RE = re.compile(r"\([^)]*\)|\b\d+(?:\.\d+)*\b|[_/]")
+
+MAX_NGRAM = 3
+# Builds without a saved analyzer are fitted on at most this many rows, encoded at load time
+MAX_TRAIN_ROWS = 5000
+
+
+def tokenize(text):
+    return [t.strip(".") for t in TOKEN_RE.findall(str(text).lower()) if t.strip(".")]
+
+
+def analyzer_text(name, description):
+    """
+    Classifier training text for an assessment. Unlike the index chunks it leaves out the
+    test type, which is the label: with it the classifier learns to read "Type: P" back.
+    """
+    return f"Assessment: {name}. Description: {description}"
+
+
+class LocalQueryAnalyzer:
+    """
+    Network-free replacement for the Gemini analysis.
+    Skills are matched against a vocabulary built from the catalogue, and K vs P is predicted
+    by a logistic regression trained on the catalogue's own test_type labels over embeddings of analyzer_text().
+    build_index.py trains it and saves it next to the index, so the API only loads it.
+    """
+    def __init__(self, vocabulary, weights, bias, encode, p_threshold=0.65, k_threshold=0.35):
+        self.vocabulary = vocabulary
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+        self.encode = encode
+        self.p_threshold = p_threshold
+        self.k_threshold = k_threshold
+
+    @classmethod
+    def train(cls, metadata, embeddings, encode=None, rows=None, **thresholds):
+        """
+        Builds the vocabulary from the catalogue and fits the classifier on embeddings, the
+        analyzer_text() vectors of the given metadata rows (default: every row, in order).
+        """
+        test_types = metadata.column('test_type') if rows is None else metadata.gather('test_type', rows)
+        labels = np.array([str(t).strip().upper() == 'P' for t in test_types], dtype=np.float32)
+        weights, bias = cls._fit_classifier(np.asarray(embeddings, dtype=np.float32), labels)
+        return cls(cls._build_vocabulary(metadata), weights, bias, encode, **thresholds)
+
+    @classmethod
+    def load(cls, path, encode, **thresholds):
+        data = np.load(path, allow_pickle=False)
+        return cls(set(data['vocabulary'].tolist()), data['weights'], float(data['bias']), encode, **thresholds)
+
+    @classmethod
+    def for_retriever(cls, retriever, **thresholds):
+        """
+        The analyzer saved with the retriever's index build. Builds from before it was saved
+        are fitted on a bounded random sample of their rows, encoded here (the index vectors
+        embed the test type, see analyzer_text()).
+        """
+        path = getattr(retriever, "analyzer_path", None)
+        if path and os.path.exists(path):
+            return cls.load(path, retriever.model.encode, **thresholds)
+        metadata = retriever.metadata
+        num_rows = len(metadata)
+        rows = np.arange(num_rows)
+        if num_rows > MAX_TRAIN_ROWS:
+            rows = np.sort(np.random.default_rng(0).choice(num_rows, size=MAX_TRAIN_ROWS, replace=False))
+        texts = [analyzer_text(name, desc) for name, desc in
+                 zip(metadata.gather('assessment_name', rows), metadata.gather('description', rows))]
+        # Unnormalized calls bypass the query embedding cache, so catalogue texts do not evict queries
+        embeddings = np.asarray(retriever.model.encode(texts, batch_size=64), dtype=np.float32)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return cls.train(metadata, embeddings, retriever.model.encode, rows=rows, **thresholds)
+
+    def save(self, path):
+        np.savez(path, vocabulary=np.array(sorted(self.vocabulary), dtype=str), weights=self.weights,
+                 bias=np.float32(self.bias))
+
+    @staticmethod
+    def _build_vocabulary(metadata):
+        vocab = set()
+
+        # Phrases from assessment names, e.g. "SAP ABAP (Advanced Level) (New)" -> "sap abap", "sap", "abap"
+        for name in metadata.column('assessment_name'):
+            for part in re.split(r"\s+-\s+|:|,", NAME_NOISE_RE.sub(" ", name)):
+                tokens = [t for t in tokenize(part) if t not in STOPWORDS]
+                for n in range(1, min(MAX_NGRAM, len(tokens)) + 1):
+                    for i in range(len(tokens) - n + 1):
+                        vocab.add(" ".join(tokens[i:i + n]))
+
+        # Informative description words: shared by a few documents but not generic
+        doc_freq = Counter()
+        for desc in metadata.column('description'):
+            doc_freq.update(set(tokenize(desc)))
+        max_df = max(2, int(0.05 * len(metadata)))
+        for token, df in doc_freq.items():
+            if 2 <= df <= max_df and token not in STOPWORDS and len(token) > 2 and not token.isdigit():
+                vocab.add(token)
+
+        return vocab
+
+    @staticmethod
+    def _fit_classifier(X, y, epochs=300, lr=0.5, l2=1e-3):
+        """
+        Class-balanced logistic regression fitted with full-batch gradient descent.
+        """
+        n, dim = X.shape
+        pos = max(y.sum(), 1.0)
+        neg = max(n - y.sum(), 1.0)
+        sample_weight = np.where(y == 1, n / (2 * pos), n / (2 * neg)).astype(np.float32)
+
+        w = np.zeros(dim, dtype=np.float32)
+        b = 0.0
+        for _ in range(epochs):
+            p = 1.0 / (1.0 + np.exp(-(X @ w + b)))
+            err = (p - y) * sample_weight
+            w -= lr * (X.T @ err / n + l2 * w)
+            b -= lr * float(err.mean())
+        return w, b
+
+    def extract_skills(self, query):
+        """
+        Greedy longest-match of query n-grams against the catalogue vocabulary.
+        """
+        tokens = tokenize(query)
+        skills = []
+        i = 0
+        while i < len(tokens):
+            for n in range(min(MAX_NGRAM, len(tokens) - i), 0, -1):
+                phrase = " ".join(tokens[i:i + n])
+                if phrase in self.vocabulary and phrase not in STOPWORDS:
+                    skills.append(phrase)
+                    i += n
+                    break
+            else:
+                i += 1
+        return list(dict.fromkeys(skills))
+
+    def predict_p(self, query_vector):
+        """
+        Probability that the query targets a Personality (P) rather than Knowledge (K) test.
+        """
+        return float(1.0 / (1.0 + np.exp(-(np.dot(query_vector, self.weights) + self.bias))))
+
+    def analyze(self, query: str) -> Dict[str, Any]:
+        """
+        Same output schema as QueryProcessor.analyze, plus a 'confidence' in [0, 1].
+        """
+        start = time.perf_counter()
+        skills = self.extract_skills(query)
+
+        tokens = set(tokenize(query))
+        has_k = bool(tokens & K_CUES)
+        has_p = bool(tokens & P_CUES)
+
+        if has_k or has_p:
+            # Explicit cues are trusted over the classifier
+            types = [t for t, hit in (('K', has_k), ('P', has_p)) if hit]
+            confidence = 1.0
+        else:
+            query_vector = np.asarray(self.encode([query], normalize_embeddings=True), dtype=np.float32)[0]
+            p = self.predict_p(query_vector)
+            if p >= self.p_threshold:
+                types = ['P']
+            elif p <= self.k_threshold:
+                types = ['K']
+            else:
+                types = ['K', 'P']
+            confidence = abs(p - 0.5) * 2
+
+        return {
+            "skills": skills,
+            "required_test_types": types,
+            "confidence": confidence,
+            "source": "local",
+            "latency_ms": (time.perf_counter() - start) * 1000
+        }
@@ -0,0 +1,109 @@
+import json
+import os
+import numpy as np
+
+MANIFEST_FILE = "manifest.json"
+
+
+def _encode_column(values):
+    """
+    Packs a column of strings into one UTF-8 byte buffer plus int64 offsets (Arrow-style).
+    """
+    encoded = [("" if v is None or (isinstance(v, float) and np.isnan(v)) else str(v)).encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return data, offsets
+
+
+class MetadataStore:
+    """
+    Columnar assessment metadata: each string column is a byte buffer plus an offsets array.
+    Saved as plain .npy files so worker processes can memory-map and share the same pages,
+    and rows are fetched by gathering offsets for an index array instead of DataFrame.iloc.
+    Fixed-width per-row values (e.g. type masks) are kept as plain arrays next to the string columns.
+    """
+    def __init__(self, columns, num_rows, ids=None, arrays=None):
+        # columns: name -> (data uint8 array, offsets int64 array)
+        self._columns = columns
+        self.num_rows = num_rows
+        # Optional stable assessment id per row (the keys of an id-mapped FAISS index)
+        self.ids = ids
+        # name -> numpy array with one entry per row
+        self.arrays = arrays or {}
+
+    @classmethod
+    def from_frame(cls, df, ids=None, arrays=None):
+        columns = {name: _encode_column(df[name].tolist()) for name in df.columns}
+        arrays = {name: np.asarray(values) for name, values in (arrays or {}).items()}
+        return cls(columns, len(df), None if ids is None else np.asarray(ids, dtype=np.int64), arrays)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name, (data, offsets) in self._columns.items():
+            np.save(os.path.join(path, f"{name}.data.npy"), data)
+            np.save(os.path.join(path, f"{name}.offsets.npy"), offsets)
+        if self.ids is not None:
+            np.save(os.path.join(path, "ids.npy"), self.ids)
+        for name, values in self.arrays.items():
+            np.save(os.path.join(path, f"{name}.array.npy"), values)
+        with open(os.path.join(path, MANIFEST_FILE), 'w') as f:
+            json.dump({
+                "columns": list(self._columns),
+                "arrays": list(self.arrays),
+                "num_rows": self.num_rows,
+                "has_ids": self.ids is not None
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        mode = 'r' if mmap else None
+        columns = {}
+        for name in manifest["columns"]:
+            data = np.load(os.path.join(path, f"{name}.data.npy"), mmap_mode=mode)
+            offsets = np.load(os.path.join(path, f"{name}.offsets.npy"), mmap_mode=mode)
+            columns[name] = (data, offsets)
+        ids = np.load(os.path.join(path, "ids.npy"), mmap_mode=mode) if manifest.get("has_ids") else None
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.array.npy"), mmap_mode=mode)
+            for name in manifest.get("arrays", [])
+        }
+        return cls(columns, manifest["num_rows"], ids, arrays)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def __len__(self):
+        return self.num_rows
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def gather(self, name, indices):
+        """
+        Values of one column for an array of row indices. Missing columns yield empty strings.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if name not in self._columns:
+            return [""] * len(indices)
+        data, offsets = self._columns[name]
+        starts = offsets[indices]
+        ends = offsets[indices + 1]
+        return [data[s:e].tobytes().decode("utf-8") for s, e in zip(starts.tolist(), ends.tolist())]
+
+    def column(self, name):
+        """
+        Every value of a column, in row order.
+        """
+        return self.gather(name, np.arange(self.num_rows))
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame({name: self.column(name) for name in self._columns})
@@ -0,0 +1,107 @@
+import threading
+
+# Latency buckets in seconds, from sub-millisecond FAISS searches to slow Gemini calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+class Histogram:
+    """
+    Prometheus-style cumulative histogram with a single label (e.g. stage).
+    """
+    def __init__(self, name, documentation, label_name=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {} # label value -> [bucket counts..., sum, count]
+
+    def observe(self, label, value=None):
+        # Unlabelled histograms are called as observe(value)
+        if self.label_name is None:
+            label, value = None, label
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items(), key=lambda kv: str(kv[0]))
+            items = [(label, list(series)) for label, series in items]
+        for label, series in items:
+            base = {self.label_name: label} if self.label_name else {}
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels({**base, 'le': bound})} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels({**base, 'le': '+Inf'})} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(base)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(base)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """
+    Value read from a callback at scrape time. The callback returns a number,
+    a {label value: number} dict (with label_name set), or None to skip.
+    Use metric_type="counter" for monotonically increasing totals kept elsewhere.
+    """
+    def __init__(self, name, documentation, fn, label_name=None, metric_type="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.label_name = label_name
+        self.metric_type = metric_type
+
+    def render(self):
+        value = self.fn()
+        if value is None:
+            return []
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        if self.label_name:
+            for label, v in value.items():
+                if v is not None:
+                    lines.append(f"{self.name}{_format_labels({self.label_name: label})} {v}")
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "shl_stage_duration_seconds", "Time spent in each recommendation stage.", label_name="stage"
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "shl_request_duration_seconds", "End-to-end API request latency.", label_name="endpoint"
+))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    "shl_micro_batch_size", "Queries per micro-batched search.", buckets=BATCH_SIZE_BUCKETS
+))
@@ -1,26 +1,132 @@
 import os
 import json
-import google.generativeai as genai
+import logging
+import threading
 from typing import Dict, List, Any
+from recommender.cache import LRUCache, normalize_key
+
+logger = logging.getLogger(__name__)
+
+# Analyzer modes: 'gemini' always asks the LLM, 'local' never leaves the process,
+# 'auto' uses the local analyzer when it is confident and Gemini otherwise.
+ANALYZER_MODES = ("gemini", "local", "auto")
 
 class QueryProcessor:
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, cache: LRUCache = None, local_analyzer=None,
+                 mode: str = "gemini", confidence_threshold: float = 0.8,
+                 max_concurrent_llm: int = 4, llm_wait: float = 1.0):
+        # Optional cache of analysis results keyed on the normalized query
+        self.cache = cache
+        self.local_analyzer = local_analyzer
+        if mode not in ANALYZER_MODES:
+            raise ValueError(f"Unknown analyzer mode '{mode}'. Expected one of {ANALYZER_MODES}.")
+        self.mode = mode
+        self.confidence_threshold = confidence_threshold
         self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
         if not self.api_key:
             # We don't raise here to allow instantiation, but methods will fail or warn
-            print("WARNING: GEMINI_API_KEY not found in environment variables.")
-        else:
-            genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-2.5-flash')
+            logger.warning("GEMINI_API_KEY not found in environment variables.")
+        # The Gemini SDK is slow to import, so the client is created on first use (or by warm_up)
+        self._model = None
+        self._model_lock = threading.Lock()
+
+        # At most max_concurrent_llm Gemini calls in flight. A caller that cannot get a slot
+        # within llm_wait seconds is served a degraded analysis instead of queueing on the API.
+        self.max_concurrent_llm = max_concurrent_llm
+        self.llm_wait = llm_wait
+        self._llm_slots = threading.BoundedSemaphore(max_concurrent_llm)
+        self._llm_lock = threading.Lock()
+        self.llm_in_flight = 0
+        self.llm_saturated = 0
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel('gemini-2.5-flash')
+        return self._model
+
+    def warm_up(self):
+        """
+        Imports and configures the Gemini client ahead of the first request.
+        """
+        if self.api_key:
+            return self.model
 
-    def analyze(self, query: str) -> Dict[str, Any]:
+    def analyze(self, query: str, mode: str = None) -> Dict[str, Any]:
         """
         Analyzes the query to extract skills and required test types.
         Returns a dictionary with 'skills' and 'required_test_types'.
+        mode overrides the processor's default analyzer mode for this call.
         """
+        mode = mode or self.mode
+        if mode not in ANALYZER_MODES:
+            raise ValueError(f"Unknown analyzer mode '{mode}'. Expected one of {ANALYZER_MODES}.")
+
+        if mode == "local":
+            # 'local' promises no network call, so there is no Gemini fallback
+            if self.local_analyzer is None:
+                raise ValueError("Analyzer mode 'local' needs a local analyzer.")
+            return self.local_analyzer.analyze(query)
+
+        if self.cache is not None:
+            key = normalize_key(query)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return dict(cached)
+
+        if self.local_analyzer is not None:
+            # Confidence-gated fast path, and the offline answer when there is no API key
+            if mode == "auto" or not self.api_key:
+                local = self.local_analyzer.analyze(query)
+                if not self.api_key or local["confidence"] >= self.confidence_threshold:
+                    return local
+
         if not self.api_key:
             return {"error": "API key missing", "skills": [], "required_test_types": ["K", "P"]}
 
+        result = self._analyze_with_llm(query)
+
+        # Only cache successful analyses so transient errors are retried
+        if self.cache is not None and not result.get("fallback"):
+            self.cache.set(key, result)
+        return result
+
+    def llm_stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrent_llm,
+            "in_flight": self.llm_in_flight,
+            "saturated": self.llm_saturated
+        }
+
+    def _degraded(self, query: str) -> Dict[str, Any]:
+        """
+        Answer used when no Gemini slot is free: the local analysis when available, else the fallback.
+        Marked as fallback either way so it is not cached.
+        """
+        if self.local_analyzer is not None:
+            return dict(self.local_analyzer.analyze(query), fallback=True)
+        return self.fallback(query)
+
+    def _analyze_with_llm(self, query: str) -> Dict[str, Any]:
+        if not self._llm_slots.acquire(timeout=self.llm_wait):
+            with self._llm_lock:
+                self.llm_saturated += 1
+            logger.warning("All %d Gemini slots busy, using degraded analysis.", self.max_concurrent_llm)
+            return self._degraded(query)
+        with self._llm_lock:
+            self.llm_in_flight += 1
+        try:
+            return self._call_llm(query)
+        finally:
+            with self._llm_lock:
+                self.llm_in_flight -= 1
+            self._llm_slots.release()
+
+    def _call_llm(self, query: str) -> Dict[str, Any]:
         prompt = f"""
         You are a data extraction assistant for an assessment catalogue.
         Analyze the following user query to determine:
@@ -68,12 +174,19 @@ class QueryProcessor:
             }
             
         except Exception as e:
-            print(f"Error analyzing query: {e}")
-            # Fallback
-            return {
-                "skills": [query], 
-                "required_test_types": ["K", "P"]
-            }
+            logger.error("Error analyzing query: %s", e)
+            return self.fallback(query)
+
+    @staticmethod
+    def fallback(query: str) -> Dict[str, Any]:
+        """
+        Degraded analysis used when Gemini fails or is too slow: no skill extraction, both test types.
+        """
+        return {
+            "skills": [query], 
+            "required_test_types": ["K", "P"],
+            "fallback": True
+        }
 
 if __name__ == "__main__":
     # Test
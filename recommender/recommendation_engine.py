@@ -1,67 +1,413 @@
-import re
+import json
+import logging
 import os
+import threading
+import time
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from recommender.batching import MicroBatcher
+from recommender.cache import LRUCache
+from recommender.cross_encoder import CrossEncoderReranker
+from recommender.diversity import MMR_DEPTH_FACTOR, mmr_order, similarity_matrix
+from recommender.local_analyzer import LocalQueryAnalyzer
+from recommender.metrics import BATCH_SIZE, STAGE_SECONDS
 from recommender.query_processor import QueryProcessor
-from recommender.search_service import SHLRetriever
+from recommender.search_service import BASE_DIR, VERSIONS_DIR, SHLRetriever, current_version
+from recommender.timing import PhaseTimer
+
+logger = logging.getLogger(__name__)
+
+# Re-ranking settings chosen offline by tune.py; RERANK_CONFIG points elsewhere
+RERANK_CONFIG_FILE = os.path.join(BASE_DIR, "data", "rerank_config.json")
+# require_types: top K and top P first when both are needed, otherwise only the needed type
+# filter: only the needed type when just one is needed, plain score order when both are
+# none: plain score order
+BALANCE_POLICIES = ("require_types", "filter", "none")
+# mmr_lambda trades relevance (1.0, MMR off) against similarity to the results ranked above
+DEFAULT_RERANK_CONFIG = {"vector_weight": 0.7, "pool_size": 20, "balance": "require_types", "mmr_lambda": 1.0}
+
+def load_rerank_config(path=None):
+    """
+    Defaults overlaid with the saved config, if there is one. The skill weight is 1 - vector_weight.
+    """
+    path = path or os.environ.get("RERANK_CONFIG", RERANK_CONFIG_FILE)
+    config = dict(DEFAULT_RERANK_CONFIG)
+    if os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+        config.update({k: saved[k] for k in DEFAULT_RERANK_CONFIG if k in saved})
+        logger.info("Loaded re-ranking config from %s: %s", path, config)
+    if config["balance"] not in BALANCE_POLICIES:
+        raise ValueError(f"Unknown balance policy {config['balance']!r}; expected one of {BALANCE_POLICIES}")
+    return config
 
 class RecommendationEngine:
-    def __init__(self):
+    def __init__(self, analysis_cache=None, analysis_timeout=None, analysis_workers=None, analyzer_mode=None,
+                 retriever=None, processor=None):
+        """
+        retriever and processor replace the default components (e.g. a synthetic index or a stub
+        analyzer for benchmarks); by default both are built from the live index and the environment.
+        """
+        self.startup_timings = PhaseTimer()
+
         # Initialize components
         api_key = os.environ.get("GEMINI_API_KEY")
         if not api_key:
-            print("WARNING: GEMINI_API_KEY not set. Query understanding will operate in fallback mode.")
+            logger.warning("GEMINI_API_KEY not set. Query understanding will operate in fallback mode.")
+
+        # Cache Gemini analyses so repeated queries skip the LLM round trip.
+        # ANALYSIS_CACHE_DB enables the on-disk layer that survives restarts.
+        if analysis_cache is None:
+            analysis_cache = LRUCache(
+                max_size=int(os.environ.get("ANALYSIS_CACHE_SIZE", 1024)),
+                ttl=float(os.environ.get("ANALYSIS_CACHE_TTL", 24 * 60 * 60)),
+                db_path=os.environ.get("ANALYSIS_CACHE_DB"),
+                table="analysis"
+            )
+        self.analysis_cache = analysis_cache
         
-        self.processor = QueryProcessor(api_key=api_key)
-        self.retriever = SHLRetriever()
+        # Live index version (None for the legacy unversioned layout). reload_index() swaps
+        # self.retriever for a fully loaded one; requests keep the reference they started with.
+        if retriever is None:
+            retriever = SHLRetriever.from_dir()
+        self.index_version = retriever.version
+        self.retriever = retriever
+        self.startup_timings.update(self.retriever.load_timings, prefix="retriever.")
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+
+        # Score weights, pool size and balancing policy come from the tuned config (see tune.py).
+        # RERANK_POOL still overrides the number of candidates retrieved for re-ranking/balancing.
+        self.rerank_config = load_rerank_config()
+        self.vector_weight = float(self.rerank_config["vector_weight"])
+        self.balance_policy = self.rerank_config["balance"]
+        # MMR_LAMBDA overrides the tuned diversity trade-off (1.0 disables MMR)
+        self.mmr_lambda = float(os.environ.get("MMR_LAMBDA", self.rerank_config["mmr_lambda"]))
+        self.candidate_pool = int(os.environ.get("RERANK_POOL", self.rerank_config["pool_size"]))
+        # Optional cross-encoder pass over the top candidates (CROSS_ENCODER_MODEL, off by default)
+        with self.startup_timings.phase("cross_encoder"):
+            self.cross_encoder = CrossEncoderReranker.from_env()
+        # REQUEST_BUDGET_MS (unset by default) is a request's end-to-end latency budget; the
+        # cross-encoder only spends what is left of it (and at most its own budget)
+        request_budget = os.environ.get("REQUEST_BUDGET_MS")
+        self.request_budget = float(request_budget) / 1000.0 if request_budget else None
+        # RETRIEVAL_MODE: 'dense' (default) or 'hybrid' (dense + BM25 with rank fusion)
+        self.retrieval_mode = os.environ.get("RETRIEVAL_MODE", "dense")
+
+        # Concurrent recommend() calls are coalesced into one encoder pass and one FAISS search.
+        # MICRO_BATCH_WINDOW_MS (default 2, 0 disables) is how long to wait for company.
+        batch_window = float(os.environ.get("MICRO_BATCH_WINDOW_MS", 2.0))
+        self.search_batcher = None
+        if batch_window > 0:
+            self.search_batcher = MicroBatcher(
+                self._search_group,
+                max_batch_size=int(os.environ.get("MICRO_BATCH_MAX_SIZE", 32)),
+                window_ms=batch_window,
+                name="search-batcher",
+                size_histogram=BATCH_SIZE
+            )
+
+        if processor is None:
+            # Offline analyzer saved with the index build (no network)
+            with self.startup_timings.phase("local_analyzer"):
+                self.local_analyzer = LocalQueryAnalyzer.for_retriever(self.retriever)
 
-    def _calculate_skill_score(self, text, skills):
+            # ANALYZER_MODE: 'gemini' (default), 'local' or 'auto' (local when confident, else Gemini)
+            if analyzer_mode is None:
+                analyzer_mode = os.environ.get("ANALYZER_MODE", "gemini")
+            processor = QueryProcessor(
+                api_key=api_key,
+                cache=analysis_cache,
+                local_analyzer=self.local_analyzer,
+                mode=analyzer_mode,
+                confidence_threshold=float(os.environ.get("ANALYZER_CONFIDENCE", 0.8)),
+                # GEMINI_MAX_CONCURRENCY caps concurrent LLM calls; GEMINI_QUEUE_TIMEOUT is how long to wait for a slot
+                max_concurrent_llm=int(os.environ.get("GEMINI_MAX_CONCURRENCY", 4)),
+                llm_wait=float(os.environ.get("GEMINI_QUEUE_TIMEOUT", 1.0))
+            )
+        else:
+            self.local_analyzer = getattr(processor, "local_analyzer", None)
+        self.processor = processor
+
+        # Gemini analysis runs on this pool while retrieval runs on the caller's thread.
+        # If it does not finish within analysis_timeout seconds we fall back to both test types.
+        if analysis_timeout is None:
+            analysis_timeout = float(os.environ.get("ANALYSIS_TIMEOUT", 8.0))
+        if analysis_workers is None:
+            analysis_workers = int(os.environ.get("ANALYSIS_WORKERS", 8))
+        self.analysis_timeout = analysis_timeout
+        self._analysis_pool = ThreadPoolExecutor(max_workers=analysis_workers, thread_name_prefix="analysis")
+        # Gemini SDK import/config happens on the pool, off the startup path
+        self._analysis_pool.submit(self.processor.warm_up)
+
+        logger.info("Engine startup: %s (total %.2fs)", self.startup_timings.summary(), self.startup_timings.total)
+
+    def _calculate_skill_scores(self, candidates, skills, retriever=None):
         """
-        Calculate normalized overlap score between text and skills.
+        Calculate normalized overlap score between each candidate's description and skills.
+        All candidates are scored in one pass over the retriever's precomputed postings.
+        Candidate ids are rows of the retriever that produced them, so pass that same retriever.
         """
-        if not skills or not text:
-            return 0.0
-            
-        text_lower = text.lower()
-        matched_count = 0
-        for skill in skills:
-            # Simple word boundary matching
-            # Escaping skill to prevent regex errors
-            skill_pattern = r'\b' + re.escape(skill.lower()) + r'\b'
-            if re.search(skill_pattern, text_lower):
-                matched_count += 1
-                
-        # Score is fraction of requested skills found
-        return matched_count / len(skills)
-
-    def recommend(self, query, min_results=5, max_results=10):
-        print(f"DEBUG: Processing query: '{query}'")
+        retriever = retriever or self.retriever
+        return retriever.skill_matcher.score([c['id'] for c in candidates], skills)
+
+    def _search_group(self, retriever, queries):
+        # Batched by retriever, so requests straddling a reload each search the index they snapshotted.
+        # Every caller gets the batch's stage timings along with its own results.
+        timer = PhaseTimer(STAGE_SECONDS)
+        results = retriever.search_batch(queries, top_k=self.candidate_pool, mode=self.retrieval_mode, timer=timer)
+        return [(r, timer) for r in results]
+
+    def _refill_filtered(self, retriever, queries, candidate_lists, analyses, max_results, top_k=None, timer=None):
+        """
+        Retrieval runs before the analysis is known, so it is unfiltered. Queries that need a single
+        test type family but got fewer than max_results of it are searched again with the type
+        filter pushed into the index (the query embedding is cached), returning a full pool of matches.
+        """
+        top_k = top_k or self.candidate_pool
+        groups = {}
+        for i, (candidates, analysis) in enumerate(zip(candidate_lists, analyses)):
+            required = {'K', 'P'} & set(analysis.get('required_test_types', ['K', 'P']))
+            if len(required) != 1:
+                continue
+            family = required.pop()
+            # Counted like _rank balances (by test_type); the filter's tag families are a superset
+            if sum(1 for c in candidates if c['test_type'] == family) < max_results:
+                groups.setdefault(family, []).append(i)
+
+        candidate_lists = list(candidate_lists)
+        for family, indices in groups.items():
+            results = retriever.search_batch(
+                [queries[i] for i in indices], top_k=top_k, mode=self.retrieval_mode, type_filter=family, timer=timer
+            )
+            for i, candidates in zip(indices, results):
+                candidate_lists[i] = candidates
+        return candidate_lists
+
+    def candidate_pools(self, queries, candidate_lists, analyses, pool_size=None, max_results=10, retriever=None):
+        """
+        The candidates recommend() would rank with a pool of pool_size (default: the engine's),
+        given lists retrieved at least that deep: each list cut to the pool, and single-type
+        queries short of matches re-searched with the type filter. Returns fresh copies, so the
+        input lists can be reused for other pool sizes.
+        """
+        retriever = retriever or self.retriever
+        pool_size = pool_size or self.candidate_pool
+        pools = self._refill_filtered(
+            retriever, queries, [candidates[:pool_size] for candidates in candidate_lists], analyses, max_results,
+            top_k=pool_size
+        )
+        return [[dict(c) for c in candidates] for candidates in pools]
+
+    def rank_candidates(self, queries, candidate_lists, analyses, pool_size=None, min_results=5, max_results=10,
+                        retriever=None):
+        """
+        Recommendations for already retrieved candidates and analyses, as recommend() would return
+        them with a pool of pool_size (see candidate_pools). One list per query, in input order.
+        """
+        retriever = retriever or self.retriever
+        pools = self.candidate_pools(queries, candidate_lists, analyses, pool_size, max_results, retriever)
+        return [
+            self._rank(candidates, analysis, min_results, max_results, retriever, query=query)
+            for query, candidates, analysis in zip(queries, pools, analyses)
+        ]
+
+    def _timed_analyze(self, query, analyzer_mode, timer):
+        with timer.phase("analyze"):
+            return self.processor.analyze(query, analyzer_mode)
+
+    def reload_index(self, index_dir=None):
+        """
+        Loads a new index build in the calling thread and swaps it in atomically.
+        Defaults to the version named by data/indexes/CURRENT. The encoder is reused.
+        In-flight requests finish on the retriever they started with. Returns the loaded version
+        (the build directory's name, as in retriever.version; None for the legacy layout).
+        """
+        with self._reload_lock:
+            start = time.perf_counter()
+            retriever = SHLRetriever.from_dir(index_dir, model=self.retriever.model)
+            local_analyzer = LocalQueryAnalyzer.for_retriever(retriever)
+
+            # Plain attribute assignments: readers see either the old or the new object, never a mix
+            self.retriever = retriever
+            self.local_analyzer = local_analyzer
+            self.processor.local_analyzer = local_analyzer
+            self.index_version = retriever.version
+
+            logger.info("Index %s reloaded in %.2fs (%d assessments).", retriever.version or "(legacy layout)",
+                        time.perf_counter() - start, len(retriever.metadata))
+            return self.index_version
+
+    def shutdown(self):
+        """
+        Stops the analysis pool and persists the query embedding warm set (QUERY_EMBEDDING_WARM_FILE).
+        """
+        self._analysis_pool.shutdown(wait=False)
+        warm_file = os.environ.get("QUERY_EMBEDDING_WARM_FILE")
+        model = self.retriever.model
+        if warm_file and hasattr(model, "save_warm_set"):
+            saved = model.save_warm_set(warm_file, limit=int(os.environ.get("QUERY_EMBEDDING_WARM_SIZE", 1000)))
+            logger.info("Saved %d warm query embeddings to %s", saved, warm_file)
+
+    def start_index_watcher(self, interval=10.0):
+        """
+        Polls data/indexes/CURRENT every interval seconds and reloads when it names a new version.
+        A failed reload keeps the current index and is retried on the next change.
+        """
+        if self._watcher is not None:
+            return self._watcher
+
+        def watch():
+            failed = None
+            while True:
+                time.sleep(interval)
+                version = current_version()
+                if version is None or version == self.index_version or version == failed:
+                    continue
+                try:
+                    # Load the version seen here, even if CURRENT moves again meanwhile
+                    self.reload_index(os.path.join(VERSIONS_DIR, version))
+                    failed = None
+                except Exception as e:
+                    logger.error("Reloading index version %s failed: %s", version, e)
+                    failed = version
+
+        self._watcher = threading.Thread(target=watch, name="index-watcher", daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+    def _wait_for_analysis(self, future, query, deadline):
+        """
+        Join an analysis future, falling back to the default analysis if the deadline passes.
+        """
+        try:
+            if deadline is None:
+                return future.result()
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            logger.warning("Query analysis timed out after %ss, using fallback.", self.analysis_timeout)
+            return self.processor.fallback(query)
+
+    def _analysis_deadline(self):
+        return time.monotonic() + self.analysis_timeout if self.analysis_timeout else None
+
+    def request_deadline(self):
+        """
+        time.monotonic() by which a request arriving now should be answered, or None without a budget.
+        """
+        return time.monotonic() + self.request_budget if self.request_budget else None
+
+    def recommend(self, query, min_results=5, max_results=10, analyzer_mode=None, timer=None,
+                  request_deadline=None):
+        """
+        Stage timings are recorded in timer (a PhaseTimer) and the stage latency histogram.
+        request_deadline (from request_deadline() when the request arrived) defaults to one from now.
+        """
+        logger.debug("Processing query: %r", query)
+        if timer is None:
+            timer = PhaseTimer(STAGE_SECONDS)
+        if request_deadline is None:
+            request_deadline = self.request_deadline()
+        deadline = self._analysis_deadline()
         
-        # 1. Analyze Query
-        analysis = self.processor.analyze(query)
+        # 1. Analyze Query (in the background, it does not depend on retrieval)
+        analysis_future = self._analysis_pool.submit(self._timed_analyze, query, analyzer_mode, timer)
+
+        # 2. Retrieve Candidates (get more than needed for re-ranking/balancing)
+        # One retriever snapshot per request, so a concurrent reload cannot mix two indexes
+        retriever = self.retriever
+        if self.search_batcher is not None:
+            candidates, batch_timer = self.search_batcher.submit(retriever, query)
+            timer.update(batch_timer)
+        else:
+            candidates = retriever.search(query, top_k=self.candidate_pool, mode=self.retrieval_mode, timer=timer)
+
+        # Time spent blocked on the analysis after retrieval finished
+        with timer.phase("analysis_wait"):
+            analysis = self._wait_for_analysis(analysis_future, query, deadline)
+
+        candidates = self._refill_filtered(retriever, [query], [candidates], [analysis], max_results, timer=timer)[0]
+        return self._rank(candidates, analysis, min_results, max_results, retriever, timer, query, request_deadline)
+
+    def recommend_batch(self, queries, min_results=5, max_results=10, analyzer_mode=None, timer=None,
+                        analysis_timeout=None, request_deadline=None):
+        """
+        Recommend for several queries, encoding and searching them in one batch.
+        Returns one recommendation list per query, in input order.
+        With analysis_timeout (seconds, for the whole batch), queries whose analysis has not
+        finished by then use the fallback analysis and their queued analyses are cancelled.
+        Offline callers leave it unset, since a large batch queues behind the pool by design.
+        request_deadline, as in recommend(), applies to the whole batch.
+        """
+        logger.debug("Processing batch of %d queries", len(queries))
+        if timer is None:
+            timer = PhaseTimer(STAGE_SECONDS)
+        if request_deadline is None:
+            request_deadline = self.request_deadline()
+        deadline = time.monotonic() + analysis_timeout if analysis_timeout else None
+
+        # Analyses run concurrently with the batch search
+        analysis_futures = [
+            self._analysis_pool.submit(self._timed_analyze, q, analyzer_mode, timer) for q in queries
+        ]
+
+        retriever = self.retriever
+        candidate_lists = retriever.search_batch(
+            queries, top_k=self.candidate_pool, mode=self.retrieval_mode, timer=timer
+        )
+
+        with timer.phase("analysis_wait"):
+            analyses = [
+                self._wait_for_analysis(future, q, deadline)
+                for future, q in zip(analysis_futures, queries)
+            ]
+        if deadline is not None:
+            # Analyses still queued past the deadline would only hold up other requests
+            for future in analysis_futures:
+                future.cancel()
+
+        candidate_lists = self._refill_filtered(retriever, queries, candidate_lists, analyses, max_results, timer=timer)
+        return [
+            self._rank(candidates, analysis, min_results, max_results, retriever, timer, q, request_deadline)
+            for q, candidates, analysis in zip(queries, candidate_lists, analyses)
+        ]
+
+    def _diversify(self, reranked_candidates, max_results, retriever=None):
+        """
+        Reorders score-sorted candidates by MMR so near-duplicates (e.g. "... - Short Form" variants)
+        do not fill the top results. Uses the index's stored vectors, so there is no encoder call.
+        """
+        retriever = retriever or self.retriever
+        vectors = retriever.get_vectors([c['id'] for c in reranked_candidates])
+        relevance = [c['final_score'] for c in reranked_candidates]
+        order = mmr_order(relevance, similarity_matrix(vectors), self.mmr_lambda, k=MMR_DEPTH_FACTOR * max_results)
+        return [reranked_candidates[i] for i in order]
+
+    def _rank(self, candidates, analysis, min_results=5, max_results=10, retriever=None, timer=None, query=None,
+              request_deadline=None):
+        """
+        Re-rank retrieved candidates using the query analysis and balance test types.
+        The cross-encoder stage (if enabled) needs the query text and gets the time left before request_deadline.
+        """
+        timer = timer or PhaseTimer(STAGE_SECONDS)
+        start = time.perf_counter()
         skills = analysis.get('skills', [])
         required_types = analysis.get('required_test_types', ['K', 'P'])
         
-        print(f"DEBUG: Extracted Skills: {skills}")
-        print(f"DEBUG: Required Types: {required_types}")
+        logger.debug("Extracted skills: %s, required types: %s", skills, required_types)
 
-        # 2. Retrieve Candidates (get more than needed for re-ranking/balancing)
-        # Using k=20 to have a pool
-        candidates = self.retriever.search(query, top_k=20)
-        
         # 3. Re-rank
+        skill_scores = self._calculate_skill_scores(candidates, skills, retriever)
         reranked_candidates = []
-        for cand in candidates:
+        for cand, skill_score in zip(candidates, skill_scores):
             # Vector score is already cosine similarity (or inner product normalized)
             vector_score = cand['score']
-            
-            # Skill score
-            desc = cand.get('description', '')
-            skill_score = self._calculate_skill_score(desc, skills)
+            skill_score = float(skill_score)
             
             # Weighted Combination
             # Vector score for MiniLM/InnerProduct is roughly -1 to 1, usually 0.3-0.8 for matches.
             # Skill score is 0 to 1.
-            final_score = (0.7 * vector_score) + (0.3 * skill_score)
+            final_score = (self.vector_weight * vector_score) + ((1 - self.vector_weight) * skill_score)
             
             cand['final_score'] = final_score
             cand['skill_score'] = skill_score
@@ -69,30 +415,49 @@ class RecommendationEngine:
             
         # Sort by final score descending
         reranked_candidates.sort(key=lambda x: x['final_score'], reverse=True)
+        timer.record("rerank", time.perf_counter() - start)
+
+        if self.cross_encoder is not None and query is not None:
+            with timer.phase("cross_encode"):
+                budget = None if request_deadline is None else request_deadline - time.monotonic()
+                reranked_candidates = self.cross_encoder.rerank(query, reranked_candidates, budget=budget)
+
+        if self.mmr_lambda < 1.0 and len(reranked_candidates) > 1:
+            start = time.perf_counter()
+            reranked_candidates = self._diversify(reranked_candidates, max_results, retriever)
+            timer.record("diversify", time.perf_counter() - start)
+        start = time.perf_counter()
 
         # 4. Filter & Balance
         final_results = []
         
-        # Split by type
+        # Split by type. Balancing uses the cleaned test_type; the full tag masks only drive the retrieval filter.
         k_candidates = [c for c in reranked_candidates if c['test_type'] == 'K']
         p_candidates = [c for c in reranked_candidates if c['test_type'] == 'P']
         
         # Check requirements
         needs_k = 'K' in required_types
         needs_p = 'P' in required_types
+        if self.balance_policy == "none":
+            needs_k = needs_p = False
         
-        if needs_k and needs_p:
+        if needs_k and needs_p and self.balance_policy == "filter":
+            final_results = reranked_candidates[:max_results]
+        elif needs_k and needs_p:
             # We need both.
-            # Strategy: Take highest from K, highest from P, then fill rest with highest remaining
+            # Strategy: Take highest from K, highest other from P, then fill rest with highest remaining
             if k_candidates:
-                final_results.append(k_candidates.pop(0))
-            if p_candidates:
-                final_results.append(p_candidates.pop(0))
-                
-            # Pool rest and sort
-            remaining = k_candidates + p_candidates
-            remaining.sort(key=lambda x: x['final_score'], reverse=True)
-            
+                final_results.append(k_candidates[0])
+            first_p = next((c for c in p_candidates if all(c is not r for r in final_results)), None)
+            if first_p is not None:
+                final_results.append(first_p)
+
+            # Rest of either type, already in score order
+            remaining = [
+                c for c in reranked_candidates
+                if c['test_type'] in ('K', 'P') and not any(c is r for r in final_results)
+            ]
+
             # Fill up to max_results (or at least min_results)
             needed = max_results - len(final_results)
             final_results.extend(remaining[:needed])
@@ -111,14 +476,20 @@ class RecommendationEngine:
             # Or just return what we have
             pass
 
-        # 5. Format Output
+        # 5. Format Output (structured attributes were parsed at build time, see build_index.py)
         output = []
         for res in final_results:
             output.append({
                 "assessment_name": res['assessment_name'],
                 "assessment_url": res.get('assessment_url', ''), # Might be missing if old data
-                "test_type": res['test_type']
+                "test_type": res['test_type'],
+                "test_types": res['test_types'],
+                "description": res['description'],
+                "duration": res['duration'],
+                "adaptive_support": res['adaptive_support'],
+                "remote_support": res['remote_support']
             })
+        timer.record("balance", time.perf_counter() - start)
             
         return output
 
@@ -1,8 +1,21 @@
 import faiss
 import pickle
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import os
+import json
+import logging
+import time
+from recommender.cache import LRUCache, normalize_key
+from recommender.encoder import CachedEncoder, load_encoder
+from recommender.metrics import STAGE_SECONDS
+from recommender.index_factory import enable_reconstruct, exhaustive_params, flat_vectors, is_id_mapped, search_params
+from recommender.metadata_store import MetadataStore
+from recommender.skill_matcher import SkillMatcher
+from recommender.sparse_index import BM25Index
+from recommender.test_types import TYPE_NAME_LISTS, filter_mask, type_masks
+from recommender.timing import PhaseTimer
+
+logger = logging.getLogger(__name__)
 
 # Use relative paths for deployment compatibility
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__))) # go up from recommender/search_service.py to root
@@ -14,52 +27,419 @@ if not os.path.exists(os.path.join(BASE_DIR, 'data')):
     BASE_DIR = os.getcwd()
 
 INDEX_DIR = os.path.join(BASE_DIR, "data", "indexes")
-INDEX_FILE = os.path.join(INDEX_DIR, "shl_embeddings.index")
-META_FILE = os.path.join(INDEX_DIR, "shl_metadata.pkl")
+# Versioned layout: data/indexes/versions/<version>/..., with CURRENT naming the live version
+VERSIONS_DIR = os.path.join(INDEX_DIR, "versions")
+CURRENT_FILE = os.path.join(INDEX_DIR, "CURRENT")
 MODEL_NAME = 'all-MiniLM-L6-v2'
+# Exported ONNX encoder (build_index.py --export-onnx), loaded instead of torch when present
+ENCODER_DIR = os.path.join(BASE_DIR, "data", "models", MODEL_NAME)
+
+def artifact_paths(index_dir):
+    """
+    File layout of one index build.
+    """
+    return {
+        "index": os.path.join(index_dir, "shl_embeddings.index"),
+        "meta": os.path.join(index_dir, "shl_metadata.pkl"),
+        "meta_store": os.path.join(index_dir, "shl_metadata"),
+        "bm25": os.path.join(index_dir, "shl_bm25.npz"),
+        "config": os.path.join(index_dir, "index_config.json"),
+        "embedding_cache": os.path.join(index_dir, "embedding_cache.npz"),
+        "analyzer": os.path.join(index_dir, "local_analyzer.npz"),
+    }
+
+def current_version():
+    """
+    Name of the live index version, or None for the legacy unversioned layout.
+    """
+    if not os.path.exists(CURRENT_FILE):
+        return None
+    with open(CURRENT_FILE) as f:
+        return f.read().strip() or None
+
+def resolve_index_dir():
+    version = current_version()
+    return os.path.join(VERSIONS_DIR, version) if version else INDEX_DIR
+
+_LEGACY = artifact_paths(INDEX_DIR)
+INDEX_FILE = _LEGACY["index"]
+META_FILE = _LEGACY["meta"]
+META_STORE_DIR = _LEGACY["meta_store"]
+BM25_FILE = _LEGACY["bm25"]
+INDEX_CONFIG_FILE = _LEGACY["config"]
+ANALYZER_FILE = _LEGACY["analyzer"]
+
+# Retrieval modes: dense FAISS only, or dense + BM25 fused with reciprocal rank fusion
+SEARCH_MODES = ("dense", "hybrid")
+RRF_K = 60 # Standard RRF damping constant
+HYBRID_FETCH_K = 50 # Candidates taken from each side before fusion
+FLAG_NAMES = {1: "Yes", 0: "No", -1: "Unknown"} # adaptive / remote codes, see scraper.clean_shl.attribute_arrays
+
+# Query embedding cache (QUERY_EMBEDDING_CACHE_SIZE, 0 disables) and the optional warm set
+# persisted across restarts (QUERY_EMBEDDING_WARM_FILE). The top-k result cache is off by default (RESULT_CACHE_SIZE).
+DEFAULT_EMBEDDING_CACHE_SIZE = 4096
 
 class SHLRetriever:
-    def __init__(self, index_path=INDEX_FILE, meta_path=META_FILE, model_name=MODEL_NAME):
-        if not os.path.exists(index_path) or not os.path.exists(meta_path):
+    def __init__(self, index_path=INDEX_FILE, meta_path=META_FILE, model_name=MODEL_NAME, bm25_path=BM25_FILE,
+                 meta_store_path=META_STORE_DIR, config_path=INDEX_CONFIG_FILE, model=None, encoder_dir=ENCODER_DIR,
+                 version=None, analyzer_path=ANALYZER_FILE):
+        has_store = meta_store_path and MetadataStore.exists(meta_store_path)
+        if not os.path.exists(index_path) or not (has_store or os.path.exists(meta_path)):
             raise FileNotFoundError("Index or Metadata file not found. Run build_index.py first.")
             
-        print(f"Loading index from {index_path}...")
-        self.index = faiss.read_index(index_path)
-        
-        print(f"Loading metadata from {meta_path}...")
-        with open(meta_path, 'rb') as f:
-            self.metadata = pickle.load(f)
-            
-        print(f"Loading model {model_name}...")
-        self.model = SentenceTransformer(model_name)
+        # Per-phase load times, logged by the engine as part of the startup breakdown
+        self.load_timings = PhaseTimer()
+
+        with self.load_timings.phase("index"):
+            logger.info("Loading index from %s", index_path)
+            self.index = faiss.read_index(index_path)
+            enable_reconstruct(self.index)
+
+            # Default nprobe / efSearch written by build_index.py (ignored for Flat)
+            self.index_config = {}
+            if config_path and os.path.exists(config_path):
+                with open(config_path) as f:
+                    self.index_config = json.load(f)
+
+        with self.load_timings.phase("metadata"):
+            if has_store:
+                # Memory-mapped columnar store, shared between worker processes via the page cache
+                logger.info("Loading metadata store from %s", meta_store_path)
+                self.metadata = MetadataStore.load(meta_store_path)
+            else:
+                # Backward compatibility with indexes built before the columnar store
+                logger.info("Loading metadata from %s", meta_path)
+                with open(meta_path, 'rb') as f:
+                    self.metadata = MetadataStore.from_frame(pickle.load(f))
+
+            # Indexes built with stable assessment ids return ids, not row positions
+            self.row_ids = None
+            if self.metadata.ids is not None and is_id_mapped(self.index):
+                self.row_ids = np.asarray(self.metadata.ids, dtype=np.int64)
+                order = np.argsort(self.row_ids)
+                self._sorted_ids = self.row_ids[order]
+                self._sorted_rows = order
+
+            # Test type bitmask per row (see recommender.test_types); older builds derive it here
+            self.type_masks = self.metadata.arrays.get("type_mask")
+            if self.type_masks is None:
+                self.type_masks = type_masks(self.metadata.column('category_tags'), self.metadata.column('test_type'))
+            self.type_masks = np.asarray(self.type_masks, dtype=np.uint8)
+
+            # Duration (-1 unknown) and adaptive / remote codes per row (see scraper.clean_shl.attribute_arrays),
+            # parsed by build_index.py; older builds parse them here. Boolean flags are from builds that
+            # could not tell "No" from unknown, so those are parsed again too.
+            arrays = self.metadata.arrays
+            if (not all(name in arrays for name in ("duration", "adaptive", "remote"))
+                    or arrays["adaptive"].dtype == bool):
+                from scraper.clean_shl import attribute_arrays
+                arrays = attribute_arrays(self.metadata.to_frame())
+            self.durations = np.asarray(arrays["duration"], dtype=np.int32)
+            self.adaptive = np.asarray(arrays["adaptive"], dtype=np.int8)
+            self.remote = np.asarray(arrays["remote"], dtype=np.int8)
+            self._type_filters = {} # filter mask -> (matching rows, IDSelector over their labels)
+
+            # Flat indexes expose their storage directly; _flat_positions maps metadata rows into it
+            self._flat, labels = flat_vectors(self.index)
+            if self._flat is not None:
+                keys = self.row_ids if self.row_ids is not None else np.arange(self.metadata.num_rows)
+                if labels is None:
+                    self._flat_positions = keys
+                else:
+                    order = np.argsort(labels)
+                    self._flat_positions = order[np.searchsorted(labels, keys, sorter=order)]
+
+        with self.load_timings.phase("skill_matcher"):
+            # Skill lookup structures are built once per loaded catalogue
+            self.skill_matcher = SkillMatcher(self.metadata.column('description'))
+
+        with self.load_timings.phase("bm25"):
+            # Optional sparse side for hybrid search
+            self.bm25 = None
+            if bm25_path and os.path.exists(bm25_path):
+                logger.info("Loading BM25 index from %s", bm25_path)
+                self.bm25 = BM25Index.load(bm25_path)
+            else:
+                logger.warning("BM25 index not found, hybrid search will fall back to dense only.")
+
+        with self.load_timings.phase("encoder"):
+            # A reload can hand over the already-loaded encoder. Otherwise the ONNX artifact
+            # is preferred (ENCODER_BACKEND=auto|onnx|torch, ENCODER_QUANTIZED=1 for int8).
+            if model is None:
+                model = load_encoder(
+                    model_name,
+                    encoder_dir,
+                    backend=os.environ.get("ENCODER_BACKEND", "auto"),
+                    quantized=os.environ.get("ENCODER_QUANTIZED", "0") == "1"
+                )
+                cache_size = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", DEFAULT_EMBEDDING_CACHE_SIZE))
+                if cache_size > 0:
+                    # Lives with the encoder, so it survives index reloads
+                    model = CachedEncoder(model, LRUCache(max_size=cache_size, ttl=None), model_name)
+                    warmed = model.load_warm_set(os.environ.get("QUERY_EMBEDDING_WARM_FILE"))
+                    if warmed:
+                        logger.info("Loaded %d warm query embeddings.", warmed)
+            self.model = model
+
+        # Top-k results of this index build. A reload creates a new retriever, so stale entries
+        # are never served; the version in the key guards against sharing one cache across builds.
+        self.version = version
+        # Local query analyzer state saved with this build (see LocalQueryAnalyzer.for_retriever)
+        self.analyzer_path = analyzer_path
+        result_cache_size = int(os.environ.get("RESULT_CACHE_SIZE", 0))
+        self.result_cache = LRUCache(max_size=result_cache_size, ttl=None) if result_cache_size > 0 else None
+
+    @classmethod
+    def from_dir(cls, index_dir=None, model_name=MODEL_NAME, model=None):
+        """
+        Loads the build in index_dir (default: the live version, or the legacy layout).
+        """
+        if index_dir is None:
+            # CURRENT is read once, so the version reported is the one loaded
+            version = current_version()
+            index_dir = os.path.join(VERSIONS_DIR, version) if version else INDEX_DIR
+        else:
+            version = os.path.basename(os.path.normpath(index_dir))
+        paths = artifact_paths(index_dir)
+        return cls(
+            index_path=paths["index"],
+            meta_path=paths["meta"],
+            model_name=model_name,
+            bm25_path=paths["bm25"],
+            meta_store_path=paths["meta_store"],
+            config_path=paths["config"],
+            analyzer_path=paths["analyzer"],
+            model=model,
+            version=version
+        )
         
-    def search(self, query, top_k=5):
+    def get_embeddings(self):
+        """
+        Returns the stored document vectors as an (n, dim) float32 matrix, row i matching metadata row i.
+        """
+        if self._flat is not None:
+            return self._flat[self._flat_positions]
+        if self.row_ids is not None:
+            return self.index.reconstruct_batch(self.row_ids)
+        return self.index.reconstruct_n(0, self.index.ntotal)
+
+    def get_vectors(self, rows):
+        """
+        Stored vectors of the given metadata rows, (len(rows), dim): a gather from Flat storage,
+        one reconstruct call for other index types.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if self._flat is not None:
+            return self._flat[self._flat_positions[rows]]
+        return self.index.reconstruct_batch(self.row_ids[rows] if self.row_ids is not None else rows)
+
+    def _to_rows(self, indices):
+        """
+        Maps FAISS result labels to metadata rows (identity for positional indexes). -1 is preserved.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if self.row_ids is None:
+            return indices
+        pos = np.clip(np.searchsorted(self._sorted_ids, indices), 0, len(self._sorted_ids) - 1)
+        return np.where(indices == -1, -1, self._sorted_rows[pos])
+
+    def search(self, query, top_k=5, mode="dense", nprobe=None, ef_search=None, type_filter=None, timer=None):
         """
         Search for assessments matching the query.
         Returns a list of dictionaries with assessment details and score.
         """
-        # Encode query
-        query_vector = self.model.encode([query], normalize_embeddings=True)
-        query_vector = np.array(query_vector).astype('float32')
-        
+        return self.search_batch(
+            [query], top_k=top_k, mode=mode, nprobe=nprobe, ef_search=ef_search, type_filter=type_filter, timer=timer
+        )[0]
+
+    def search_batch(self, queries, top_k=5, batch_size=64, mode="dense", nprobe=None, ef_search=None,
+                     type_filter=None, timer=None):
+        """
+        Search for several queries at once.
+        All queries are encoded in padded batches and sent to FAISS as a single matrix.
+        Returns one result list per query, in input order.
+        mode='hybrid' fuses the dense list with BM25 using reciprocal rank fusion.
+        nprobe (IVF) and ef_search (HNSW) trade recall for latency; they default to the build config.
+        type_filter ("K", "P", code letters like "AS", or a list of them) restricts the search inside
+        FAISS to assessments with any of those test types, so top_k matches come back whenever they exist.
+        Stage timings (encode, index_search, metadata_gather) go to timer, or straight to the stage histogram.
+        """
+        if timer is None:
+            timer = PhaseTimer(STAGE_SECONDS)
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}'. Expected one of {SEARCH_MODES}.")
+        if not queries:
+            return []
+
+        mask = filter_mask(type_filter) if type_filter else None
+
+        if self.result_cache is None:
+            return self._search(queries, top_k, batch_size, mode, nprobe, ef_search, mask, timer)
+
+        keys = [(normalize_key(q), top_k, mode, nprobe, ef_search, mask, self.version) for q in queries]
+        cached = [self.result_cache.get(k) for k in keys]
+        missing = [i for i, hit in enumerate(cached) if hit is None]
+        if missing:
+            fresh = self._search([queries[i] for i in missing], top_k, batch_size, mode, nprobe, ef_search, mask, timer)
+            for i, results in zip(missing, fresh):
+                self.result_cache.set(keys[i], results)
+                cached[i] = results
+        # Callers annotate result dicts during re-ranking, so hand out copies
+        return [[dict(r) for r in results] for results in cached]
+
+    def _type_filter(self, mask):
+        """
+        Rows whose type mask intersects mask, and an IDSelector over their FAISS labels (cached per mask).
+        """
+        cached = self._type_filters.get(mask)
+        if cached is None:
+            rows = np.flatnonzero(self.type_masks & mask)
+            labels = self.row_ids[rows] if self.row_ids is not None else rows
+            cached = self._type_filters[mask] = (rows, faiss.IDSelectorBatch(labels.astype(np.int64)))
+        return cached
+
+    def _exact_filtered(self, query_vectors, rows, sel, top_k, ef_search=None):
+        """
+        Top_k over the given rows, for queries whose approximate filtered search (IVF probing
+        too few lists, HNSW cut off by the filter) came back short. The index searches again with
+        the same IDSelector and exhaustive parameters; Flat storage is scored directly.
+        """
+        if self._flat is not None:
+            scores = query_vectors @ self.get_vectors(rows).T
+            order = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+            return np.take_along_axis(scores, order, axis=1), rows[order]
+        params = exhaustive_params(self.index, sel, len(rows), ef_search)
+        scores, indices = self.index.search(query_vectors, top_k, params=params)
+        return scores, self._to_rows(indices)
+
+    def _search(self, queries, top_k, batch_size, mode, nprobe, ef_search, mask, timer):
+        # Encode queries
+        with timer.phase("encode"):
+            query_vectors = self.model.encode(list(queries), batch_size=batch_size, normalize_embeddings=True)
+            query_vectors = np.array(query_vectors).astype('float32')
+
+        rows = sel = None
+        if mask is not None:
+            rows, sel = self._type_filter(mask)
+            top_k = min(top_k, len(rows))
+            if top_k == 0:
+                return [[] for _ in queries]
+
+        nprobe = nprobe if nprobe is not None else self.index_config.get("nprobe")
+        ef_search = ef_search if ef_search is not None else self.index_config.get("ef_search")
+        params = search_params(self.index, nprobe=nprobe, ef_search=ef_search, sel=sel)
+
+        if mode == "hybrid" and self.bm25 is not None:
+            return self._hybrid_search(queries, query_vectors, top_k, params, timer, rows, sel, ef_search)
+
         # Search index
-        scores, indices = self.index.search(query_vector, top_k)
-        
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx == -1: continue # Should not happen in Flat index unless k > n
-            
-            row = self.metadata.iloc[idx]
-            results.append({
-                'score': float(score),
-                'assessment_name': row['assessment_name'],
-                'test_type': row['test_type'],
-                'description': row['description'],
-                'assessment_url': row['assessment_url'] if 'assessment_url' in row else '',
-                'category_tags': row['category_tags'] if 'category_tags' in row else ''
-            })
-            
-        return results
+        with timer.phase("index_search"):
+            scores, indices = self.index.search(query_vectors, top_k, params=params)
+            indices = self._to_rows(indices)
+            short = (indices == -1).any(axis=1)
+            if rows is not None and short.any():
+                scores[short], indices[short] = self._exact_filtered(query_vectors[short], rows, sel, top_k, ef_search)
+
+        with timer.phase("metadata_gather"):
+            return [self._build_results(row_scores, row_indices) for row_scores, row_indices in zip(scores, indices)]
+
+    def cache_stats(self):
+        """
+        Hit rates of the query embedding cache and the result cache (None when disabled).
+        """
+        return {
+            "query_embeddings": self.model.stats() if isinstance(self.model, CachedEncoder) else None,
+            "results": self.result_cache.stats() if self.result_cache is not None else None
+        }
+
+    def _hybrid_search(self, queries, query_vectors, top_k, params=None, timer=None, rows=None, sel=None,
+                       ef_search=None):
+        timer = timer or PhaseTimer(STAGE_SECONDS)
+        fetch_k = min(max(top_k, HYBRID_FETCH_K), self.index.ntotal if rows is None else len(rows))
+        with timer.phase("index_search"):
+            dense_scores, dense_indices = self.index.search(query_vectors, fetch_k, params=params)
+            dense_indices = self._to_rows(dense_indices)
+            short = (dense_indices == -1).any(axis=1)
+            if rows is not None and short.any():
+                dense_scores[short], dense_indices[short] = self._exact_filtered(
+                    query_vectors[short], rows, sel, fetch_k, ef_search
+                )
+
+        batch_results = []
+        for query, query_vector, row_scores, row_indices in zip(queries, query_vectors, dense_scores, dense_indices):
+            with timer.phase("bm25"):
+                sparse_scores, sparse_indices = self.bm25.search(query, fetch_k)
+                if rows is not None:
+                    # BM25 has no filter of its own; drop non-matching rows from its list
+                    keep = np.isin(sparse_indices, rows)
+                    sparse_scores, sparse_indices = np.asarray(sparse_scores)[keep], np.asarray(sparse_indices)[keep]
+
+            # Reciprocal rank fusion: sum of 1 / (RRF_K + rank) over both lists
+            fused = {}
+            dense_lookup = {}
+            for rank, (score, idx) in enumerate(zip(row_scores, row_indices)):
+                if idx == -1: continue
+                dense_lookup[int(idx)] = float(score)
+                fused[int(idx)] = fused.get(int(idx), 0.0) + 1.0 / (RRF_K + rank + 1)
+            sparse_lookup = {}
+            for rank, (score, idx) in enumerate(zip(sparse_scores, sparse_indices)):
+                sparse_lookup[int(idx)] = float(score)
+                fused[int(idx)] = fused.get(int(idx), 0.0) + 1.0 / (RRF_K + rank + 1)
+
+            top = sorted(fused, key=fused.get, reverse=True)[:top_k]
+
+            # Keep 'score' as the cosine similarity so downstream re-ranking is unchanged;
+            # BM25-only hits are scored together from one gather of their stored vectors
+            cosine = np.array([dense_lookup.get(idx, 0.0) for idx in top], dtype=np.float32)
+            sparse_only = [i for i, idx in enumerate(top) if idx not in dense_lookup]
+            if sparse_only:
+                cosine[sparse_only] = self.get_vectors([top[i] for i in sparse_only]) @ query_vector
+
+            with timer.phase("metadata_gather"):
+                results = self._build_results(cosine, top)
+            for res in results:
+                res['rrf_score'] = fused[res['id']]
+                res['bm25_score'] = sparse_lookup.get(res['id'], 0.0)
+            batch_results.append(results)
+
+        return batch_results
+
+    def _build_results(self, scores, indices):
+        scores = np.asarray(scores, dtype=np.float32)
+        indices = np.asarray(indices, dtype=np.int64)
+        valid = indices != -1 # -1 should not happen in Flat index unless k > n
+        scores, indices = scores[valid], indices[valid]
+
+        # One gather per column for the whole hit list
+        names = self.metadata.gather('assessment_name', indices)
+        types = self.metadata.gather('test_type', indices)
+        descriptions = self.metadata.gather('description', indices)
+        urls = self.metadata.gather('assessment_url', indices)
+        tags = self.metadata.gather('category_tags', indices)
+        masks = self.type_masks[indices]
+        durations = self.durations[indices]
+        adaptive = self.adaptive[indices]
+        remote = self.remote[indices]
+
+        return [
+            {
+                'id': idx,
+                'score': score,
+                'assessment_name': name,
+                'test_type': test_type,
+                'description': desc,
+                'assessment_url': url,
+                'category_tags': tag,
+                'type_mask': mask,
+                'test_types': TYPE_NAME_LISTS[mask],
+                'duration': duration if duration >= 0 else None,
+                'adaptive_support': FLAG_NAMES[adaptive_code],
+                'remote_support': FLAG_NAMES[remote_code]
+            }
+            for idx, score, name, test_type, desc, url, tag, mask, duration, adaptive_code, remote_code
+            in zip(indices.tolist(), scores.tolist(), names, types, descriptions, urls, tags, masks.tolist(),
+                   durations.tolist(), adaptive.tolist(), remote.tolist())
+        ]
 
 if __name__ == "__main__":
     # Test run
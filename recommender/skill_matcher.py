@@ -0,0 +1,56 @@
+import re
+import numpy as np
+
+WORD_RE = re.compile(r"\w+")
+
+
+class SkillMatcher:
+    """
+    Precomputed skill lookup over the catalogue descriptions.
+    Built once at load time: lowercased texts plus token -> doc id postings, so scoring a
+    candidate pool is a few array lookups instead of one regex per skill per candidate.
+    """
+    def __init__(self, texts):
+        self.texts = [str(t).lower() if isinstance(t, str) else "" for t in texts]
+
+        postings = {}
+        for doc_id, text in enumerate(self.texts):
+            for token in set(WORD_RE.findall(text)):
+                postings.setdefault(token, []).append(doc_id)
+        self.postings = {token: np.array(ids, dtype=np.int64) for token, ids in postings.items()}
+        self._empty = np.array([], dtype=np.int64)
+
+    def score(self, doc_ids, skills):
+        """
+        Fraction of skills found (word-boundary match) in each document.
+        Returns a float array aligned with doc_ids.
+        """
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        skills = [s.lower().strip() for s in skills if s and s.strip()]
+        if not skills or len(doc_ids) == 0:
+            return np.zeros(len(doc_ids), dtype=np.float32)
+
+        # Single-word skills are answered from the postings; anything else
+        # (phrases, "c++", "node.js") is matched with its own word-boundary pattern, so skills
+        # that overlap in the text ("java" / "java script") are each found.
+        skills = list(dict.fromkeys(skills))
+        simple = [s for s in skills if WORD_RE.fullmatch(s)]
+        complex_skills = [s for s in skills if not WORD_RE.fullmatch(s)]
+
+        matched = np.zeros(len(doc_ids), dtype=np.float32)
+        for skill in simple:
+            matched += np.isin(doc_ids, self.postings.get(skill, self._empty))
+
+        for skill in complex_skills:
+            pattern = re.compile(r"\b" + re.escape(skill) + r"\b")
+            # Every word of the skill must be a token of the document, so the postings
+            # narrow down where the regex has to run
+            present = doc_ids >= 0
+            for token in WORD_RE.findall(skill):
+                present &= np.isin(doc_ids, self.postings.get(token, self._empty))
+            for i in np.flatnonzero(present):
+                if pattern.search(self.texts[doc_ids[i]]):
+                    matched[i] += 1
+
+        # Score is fraction of requested skills found
+        return matched / (len(simple) + len(complex_skills))
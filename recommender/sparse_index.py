@@ -0,0 +1,110 @@
+import re
+import numpy as np
+from collections import Counter
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text).lower())
+
+
+class BM25Index:
+    """
+    Sparse BM25 index stored as CSR postings arrays.
+    Term weights (idf * saturated tf) are precomputed at build time, so a query is a
+    gather over its terms' posting slices plus one bincount.
+    """
+    def __init__(self, terms, indptr, doc_ids, weights, num_docs):
+        self.term_ids = {t: i for i, t in enumerate(terms)}
+        self.terms = terms
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.num_docs = int(num_docs)
+
+    @classmethod
+    def build(cls, texts, k1=1.5, b=0.75):
+        docs = [Counter(tokenize(t)) for t in texts]
+        num_docs = len(docs)
+        doc_lens = np.array([sum(d.values()) for d in docs], dtype=np.float32)
+        avg_len = float(doc_lens.mean()) if num_docs else 0.0
+
+        postings = {}
+        for doc_id, counts in enumerate(docs):
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        terms = sorted(postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        doc_ids, weights = [], []
+        for i, term in enumerate(terms):
+            plist = postings[term]
+            df = len(plist)
+            idf = np.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+            for doc_id, tf in plist:
+                norm = k1 * (1.0 - b + b * doc_lens[doc_id] / avg_len)
+                doc_ids.append(doc_id)
+                weights.append(idf * tf * (k1 + 1.0) / (tf + norm))
+            indptr[i + 1] = len(doc_ids)
+
+        return cls(
+            np.array(terms),
+            indptr,
+            np.array(doc_ids, dtype=np.int64),
+            np.array(weights, dtype=np.float32),
+            num_docs
+        )
+
+    def save(self, path):
+        np.savez(path, terms=self.terms, indptr=self.indptr, doc_ids=self.doc_ids,
+                 weights=self.weights, num_docs=np.array(self.num_docs))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        return cls(data['terms'], data['indptr'], data['doc_ids'], data['weights'], data['num_docs'])
+
+    def matches(self, query):
+        """
+        (doc_ids, scores) of the documents sharing a term with the query. Only the query terms'
+        postings are touched, so the cost does not grow with the size of the catalogue.
+        """
+        slices = []
+        for term in set(tokenize(query)):
+            i = self.term_ids.get(term)
+            if i is not None:
+                slices.append(slice(self.indptr[i], self.indptr[i + 1]))
+        if not slices:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+        ids = np.concatenate([self.doc_ids[s] for s in slices])
+        w = np.concatenate([self.weights[s] for s in slices])
+        docs, local = np.unique(ids, return_inverse=True)
+        return docs, np.bincount(local, weights=w, minlength=len(docs)).astype(np.float32)
+
+    def scores(self, query):
+        """
+        BM25 score of every document for the query, as a dense float array.
+        """
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        docs, doc_scores = self.matches(query)
+        scores[docs] = doc_scores
+        return scores
+
+    def search(self, query, top_k=10):
+        """
+        Returns (scores, doc_ids) of the top_k matching documents; documents with no term overlap are skipped.
+        """
+        docs, scores = self.matches(query)
+        keep = scores > 0
+        docs, scores = docs[keep], scores[keep]
+        k = min(top_k, len(docs))
+        if k == 0:
+            return np.array([], dtype=np.float32), np.array([], dtype=np.int64)
+        if k < len(docs):
+            top = np.argpartition(-scores, k - 1)[:k]
+            docs, scores = docs[top], scores[top]
+        # Best first, ties by document id
+        order = np.lexsort((docs, -scores))
+        return scores[order], docs[order]
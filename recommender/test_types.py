@@ -0,0 +1,70 @@
+import numpy as np
+
+# SHL test type codes, one bit each in a row's type mask:
+# Ability & Aptitude, Biodata & Situational Judgement, Competencies, Development & 360,
+# Assessment Exercises, Knowledge & Skills, Personality & Behaviour, Simulations
+TYPE_CODES = "ABCDEKPS"
+TYPE_BITS = {code: 1 << i for i, code in enumerate(TYPE_CODES)}
+
+# Display names returned by the API, in TYPE_CODES order
+TYPE_NAMES = {
+    "A": "Ability & Aptitude", "B": "Biodata & Situational Judgement", "C": "Competencies",
+    "D": "Development & 360", "E": "Assessment Exercises", "K": "Knowledge & Skills",
+    "P": "Personality & Behavior", "S": "Simulations"
+}
+
+# The K/P families that clean_shl.normalize_type collapses the codes into
+FAMILIES = {"K": "KSA", "P": "PBCDE"}
+
+
+def type_mask(codes):
+    """
+    Bitmask of every known code letter in a string such as "CPAB" (other characters are ignored).
+    """
+    if not isinstance(codes, str):
+        return 0 # missing (None / NaN)
+    mask = 0
+    for code in codes.upper():
+        mask |= TYPE_BITS.get(code, 0)
+    return mask
+
+
+def family_mask(family):
+    """
+    Mask matching any code of a K/P family; other values are taken as code letters.
+    """
+    return type_mask(FAMILIES.get(family, family))
+
+
+def type_masks(category_tags, test_types=None):
+    """
+    One uint8 mask per row from its category_tags, falling back to test_type when a row has no tags.
+    """
+    masks = np.array([type_mask(tags) for tags in category_tags], dtype=np.uint8)
+    if test_types is not None:
+        fallback = np.array([type_mask(t) for t in test_types], dtype=np.uint8)
+        masks = np.where(masks == 0, fallback, masks)
+    return masks
+
+
+def filter_mask(type_filter):
+    """
+    Mask for a search type filter: a family or code string ("K", "P", "AS") or a list of them.
+    """
+    if isinstance(type_filter, str):
+        return family_mask(type_filter)
+    mask = 0
+    for item in type_filter:
+        mask |= family_mask(item)
+    return mask
+
+
+def type_names(mask):
+    """
+    Display names of the codes set in a type mask.
+    """
+    return [TYPE_NAMES[code] for code in TYPE_CODES if mask & TYPE_BITS[code]]
+
+
+# Every possible uint8 mask -> its names, so serving a row's type list is a table lookup
+TYPE_NAME_LISTS = [type_names(mask) for mask in range(1 << len(TYPE_CODES))]
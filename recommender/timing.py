@@ -0,0 +1,53 @@
+import contextlib
+import threading
+import time
+
+
+class PhaseTimer:
+    """
+    Wall-clock durations of named phases, in the order they ran.
+    With a histogram (see recommender.metrics), every recorded phase is also observed there.
+    Thread-safe: a request's timer is shared with the threads running its query analyses.
+    """
+    def __init__(self, histogram=None):
+        self.phases = {}
+        self.histogram = histogram
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+        if self.histogram is not None:
+            self.histogram.observe(name, seconds)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def update(self, other, prefix=""):
+        # Copies another timer's phases without observing them again
+        phases = other.snapshot()
+        with self._lock:
+            for name, seconds in phases.items():
+                self.phases[prefix + name] = seconds
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.phases)
+
+    @property
+    def total(self):
+        return sum(self.snapshot().values())
+
+    def summary(self):
+        return ", ".join(f"{name}={seconds:.2f}s" for name, seconds in self.snapshot().items())
+
+    def server_timing(self):
+        """
+        Phases as an HTTP Server-Timing header value (durations in milliseconds).
+        """
+        return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.snapshot().items())
@@ -1,88 +1,217 @@
+import numpy as np
 import pandas as pd
+import argparse
 import os
-import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-INPUT_FILE = r"c:\Users\safal\Desktop\shl_assignment\data\raw\shl_catalogue.csv"
-OUTPUT_DIR = r"c:\Users\safal\Desktop\shl_assignment\data\processed"
-OUTPUT_FILE = os.path.join(OUTPUT_DIR, "shl_catalogue_clean.csv")
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUT_FILE = os.path.join(BASE_DIR, "data", "raw", "shl_catalogue.csv")
+OUTPUT_DIR = os.path.join(BASE_DIR, "data", "processed")
+OUTPUT_FILE = os.path.join(OUTPUT_DIR, "shl_catalogue_clean.parquet")
+MIN_ROWS = 377
+
+# Mapping rules based on analysis; anything not listed falls back to K
+TYPE_MAP = {
+    'K': 'K', 'S': 'K', 'A': 'K', 'AS': 'K', # Knowledge, Simulation, Ability
+    'P': 'P', 'B': 'P', 'D': 'P', 'C': 'P', 'BS': 'P', 'SB': 'P', 'E': 'P' # Personality, Behavioral, Dev, Competency
+}
+
+# Structured attributes served by the API. Values scraped from the product page win; otherwise
+# they are read from the description. Without either, duration stays missing and a flag is UNKNOWN:
+# a description that does not mention remote testing is no evidence that it is unsupported.
+ATTRIBUTE_COLUMNS = ['duration', 'adaptive_support', 'remote_support']
+UNKNOWN = 'Unknown'
+DURATION_PATTERN = r'(?i)minutes\s*=\s*(\d+)|(\d+)\s*(?:min|minute)'
+FLAG_PATTERNS = {
+    'adaptive_support': r'(?i)\badaptive\b|\bIRT\b',
+    'remote_support': r'(?i)\bremote\b|\bonline\b|unsupervised|unproctored'
+}
+YES_NO = {'yes': True, 'true': True, '1': True, 'no': False, 'false': False, '0': False}
 
 def clean_text(text):
-    if not isinstance(text, str):
-        return ""
-    # Remove HTML tags
-    text = re.sub(r'<[^>]+>', '', text)
-    # Remove "Description" prefix if present (case insensitive)
-    text = re.sub(r'^Description\s*', '', text, flags=re.IGNORECASE)
-    # Normalize whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
-
-def main():
-    if not os.path.exists(INPUT_FILE):
-        print(f"Error: Input file not found at {INPUT_FILE}")
-        return
+    """
+    Vectorized over a Series of descriptions; missing values become "".
+    """
+    return (
+        text.fillna("").astype(str)
+        # Remove HTML tags
+        .str.replace(r'<[^>]+>', '', regex=True)
+        # Remove "Description" prefix if present (case insensitive)
+        .str.replace(r'^Description\s*', '', regex=True, case=False)
+        # Normalize whitespace
+        .str.replace(r'\s+', ' ', regex=True)
+        .str.strip()
+    )
+
+def normalize_type(types):
+    return types.astype(str).str.strip().str.upper().map(TYPE_MAP).fillna('K')
+
+def structured_attributes(df):
+    """
+    Duration (nullable int minutes) and adaptive / remote support ("Yes" / "No" / UNKNOWN) per row,
+    vectorized. Also used by build_index.py for catalogues cleaned before these columns existed.
+    """
+    description = df['description'].fillna("").astype(str)
+    attributes = pd.DataFrame(index=df.index)
+
+    found = description.str.extract(DURATION_PATTERN)
+    duration = pd.to_numeric(found[0].fillna(found[1]), errors='coerce')
+    if 'duration' in df:
+        duration = pd.to_numeric(df['duration'], errors='coerce').fillna(duration)
+    attributes['duration'] = duration.astype('Int64')
 
-    print(f"Loading data from {INPUT_FILE}...")
-    df = pd.read_csv(INPUT_FILE)
-    initial_count = len(df)
-    print(f"Initial row count: {initial_count}")
-
-    # 1. Deduplicate
-    print("Removing duplicates...")
-    df = df.drop_duplicates(subset=['assessment_url'], keep='first')
-    print(f"Rows after deduplication: {len(df)}")
-
-    # 2. Filter empty URLs or Names
-    print("Filtering invalid rows...")
-    df = df.dropna(subset=['assessment_url', 'assessment_name'])
-    df = df[df['assessment_url'].str.strip() != '']
-    print(f"Rows after filtering: {len(df)}")
-
-    # 3. Clean Description
-    print("Cleaning descriptions...")
-    df['description'] = df['description'].fillna("")
-    df['description'] = df['description'].apply(clean_text)
-    
-    # Drops rows where description is empty after cleaning
-    initial_len = len(df)
-    df = df[df['description'] != ""]
-    print(f"Dropped {initial_len - len(df)} rows with empty descriptions.")
-    print(f"Rows after description filtering: {len(df)}")
-
-    # 4. Normalize Test Type
-    print("Normalizing test types...")
-    def normalize_type(t):
-        t = str(t).strip().upper()
-        # Mapping rules based on analysis
-        if t in ['K', 'S', 'A', 'AS']: # Knowledge, Simulation, Ability
-            return 'K'
-        elif t in ['P', 'B', 'D', 'C', 'BS', 'SB', 'E']: # Personality, Behavioral, Dev, Competency
-            return 'P'
+    for column, pattern in FLAG_PATTERNS.items():
+        # The description can only say yes; its silence leaves the flag unknown
+        flag = description.str.contains(pattern).map({True: True, False: None})
+        if column in df:
+            flag = df[column].astype(str).str.strip().str.lower().map(YES_NO).fillna(flag)
+        attributes[column] = flag.map({True: 'Yes', False: 'No'}).fillna(UNKNOWN)
+    return attributes
+
+def attribute_arrays(df):
+    """
+    structured_attributes as the fixed-width arrays of the metadata store: duration in
+    minutes (-1 when unknown) and adaptive / remote as 1 (Yes), 0 (No) or -1 (unknown).
+    """
+    attributes = structured_attributes(df)
+    codes = {'Yes': 1, 'No': 0, UNKNOWN: -1}
+    return {
+        "duration": attributes['duration'].fillna(-1).to_numpy(dtype=np.int32),
+        "adaptive": attributes['adaptive_support'].map(codes).to_numpy(dtype=np.int8),
+        "remote": attributes['remote_support'].map(codes).to_numpy(dtype=np.int8)
+    }
+
+def clean_chunk(chunk):
+    """
+    Cleans one chunk (runs in a worker process). Rows are kept so that deduplication,
+    which needs every URL seen so far, can run in the parent; 'valid' marks the usable ones.
+    """
+    chunk = chunk.copy()
+    chunk['description'] = clean_text(chunk['description'])
+    chunk['test_type'] = normalize_type(chunk['test_type'])
+    chunk[ATTRIBUTE_COLUMNS] = structured_attributes(chunk)
+    chunk['valid'] = (
+        chunk['assessment_name'].notna()
+        & chunk['assessment_url'].notna()
+        & (chunk['assessment_url'].fillna("").str.strip() != '')
+        & (chunk['description'] != "")
+    )
+    return chunk
+
+class ChunkWriter:
+    """
+    Appends cleaned chunks to a Parquet (pyarrow) or CSV file as they arrive.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.endswith(".parquet")
+        self._writer = None
+        self._tmp = path + ".tmp"
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp) # left over from an interrupted run
+
+    def write(self, df):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            # Every column is read as text (bar the parsed duration), so the schema is fixed even when
+            # a chunk's column is all null
+            schema = pa.schema([(column, pa.int64() if column == 'duration' else pa.string()) for column in df.columns])
+            table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self._tmp, schema)
+            self._writer.write_table(table)
         else:
-            return 'K' # Default fallback if unknown, or typically K
+            df.to_csv(self._tmp, mode='a', index=False, header=self._writer is None)
+            self._writer = True
+
+    def close(self):
+        if self._writer is None:
+            return
+        if self.parquet:
+            self._writer.close()
+        # Readers only ever see a complete file
+        os.replace(self._tmp, self.path)
+
+def iter_cleaned(chunks, workers):
+    """
+    Cleaned chunks in input order; with workers > 1 they are cleaned in a process pool,
+    a bounded number ahead of the consumer.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield clean_chunk(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(clean_chunk, chunk))
+            if len(pending) > workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def main(input_file=INPUT_FILE, output_file=OUTPUT_FILE, chunk_size=50000, workers=1):
+    if not os.path.exists(input_file):
+        print(f"Error: Input file not found at {input_file}")
+        return
+
+    print(f"Streaming data from {input_file} (chunks of {chunk_size}, {workers} worker(s))...")
+    start = time.perf_counter()
+    chunks = pd.read_csv(input_file, chunksize=chunk_size, dtype=str)
+
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    writer = ChunkWriter(output_file)
+    seen_urls = set()
+    counts = {"input": 0, "duplicates": 0, "invalid": 0, "output": 0}
+    type_counts = pd.Series(dtype=int)
+
+    for chunk in iter_cleaned(chunks, workers):
+        counts["input"] += len(chunk)
+        # 1. Deduplicate on URL (first occurrence wins, across chunks)
+        urls = chunk['assessment_url']
+        # Plain set lookups: Series.isin would copy the whole (growing) set on every chunk
+        duplicate = urls.duplicated() | pd.Series([u in seen_urls for u in urls], index=urls.index)
+        seen_urls.update(urls.dropna())
+        counts["duplicates"] += int(duplicate.sum())
+
+        # 2./3. Drop rows without URL/name or with an empty description after cleaning
+        keep = ~duplicate & chunk['valid']
+        counts["invalid"] += int((~duplicate & ~chunk['valid']).sum())
+        chunk = chunk[keep].drop(columns=['valid'])
+        if chunk.empty:
+            continue
+
+        # 4. Test types were normalized in the worker
+        type_counts = type_counts.add(chunk['test_type'].value_counts(), fill_value=0)
+        writer.write(chunk)
+        counts["output"] += len(chunk)
+
+    writer.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"Initial row count: {counts['input']}")
+    print(f"Removed {counts['duplicates']} duplicates, dropped {counts['invalid']} rows with missing URL/name or empty description.")
+    print(f"Test type distribution:\n{type_counts.astype(int).to_string()}")
 
-    df['test_type'] = df['test_type'].apply(normalize_type)
-    print(f"Test type distribution:\n{df['test_type'].value_counts()}")
-    
     # 5. Sanity Checks
     print("Running sanity checks...")
-    current_count = len(df)
-    if current_count < 377:
-        print(f"WARNING: Row count {current_count} is less than required 377!")
+    if counts["output"] < MIN_ROWS:
+        print(f"WARNING: Row count {counts['output']} is less than required {MIN_ROWS}!")
     else:
-        print(f"Row count check passed: {current_count} >= 377")
-
-    missing_urls = df['assessment_url'].isnull().sum()
-    if missing_urls > 0:
-        print(f"WARNING: Found {missing_urls} rows with missing URLs!")
+        print(f"Row count check passed: {counts['output']} >= {MIN_ROWS}")
 
-    # 6. Save
-    # print("Dropping assessment_url column...")
-    # df = df.drop(columns=['assessment_url'], errors='ignore')
-    
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    df.to_csv(OUTPUT_FILE, index=False)
-    print(f"Cleaned data saved to {OUTPUT_FILE}")
+    print(f"Cleaned data saved to {output_file}")
+    print(f"Processed {counts['input']} rows in {elapsed:.2f}s ({counts['input'] / elapsed if elapsed else 0:,.0f} rows/s)")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Clean the scraped SHL catalogue.")
+    parser.add_argument("--input", default=INPUT_FILE, help="Raw catalogue CSV")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="Output file (.parquet, or .csv)")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="Rows per chunk")
+    parser.add_argument("--workers", type=int, default=1, help="Processes cleaning chunks in parallel")
+    args = parser.parse_args()
+    main(args.input, args.output, args.chunk_size, args.workers)
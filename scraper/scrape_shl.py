@@ -1,47 +1,164 @@
+import argparse
 import asyncio
-import pandas as pd
-import random
-import time
-from playwright.async_api import async_playwright
+import json
 import os
+import re
+import time
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
 
-INPUT_CSV = r"c:\Users\safal\Desktop\shl_assignment\shl_catalogue.csv"
-OUTPUT_DIR = r"c:\Users\safal\Desktop\shl_assignment\data\raw"
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUT_CSV = os.path.join(BASE_DIR, "shl_catalogue.csv")
+OUTPUT_DIR = os.path.join(BASE_DIR, "data", "raw")
 OUTPUT_CSV = os.path.join(OUTPUT_DIR, "shl_catalogue.csv")
+# Append-only log of scraped descriptions (one JSON object per line); the CSV is written once at the end
+CHECKPOINT_FILE = os.path.join(OUTPUT_DIR, "shl_catalogue.scraped.jsonl")
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+# Selectors to try for description text
+# These are educated guesses based on common layouts.
+CONTENT_SELECTORS = [
+    ".product-description",
+    ".catalog-product-view__description",
+    "div[itemprop='description']",
+    ".product-detail__description"
+]
+CONTENT_CLASSES = {s[1:] for s in CONTENT_SELECTORS if s.startswith(".")}
+HEADER_TAGS = {"h2", "h3", "h4", "strong"}
+BLOCK_TAGS = {"p", "div", "li", "br", "ul", "ol", "tr", "h1", "h2", "h3", "h4", "h5", "h6"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+# Product page facts: "Approximate Completion Time in minutes = 30", and a yes/no circle
+# icon after the "Remote Testing" / "Adaptive/IRT" labels
+DURATION_PATTERN = re.compile(r"Completion Time in minutes\s*=\s*(\d+)", re.IGNORECASE)
+FLAG_LABELS = {"remote_support": "Remote Testing", "adaptive_support": "Adaptive/IRT"}
+ATTRIBUTE_COLUMNS = ["duration", *FLAG_LABELS]
+
+
+class HostRateLimiter:
+    """
+    At most `rate` requests per second to each host. Callers reserve the next free slot
+    for their host and sleep until it comes up, so concurrent workers never burst a host.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = {}
+
+    async def wait(self, url):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(host, 0.0))
+        self._next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class _DescriptionParser(HTMLParser):
+    """
+    Static-HTML version of the browser selectors: text of the first element matching
+    CONTENT_SELECTORS, else of the element following a "Description" header.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.found = {}  # "content" / "header" -> text parts
+        self._capture = None  # (kind, depth)
+        self._header = None  # text parts of the header being read
+        self._after_header = False
+
+    def _start_capture(self, kind):
+        if kind not in self.found:
+            self.found[kind] = []
+            self._capture = (kind, 1)
 
-async def scrape_description(page, url):
+    def handle_starttag(self, tag, attrs):
+        if self._capture:
+            kind, depth = self._capture
+            if tag in BLOCK_TAGS:
+                self.found[kind].append("\n")
+            if tag not in VOID_TAGS:
+                self._capture = (kind, depth + 1)
+            return
+        attrs = dict(attrs)
+        classes = set((attrs.get("class") or "").split())
+        if classes & CONTENT_CLASSES or (tag == "div" and attrs.get("itemprop") == "description"):
+            self._start_capture("content")
+        elif self._after_header and tag not in VOID_TAGS:
+            self._after_header = False
+            self._start_capture("header")
+        elif tag in HEADER_TAGS:
+            self._header = []
+
+    def handle_endtag(self, tag):
+        if self._capture:
+            kind, depth = self._capture
+            if tag in BLOCK_TAGS:
+                self.found[kind].append("\n")
+            self._capture = (kind, depth - 1) if depth > 1 else None
+        elif self._header is not None and tag in HEADER_TAGS:
+            self._after_header = "".join(self._header).strip() == "Description"
+            self._header = None
+
+    def handle_data(self, data):
+        if self._capture:
+            self.found[self._capture[0]].append(data)
+        elif self._header is not None:
+            self._header.append(data)
+
+
+def extract_attributes(html):
+    """
+    Duration and remote / adaptive support from a product page; None where the page does not say.
+    """
+    match = DURATION_PATTERN.search(html)
+    attributes = {"duration": int(match.group(1)) if match else None}
+    for column, label in FLAG_LABELS.items():
+        flag = re.search(re.escape(label) + r":?\s*(?:<[^>]*>\s*)*?<span[^>]*catalogue__circle([^\"']*)", html)
+        attributes[column] = None if flag is None else ("Yes" if "-yes" in flag.group(1) else "No")
+    return attributes
+
+
+def extract_description(html):
+    parser = _DescriptionParser()
+    parser.feed(html)
+    for kind in ("content", "header"):
+        lines = (line.strip() for line in "".join(parser.found.get(kind, [])).splitlines())
+        text = "\n".join(line for line in lines if line)
+        if len(text) > 10:
+            return text
+    return ""
+
+
+async def scrape_page(page, url, selector_timeout=3000):
+    """
+    Description and extract_attributes() of a product page, rendered in the browser.
+    """
     try:
         print(f"Visiting: {url}")
         await page.goto(url, timeout=60000, wait_until="domcontentloaded")
-        
-        await asyncio.sleep(1) 
-        
+
+        # Wait for the description to render instead of sleeping a fixed time
+        try:
+            await page.locator(", ".join(CONTENT_SELECTORS)).first.wait_for(timeout=selector_timeout)
+        except Exception:
+            pass
+
         description = ""
-        
-        # Selectors to try for description text
-        # These are educated guesses based on common layouts. 
-        # browser_subagent showed a "Description" header.
-        content_selectors = [
-            ".product-description", 
-            ".catalog-product-view__description", 
-            "div[itemprop='description']",
-            ".product-detail__description"
-        ]
-        
-        for selector in content_selectors:
+        for selector in CONTENT_SELECTORS:
             if await page.locator(selector).count() > 0:
                 description = await page.locator(selector).inner_text()
                 break
-        
+
         if not description:
             try:
                 # Try finding a header with "Description" and getting the next sibling or parent text
-                # We use a regex to be case-insensitive and handle potential whitespace
-                # Look for h2, h3, h4, or strong/b tags that might be headers
-                potential_headers = page.locator("h1, h2, h3, h4, h5, h6, strong, b").filter(has_text=pd.Series(["Description"]).str.contains("Description", case=False, regex=False).any() if False else "Description") 
-                # Playwright filter is simpler:
                 potential_headers = page.locator("h2, h3, h4, strong").filter(has_text="Description")
-                
+
                 count = await potential_headers.count()
                 for i in range(count):
                     header = potential_headers.nth(i)
@@ -53,7 +170,7 @@ async def scrape_description(page, url):
                             if len(text.strip()) > 10:
                                 description = text
                                 break
-                        
+
                         # Attempt 2: Parent text
                         parent = header.locator("xpath=..")
                         text = await parent.inner_text()
@@ -61,80 +178,187 @@ async def scrape_description(page, url):
                         if len(cleaned) > 10:
                             description = cleaned
                             break
-            except Exception as e:
+            except Exception:
                 pass
 
+        return {"description": description.strip(), **extract_attributes(await page.content())}
 
-        if not description:
-             # Last ditch: grabbed specific div from previous observation if possible?
-             # Just return empty string if fail.
-             pass
+    except Exception as e:
+        print(f"Error scraping {url}: {e}")
+        return {"description": ""}
 
-        return description.strip()
 
+def fetch_page_http(session, url, timeout=30):
+    """
+    Plain GET + static HTML parsing, for pages whose description is server-rendered.
+    """
+    try:
+        print(f"Fetching: {url}")
+        response = session.get(url, timeout=timeout)
+        response.raise_for_status()
+        return {"description": extract_description(response.text), **extract_attributes(response.text)}
     except Exception as e:
-        print(f"Error scraping {url}: {e}")
-        return ""
+        print(f"Error fetching {url}: {e}")
+        return {"description": ""}
+
+
+def load_checkpoint(path):
+    """
+    url -> scraped record (description and page attributes) for every page already scraped (later lines win).
+    A crash can leave a torn last line; it is cut from the file, so the next run's records
+    start on a line of their own and that page is scraped again.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    valid_bytes = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("no line end")
+                record = json.loads(line)
+            except ValueError:
+                print(f"Ignoring incomplete checkpoint entry {line[:80]!r} and anything after it")
+                break
+            done[record.pop("url")] = record
+            valid_bytes += len(line)
+    if valid_bytes < os.path.getsize(path):
+        with open(path, 'r+b') as f:
+            f.truncate(valid_bytes)
+    return done
+
+
+async def crawl(urls, fetch, concurrency, rate, checkpoint_file):
+    """
+    Runs fetch(worker_id, url) -> record over urls with `concurrency` workers fed from a queue,
+    appending each result to the checkpoint log as soon as it arrives.
+    """
+    queue = asyncio.Queue()
+    for url in urls:
+        queue.put_nowait(url)
+    limiter = HostRateLimiter(rate)
+    results = {}
+    start = time.perf_counter()
+
+    with open(checkpoint_file, "a", encoding="utf-8") as log:
+        async def worker(worker_id):
+            while True:
+                try:
+                    url = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await limiter.wait(url)
+                record = await fetch(worker_id, url)
+
+                # Clean up description (remove 'Description' header text if it was captured)
+                if record["description"].startswith("Description"):
+                    record["description"] = record["description"][11:].strip()
+                results[url] = record
+                log.write(json.dumps({"url": url, **record}) + "\n")
+                log.flush()
+                if len(results) % 10 == 0:
+                    elapsed = time.perf_counter() - start
+                    print(f"Progress: {len(results)}/{len(urls)} pages ({len(results) / elapsed:.2f} pages/s)")
 
-async def main():
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return results
+
+
+async def main(input_csv=INPUT_CSV, output_csv=OUTPUT_CSV, checkpoint_file=CHECKPOINT_FILE,
+               mode="browser", concurrency=4, rate=2.0, selector_timeout=3000):
     # Resume from output if exists, else start from input
-    if os.path.exists(OUTPUT_CSV):
-        print(f"Resuming from {OUTPUT_CSV}")
-        df = pd.read_csv(OUTPUT_CSV)
-    elif os.path.exists(INPUT_CSV):
-        print(f"Starting fresh from {INPUT_CSV}")
-        df = pd.read_csv(INPUT_CSV)
+    if os.path.exists(output_csv):
+        print(f"Resuming from {output_csv}")
+        df = pd.read_csv(output_csv)
+    elif os.path.exists(input_csv):
+        print(f"Starting fresh from {input_csv}")
+        df = pd.read_csv(input_csv)
     else:
-        print(f"Input file not found: {INPUT_CSV}")
+        print(f"Input file not found: {input_csv}")
         return
 
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    
+    os.makedirs(os.path.dirname(output_csv) or ".", exist_ok=True)
+    os.makedirs(os.path.dirname(checkpoint_file) or ".", exist_ok=True)
     print(f"Loaded {len(df)} rows")
-    
+
     # Ensure description column exists and is string type
     if 'description' not in df.columns:
         df['description'] = ""
-    
-    # Fill NaN with empty string to avoid dtype issues
     df['description'] = df['description'].fillna("").astype(str)
 
+    # Pages scraped by an interrupted run come back from the checkpoint log
+    scraped = load_checkpoint(checkpoint_file)
+    missing = df['description'].str.strip() == ""
+    from_log = df['assessment_url'].map(lambda u: scraped.get(u, {}).get("description")).fillna("")
+    df.loc[missing, 'description'] = from_log[missing]
+
+    needs_page = df['description'].str.strip() == ""
+    if not all(column in df for column in ATTRIBUTE_COLUMNS):
+        # Catalogues scraped before page attributes were collected are crawled once more for them
+        needs_page[:] = True
+    urls = df.loc[needs_page, 'assessment_url']
+    urls = [u for u in urls.dropna().astype(str).unique()
+            if u.startswith('http') and not scraped.get(u, {}).get("description")]
+    print(f"{len(urls)} pages to scrape ({mode} mode, {concurrency} workers, {rate} req/s per host)")
+
+    start = time.perf_counter()
+    if mode == "http":
+        with requests.Session() as session:
+            # Keep-alive connections, one per worker
+            adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = USER_AGENT
+
+            async def fetch(worker_id, url):
+                return await asyncio.to_thread(fetch_page_http, session, url)
+
+            results = await crawl(urls, fetch, concurrency, rate, checkpoint_file)
+    else:
+        from playwright.async_api import async_playwright
+
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=True)
+            # One context, so the pages share a connection pool and cookies
+            context = await browser.new_context(user_agent=USER_AGENT)
+            pages = [await context.new_page() for _ in range(concurrency)]
+
+            async def fetch(worker_id, url):
+                return await scrape_page(pages[worker_id], url, selector_timeout)
+
+            results = await crawl(urls, fetch, concurrency, rate, checkpoint_file)
+            await browser.close()
+
+    elapsed = time.perf_counter() - start
+    records = {**scraped, **results}
+    # Descriptions already in the CSV are kept (a page may only have been revisited for its attributes)
+    df['description'] = [desc if desc.strip() else (records.get(url) or {}).get("description") or desc
+                         for url, desc in zip(df['assessment_url'], df['description'])]
+    # Page attributes (duration, remote / adaptive support) go to their own columns for clean_shl.py
+    for column in ATTRIBUTE_COLUMNS:
+        values = df['assessment_url'].map(lambda u: (records.get(u) or {}).get(column))
+        df[column] = values.combine_first(df[column]) if column in df else values
+    tmp = output_csv + ".tmp"
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, output_csv)
+    empty = sum(1 for record in results.values() if not record["description"])
+    print(f"Completed {len(results)} pages in {elapsed:.1f}s"
+          + (f" ({len(results) / elapsed:.2f} pages/s)" if elapsed else "")
+          + (f", {empty} without a description (rerun to retry)" if empty else ""))
+    print(f"Saved to {output_csv}")
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context(
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        )
-        page = await context.new_page()
-
-        for index, row in df.iterrows():
-            url = row.get('assessment_url')
-            if pd.isna(url) or not str(url).startswith('http'):
-                continue
-            
-            # Resume capability
-            if pd.notna(row.get('description')) and str(row.get('description')).strip() != "":
-                continue
-
-            desc = await scrape_description(page, url)
-            
-            # Clean up description (remove 'Description' header text if it was captured)
-            if desc.startswith("Description"):
-                desc = desc[11:].strip()
-            
-            df.at[index, 'description'] = desc
-            
-            if index % 10 == 0:
-                df.to_csv(OUTPUT_CSV, index=False)
-                print(f"Progress saved at index {index}")
-            
-            val = random.uniform(1.0, 2.0)
-            await asyncio.sleep(val)
-
-        df.to_csv(OUTPUT_CSV, index=False)
-        print(f"Completed. Saved to {OUTPUT_CSV}")
-        
-        await browser.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Scrape SHL product descriptions.")
+    parser.add_argument("--input", default=INPUT_CSV, help="Catalogue CSV with assessment_url")
+    parser.add_argument("--output", default=OUTPUT_CSV, help="Output CSV (also resumed from if present)")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="Append-only log of scraped pages")
+    parser.add_argument("--mode", choices=["browser", "http"], default="browser",
+                        help="browser: Playwright (JS rendered); http: plain GET with static HTML parsing")
+    parser.add_argument("--concurrency", type=int, default=4, help="Pages (browser) or connections (http) in flight")
+    parser.add_argument("--rate", type=float, default=2.0, help="Max requests per second per host (0 = unlimited)")
+    parser.add_argument("--selector-timeout", type=int, default=3000, help="ms to wait for the description to render")
+    args = parser.parse_args()
+    asyncio.run(main(args.input, args.output, args.checkpoint, args.mode, args.concurrency, args.rate,
+                     args.selector_timeout))
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+from recommender import build_index as build
+
+
+def fake_embed(chunks, hashes, cache):
+    # Deterministic unit vectors keyed by chunk hash, in place of the sentence-transformer
+    vectors = []
+    for h in hashes:
+        seed = int(hashlib.sha1(h.encode("utf-8")).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).standard_normal(16).astype(np.float32)
+        vectors.append(vector / np.linalg.norm(vector))
+    return np.vstack(vectors)
+
+
+def catalogue(n=50):
+    return pd.DataFrame({
+        "assessment_name": [f"Assessment {i}" for i in range(n)],
+        "assessment_url": [f"https://example.com/product/{i}" for i in range(n)],
+        "test_type": ["Knowledge & Skills"] * n,
+        "description": [f"Measures skill number {i}. Test length 20 minutes." for i in range(n)],
+    })
+
+
+def setup_paths(monkeypatch, tmp_path):
+    csv_path = str(tmp_path / "catalogue.csv")
+    monkeypatch.setattr(build, "catalogue_path", lambda: csv_path)
+    monkeypatch.setattr(build, "resolve_index_dir", lambda: str(tmp_path))
+    monkeypatch.setattr(build, "INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(build, "CURRENT_FILE", str(tmp_path / "CURRENT"))
+    monkeypatch.setattr(build, "embed_chunks", fake_embed)
+    return csv_path
+
+
+def test_incremental_rebuild_keeps_previous_index_config(monkeypatch, tmp_path):
+    csv_path = setup_paths(monkeypatch, tmp_path)
+    df = catalogue()
+    df.to_csv(csv_path, index=False)
+    build.build_index(index_type="hnsw", ef_search=64)
+    with open(tmp_path / "index_config.json") as f:
+        before = json.load(f)
+
+    # HNSW cannot remove vectors, so the changed row forces a rebuild
+    df.loc[3, "description"] = "Updated description."
+    df.to_csv(csv_path, index=False)
+    build.build_index(incremental=True)
+    with open(tmp_path / "index_config.json") as f:
+        after = json.load(f)
+
+    assert after == before
+    assert after["index_type"] == "hnsw"
+    assert after["factory"] != "IDMap2,Flat"
+    assert after["ef_search"] == 64
+
+
+def test_versions_built_in_the_same_second_do_not_collide(monkeypatch, tmp_path):
+    monkeypatch.setattr(build, "VERSIONS_DIR", str(tmp_path / "versions"))
+    monkeypatch.setattr(build.time, "strftime", lambda fmt: "20240101-120000")
+
+    versions = [build.new_version() for _ in range(3)]
+    assert versions == ["20240101-120000", "20240101-120000-01", "20240101-120000-02"]
+    assert sorted(versions) == versions
+
+
+def test_incremental_rebuild_honours_an_explicit_new_index_type(monkeypatch, tmp_path):
+    csv_path = setup_paths(monkeypatch, tmp_path)
+    catalogue().to_csv(csv_path, index=False)
+    build.build_index(index_type="hnsw", ef_search=64)
+
+    build.build_index(index_type="flat", incremental=True)
+    with open(tmp_path / "index_config.json") as f:
+        config = json.load(f)
+
+    assert config["index_type"] == "flat"
+    assert config["factory"] == "IDMap2,Flat"
+    assert config["ef_search"] is None
@@ -0,0 +1,35 @@
+import sqlite3
+from recommender import cache as cache_module
+from recommender.cache import LRUCache
+
+
+def disk_rows(path, table):
+    with sqlite3.connect(path) as db:
+        return [row[0] for row in db.execute(f"SELECT key FROM {table} ORDER BY rowid")]
+
+
+def test_disk_table_is_bounded(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache_module, "PRUNE_INTERVAL", 5)
+    path = str(tmp_path / "cache.sqlite")
+    cache = LRUCache(max_size=10, db_path=path, table="analysis")
+    for i in range(100):
+        cache.set(f"q{i}", {"i": i})
+
+    keys = disk_rows(path, "analysis")
+    assert keys == [f"q{i}" for i in range(90, 100)]
+    # A restart keeps serving what is left on disk
+    assert LRUCache(max_size=10, db_path=path, table="analysis").get("q95") == {"i": 95}
+
+
+def test_expired_rows_are_purged_while_running(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache_module, "PRUNE_INTERVAL", 5)
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    path = str(tmp_path / "cache.sqlite")
+    cache = LRUCache(max_size=100, ttl=10, db_path=path, table="analysis")
+    for i in range(4):
+        cache.set(f"old{i}", i)
+    now[0] += 60
+    cache.set("new", 1) # fifth write prunes
+
+    assert disk_rows(path, "analysis") == ["new"]
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+from recommender.index_factory import build_ann_index, is_id_mapped
+
+
+def random_vectors(n, dim=32, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("with_ids", [True, False])
+def test_ivf_trained_on_sample_keeps_all_vectors(with_ids):
+    vectors = random_vectors(2000)
+    ids = np.arange(2000, dtype=np.int64) * 7 + 11 if with_ids else None
+
+    index, spec = build_ann_index(vectors, "ivf_flat", ids=ids, nlist=16, max_train_points=1000)
+
+    assert index.ntotal == len(vectors)
+    assert is_id_mapped(index) == with_ids
+    index.nprobe = 16
+    _, labels = index.search(vectors[:5], 1)
+    expected = ids[:5] if with_ids else np.arange(5)
+    assert labels[:, 0].tolist() == expected.tolist()
@@ -0,0 +1,52 @@
+import csv
+import pandas as pd
+import predict
+
+
+class FakeEngine:
+    calls = []
+
+    def __init__(self, **kwargs):
+        pass
+
+    def recommend_batch(self, queries):
+        FakeEngine.calls.append(list(queries))
+        return [[{"assessment_url": f"{q}/{k}"} for k in range(2)] for q in queries]
+
+    def shutdown(self):
+        pass
+
+
+def read_rows(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.reader(f))[1:]
+
+
+def test_resume_from_torn_checkpoint(monkeypatch, tmp_path):
+    monkeypatch.setattr(predict, "RecommendationEngine", FakeEngine)
+    monkeypatch.setattr(predict, "CACHE_DB", str(tmp_path / "cache.sqlite"))
+    queries = ["java", "multi\nline", "sales", "java", "excel", "sql", "java"]
+    input_file, output_file = str(tmp_path / "in.csv"), str(tmp_path / "out.csv")
+    checkpoint_file = output_file + ".done"
+    pd.DataFrame({"Query": queries}).to_csv(input_file, index=False)
+    expected = [[q, f"{q}/{k}"] for q in queries for k in range(2)]
+
+    predict.generate_predictions(input_file, output_file, batch_size=2, workers=1)
+    assert read_rows(output_file) == expected
+    assert FakeEngine.calls == [["java", "multi\nline"], ["sales"], ["excel", "sql"]]
+
+    # Crash mid-write: the last checkpoint line is torn and its rows are partly on disk
+    with open(checkpoint_file, 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
+    with open(checkpoint_file, 'wb') as f:
+        f.write(b"".join(lines[:4]) + lines[4][:1])
+    with open(output_file, newline='', encoding='utf-8') as f:
+        partial = list(csv.reader(f))[:10]
+    with open(output_file, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(partial)
+
+    FakeEngine.calls = []
+    predict.generate_predictions(input_file, output_file, batch_size=2, workers=1)
+    assert read_rows(output_file) == expected
+    assert FakeEngine.calls == [["excel", "sql"], ["java"]]
+    assert len(predict.load_checkpoint(checkpoint_file)) == len(queries)
@@ -0,0 +1,22 @@
+import pytest
+from recommender.query_processor import QueryProcessor
+
+
+class FakeAnalyzer:
+    def analyze(self, query):
+        return {"skills": [query], "required_test_types": ["K"], "confidence": 1.0, "source": "local"}
+
+
+def test_local_mode_without_analyzer_never_calls_gemini(monkeypatch):
+    processor = QueryProcessor(api_key="key", mode="local")
+    monkeypatch.setattr(processor, "_call_llm", lambda query: pytest.fail("Gemini was called"))
+
+    with pytest.raises(ValueError):
+        processor.analyze("java developer")
+    with pytest.raises(ValueError):
+        QueryProcessor(api_key="key").analyze("java developer", mode="local")
+
+
+def test_local_mode_uses_the_analyzer():
+    processor = QueryProcessor(api_key="key", local_analyzer=FakeAnalyzer(), mode="local")
+    assert processor.analyze("java")["source"] == "local"
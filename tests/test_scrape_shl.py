@@ -0,0 +1,107 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+import pytest
+from scraper import scrape_shl
+
+PAGES = {
+    "/product/java/": """<html><body><h1>Java 8 (New)</h1>
+        <div class="product-description"><p>Multi-choice test that measures knowledge of Java 8.</p></div>
+        <p>Approximate Completion Time in minutes = 18</p>
+        <p>Remote Testing: <span class="catalogue__circle -yes"></span></p>
+        <p>Adaptive/IRT: <span class="catalogue__circle"></span></p></body></html>""",
+    "/product/opq/": """<html><body><h3>Description</h3>
+        <div>Personality questionnaire describing behavioural style at work.</div></body></html>""",
+    "/product/sales/": """<html><body><div itemprop="description">Situational judgement for sales roles.</div>
+        <p>Remote Testing: <span class="catalogue__circle -yes"></span></p></body></html>""",
+    "/product/excel/": """<html><body><div class="product-description">Excel 365 simulation.</div></body></html>""",
+}
+RATE = 10.0
+
+
+class FixtureServer(ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FixtureHandler)
+        self.requests = [] # (monotonic time, path)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append((time.monotonic(), self.path))
+        body = PAGES.get(self.path)
+        self.send_response(200 if body else 404)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.end_headers()
+        self.wfile.write((body or "not found").encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv("NO_PROXY", "127.0.0.1")
+    server = FixtureServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def write_catalogue(path, server, paths):
+    pd.DataFrame({
+        "assessment_name": [p.strip("/").split("/")[-1] for p in paths],
+        "assessment_url": [server.base_url + p for p in paths],
+    }).to_csv(path, index=False)
+
+
+def run_scraper(tmp_path, concurrency=4):
+    output_csv = tmp_path / "out.csv"
+    asyncio.run(scrape_shl.main(str(tmp_path / "in.csv"), str(output_csv), str(tmp_path / "scraped.jsonl"),
+                                mode="http", concurrency=concurrency, rate=RATE))
+    return pd.read_csv(output_csv).set_index("assessment_name")
+
+
+def test_crawl_extracts_pages_within_the_rate_limit(server, tmp_path):
+    write_catalogue(tmp_path / "in.csv", server, list(PAGES) + ["/product/missing/"])
+    out = run_scraper(tmp_path)
+
+    assert out.loc["java", "description"] == "Multi-choice test that measures knowledge of Java 8."
+    assert (out.loc["java", "duration"], out.loc["java", "remote_support"], out.loc["java", "adaptive_support"]) \
+        == (18, "Yes", "No")
+    assert out.loc["opq", "description"].startswith("Personality questionnaire")
+    assert out.loc["sales", "description"] == "Situational judgement for sales roles."
+    assert out.loc["sales", "remote_support"] == "Yes" and pd.isna(out.loc["sales", "adaptive_support"])
+    assert pd.isna(out.loc["excel", "duration"]) and pd.isna(out.loc["missing", "description"])
+
+    # Four workers, one host: requests still arrive at most RATE per second
+    times = sorted(t for t, _ in server.requests)
+    assert len(times) == 5
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert min(gaps) > 0.5 / RATE
+    assert times[-1] - times[0] > 0.9 * (len(times) - 1) / RATE
+
+
+def test_crawl_resumes_from_checkpoint(server, tmp_path):
+    write_catalogue(tmp_path / "in.csv", server, list(PAGES))
+    done = {"url": server.base_url + "/product/java/", "description": "From an earlier run.",
+            "duration": 18, "remote_support": "Yes", "adaptive_support": "No"}
+    with open(tmp_path / "scraped.jsonl", "w", encoding="utf-8") as f:
+        # An interrupted run: one finished page, then a torn line
+        f.write(json.dumps(done) + "\n" + '{"url": "' + server.base_url + '/product/opq/", "descr')
+    out = run_scraper(tmp_path, concurrency=2)
+
+    assert sorted(path for _, path in server.requests) == ["/product/excel/", "/product/opq/", "/product/sales/"]
+    assert out.loc["java", "description"] == "From an earlier run."
+    assert out.loc["java", "duration"] == 18
+    assert out.loc["opq", "description"].startswith("Personality questionnaire")
+    # Pages scraped in this run are appended to the log, so a further rerun fetches nothing
+    assert set(scrape_shl.load_checkpoint(str(tmp_path / "scraped.jsonl"))) == {server.base_url + p for p in PAGES}
@@ -0,0 +1,37 @@
+import re
+import numpy as np
+from recommender.skill_matcher import SkillMatcher
+
+
+def baseline_score(text, skills):
+    # The per-candidate scorer SkillMatcher replaced: one word-boundary search per skill
+    if not skills or not text:
+        return 0.0
+    text_lower = text.lower()
+    matched = sum(1 for skill in skills if re.search(r'\b' + re.escape(skill.lower()) + r'\b', text_lower))
+    return matched / len(skills)
+
+
+TEXTS = [
+    "Measures Java Script skills and core Java programming.",
+    "For roles in project management and people management.",
+    "Project Management Office essentials for senior project managers.",
+    "Covers C++, Node.js services and SQL Server administration.",
+    "A short sales aptitude test.",
+]
+
+
+def test_overlapping_skills_match_baseline():
+    matcher = SkillMatcher(TEXTS)
+    skill_sets = [
+        ["java", "java script"],
+        ["java script", "script"],
+        ["project management", "management"],
+        ["project management", "project management office"],
+        ["sql", "sql server", "server administration", "c++", "node.js"],
+        ["sales aptitude", "aptitude test", "sales"],
+    ]
+    doc_ids = np.arange(len(TEXTS))
+    for skills in skill_sets:
+        expected = [baseline_score(text, skills) for text in TEXTS]
+        np.testing.assert_allclose(matcher.score(doc_ids, skills), expected, err_msg=str(skills))
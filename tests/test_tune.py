@@ -0,0 +1,69 @@
+import itertools
+import numpy as np
+import tune
+from recommender.recommendation_engine import BALANCE_POLICIES, RecommendationEngine
+
+
+class FakeSkillMatcher:
+    def __init__(self, scores):
+        self.scores = scores
+
+    def score(self, ids, skills):
+        return self.scores[ids]
+
+
+class FakeRetriever:
+    def __init__(self, num_rows, rng):
+        self.skill_matcher = FakeSkillMatcher(rng.random(num_rows))
+        self.vectors = rng.standard_normal((num_rows, 8)).astype(np.float32)
+
+    def get_vectors(self, ids):
+        return self.vectors[ids]
+
+
+def fixture_engine(rng, num_rows):
+    # Only the state _rank reads; no index, encoder or analyzer
+    engine = object.__new__(RecommendationEngine)
+    engine.retriever = FakeRetriever(num_rows, rng)
+    engine.cross_encoder = None
+    return engine
+
+
+def fixture_candidates(rng, num_rows, lengths):
+    candidates = []
+    for length in lengths:
+        rows = rng.choice(num_rows, size=length, replace=False)
+        scores = np.sort(rng.random(length))[::-1]
+        candidates.append([{
+            "id": int(row), "score": float(score), "assessment_name": f"A{row}", "assessment_url": f"/a/{row}",
+            "test_type": rng.choice(["K", "P", "A"], p=[0.5, 0.35, 0.15]), "test_types": [], "description": "",
+            "duration": None, "adaptive_support": "Unknown", "remote_support": "Unknown"
+        } for row, score in zip(rows, scores)])
+    return candidates
+
+
+def test_grid_ranking_matches_engine_rank():
+    rng = np.random.default_rng(0)
+    engine = fixture_engine(rng, 200)
+    candidates = fixture_candidates(rng, 200, [40, 40, 25, 40, 12])
+    analyses = [{"skills": [], "required_test_types": types} for types in (["K", "P"], ["K"], ["P"], [], ["K", "P"])]
+
+    vector, skill, is_k, is_p, _, valid, needs_k, needs_p, similarity = tune.candidate_arrays(
+        engine, candidates, analyses, [[] for _ in candidates]
+    )
+    # Relevance is each candidate's 1-based position, so the "relevance" tune ranks is the candidate itself
+    rel = np.where(valid, np.arange(1, vector.shape[1] + 1), 0).astype(np.float64)
+    weights = [0.0, 0.3, 0.7, 1.0]
+
+    for pool_size, mmr_lambda, policy in itertools.product((10, 25, 40), (1.0, 0.7), BALANCE_POLICIES):
+        order = tune.score_order(weights, pool_size, mmr_lambda, vector, skill, valid, similarity)
+        ranked = tune.ranked_relevance(order, pool_size, policy, is_k, is_p, rel, valid, needs_k, needs_p)
+        engine.balance_policy, engine.mmr_lambda = policy, mmr_lambda
+        for w, weight in enumerate(weights):
+            engine.vector_weight = weight
+            for q, (cands, analysis) in enumerate(zip(candidates, analyses)):
+                position = {c["assessment_name"]: i + 1 for i, c in enumerate(cands)}
+                results = engine._rank([dict(c) for c in cands[:pool_size]], analysis, max_results=tune.MAX_RESULTS)
+                expected = [position[r["assessment_name"]] for r in results]
+                expected += [0] * (tune.MAX_RESULTS - len(expected))
+                assert ranked[w, q].tolist() == expected, (pool_size, mmr_lambda, policy, weight, q)
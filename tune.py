@@ -0,0 +1,211 @@
+import pandas as pd
+import argparse
+import itertools
+import json
+import os
+import time
+import numpy as np
+from evaluate import LABELED_DATA, OUTPUT_DIR, collect, ranking_metric_arrays
+from predict import CACHE_DB
+from recommender.cache import LRUCache
+from recommender.diversity import MMR_DEPTH_FACTOR, mmr_order, similarity_matrix
+from recommender.recommendation_engine import BALANCE_POLICIES, RERANK_CONFIG_FILE, RecommendationEngine
+
+GRID_FILE = os.path.join(OUTPUT_DIR, "rerank_grid.json")
+MAX_RESULTS = 10
+
+def candidate_arrays(engine, candidates, analyses, relevant_lists):
+    """
+    The cached candidate pool as (num_queries, pool) arrays: vector score, skill score,
+    K / P test type, relevance and validity (short pools are padded),
+    plus which test types each query's analysis asks for and the pairwise
+    similarity of each pool's stored vectors, (num_queries, pool, pool).
+    """
+    num_queries = len(candidates)
+    depth = max(len(c) for c in candidates)
+    vector = np.zeros((num_queries, depth))
+    skill = np.zeros((num_queries, depth))
+    is_k = np.zeros((num_queries, depth), dtype=bool)
+    is_p = np.zeros((num_queries, depth), dtype=bool)
+    rel = np.zeros((num_queries, depth))
+    valid = np.zeros((num_queries, depth), dtype=bool)
+    needs_k = np.zeros(num_queries, dtype=bool)
+    needs_p = np.zeros(num_queries, dtype=bool)
+    similarity = np.zeros((num_queries, depth, depth), dtype=np.float32)
+
+    for i, (cands, analysis, relevant) in enumerate(zip(candidates, analyses, relevant_lists)):
+        n = len(cands)
+        relevant = set(relevant)
+        vector[i, :n] = [c['score'] for c in cands]
+        skill[i, :n] = engine._calculate_skill_scores(cands, analysis.get('skills', []))
+        is_k[i, :n] = [c['test_type'] == 'K' for c in cands]
+        is_p[i, :n] = [c['test_type'] == 'P' for c in cands]
+        rel[i, :n] = [c['assessment_name'] in relevant for c in cands]
+        valid[i, :n] = True
+        required = analysis.get('required_test_types', ['K', 'P'])
+        needs_k[i] = 'K' in required
+        needs_p[i] = 'P' in required
+        if n:
+            similarity[i, :n, :n] = similarity_matrix(engine.retriever.get_vectors([c['id'] for c in cands]))
+    return vector, skill, is_k, is_p, rel, valid, needs_k, needs_p, similarity
+
+def score_order(weights, pool_size, mmr_lambda, vector, skill, valid, similarity):
+    """
+    Candidate order before balancing for every weight at once, (num_weights, num_queries, pool):
+    stable sort by the weighted score, or MMR over it. Shared by all balancing policies.
+    """
+    w = np.asarray(weights)[:, None, None]
+    scores = w * vector + (1 - w) * skill # (W, Q, pool)
+    in_pool = valid & (np.arange(vector.shape[1]) < pool_size)
+    scores = np.where(in_pool, scores, -np.inf)
+    if mmr_lambda >= 1.0:
+        return np.argsort(-scores, axis=-1, kind="stable")
+    return mmr_order(scores, similarity, mmr_lambda, k=MMR_DEPTH_FACTOR * MAX_RESULTS)
+
+def ranked_relevance(order, pool_size, policy, is_k, is_p, rel, valid, needs_k, needs_p):
+    """
+    Relevance of the top MAX_RESULTS for every weight at once, shape (num_weights, num_queries, MAX_RESULTS).
+    Mirrors RecommendationEngine._rank: the balancing policy applied to score_order's order.
+    """
+    shape = order.shape
+    keep = valid & (np.arange(valid.shape[1]) < pool_size)
+    only_k = needs_k & ~needs_p
+    only_p = needs_p & ~needs_k
+    both = needs_k & needs_p
+    if policy != "none":
+        # A single required type drops everything else
+        keep = keep & ~(only_k[:, None] & ~is_k) & ~(only_p[:, None] & ~is_p)
+    if policy == "require_types":
+        # Only K and P candidates take part when both are required
+        keep = keep & ~(both[:, None] & ~(is_k | is_p))
+    keep = np.broadcast_to(keep, shape)
+
+    # Dropped candidates move to the back, the kept ones stay in order
+    ranked_keep = np.take_along_axis(keep, order, axis=-1)
+    order = np.take_along_axis(order, np.argsort(~ranked_keep, axis=-1, kind="stable"), axis=-1)
+    ranked_keep = np.take_along_axis(keep, order, axis=-1)
+    ranked_rel = np.take_along_axis(np.broadcast_to(rel, shape), order, axis=-1) * ranked_keep
+
+    if policy == "require_types":
+        # Best K first, then the best other P, then the rest in score order
+        position = np.broadcast_to(np.arange(order.shape[-1], dtype=np.float64), shape).copy()
+        for member, slot in ((is_k, -2.0), (is_p, -1.0)):
+            # Positions already pinned (the first K may also be P) are not eligible
+            is_type = np.take_along_axis(np.broadcast_to(member, shape), order, axis=-1) & ranked_keep & (position >= 0)
+            first = is_type.argmax(axis=-1)
+            pin = both[None, :] & is_type.any(axis=-1)
+            idx = first[..., None]
+            current = np.take_along_axis(position, idx, axis=-1)
+            np.put_along_axis(position, idx, np.where(pin[..., None], slot, current), axis=-1)
+        reorder = np.argsort(position, axis=-1, kind="stable")
+        ranked_rel = np.take_along_axis(ranked_rel, reorder, axis=-1)
+
+    top = ranked_rel[..., :MAX_RESULTS]
+    if top.shape[-1] < MAX_RESULTS:
+        top = np.pad(top, [(0, 0)] * (top.ndim - 1) + [(0, MAX_RESULTS - top.shape[-1])])
+    return top
+
+def grid_search(engine, candidates, analyses, relevant_lists, weights, pool_sizes, policies, mmr_lambdas=(1.0,)):
+    vector, skill, is_k, is_p, rel, valid, needs_k, needs_p, similarity = candidate_arrays(
+        engine, candidates, analyses, relevant_lists
+    )
+    num_relevant = [len(r) for r in relevant_lists]
+    rows = []
+    for pool_size, mmr_lambda in itertools.product(pool_sizes, mmr_lambdas):
+        order = score_order(weights, pool_size, mmr_lambda, vector, skill, valid, similarity)
+        for policy in policies:
+            ranked = ranked_relevance(order, pool_size, policy, is_k, is_p, rel, valid, needs_k, needs_p)
+            metrics = ranking_metric_arrays(ranked, num_relevant, (MAX_RESULTS,))
+            means = {name: values.mean(axis=-1) for name, values in metrics.items()}
+            for i, weight in enumerate(weights):
+                rows.append({
+                    "vector_weight": float(weight),
+                    "pool_size": int(pool_size),
+                    "balance": policy,
+                    "mmr_lambda": float(mmr_lambda),
+                    **{name: float(values[i]) for name, values in means.items()}
+                })
+    return rows
+
+def tune(labeled_path=LABELED_DATA, weights=None, pool_sizes=None, policies=BALANCE_POLICIES, mmr_lambdas=None,
+         metric="recall@10", output=RERANK_CONFIG_FILE, workers=16, analyzer_mode=None):
+    print("Initializing systems...")
+    analysis_cache = LRUCache(max_size=10000, db_path=CACHE_DB, table="analysis")
+    engine = RecommendationEngine(analysis_cache=analysis_cache)
+
+    df = pd.read_csv(labeled_path)
+    queries = df['query'].tolist()
+    relevant_lists = [[x.strip() for x in str(r).split('|')] for r in df['relevant_assessments']]
+
+    weights = np.round(np.linspace(0.0, 1.0, 21), 4) if weights is None else np.asarray(weights)
+    pool_sizes = sorted(set(pool_sizes or [10, 20, 30, 50]))
+    mmr_lambdas = sorted(set(mmr_lambdas or [1.0, 0.9, 0.8, 0.7, 0.5]), reverse=True)
+
+    # Retrieval and analysis happen once; every combination re-ranks the cached pool
+    start = time.perf_counter()
+    candidates, analyses, _ = collect(engine, queries, max(pool_sizes), workers, analyzer_mode)
+    candidates = engine.candidate_pools(queries, candidates, analyses, max(pool_sizes), MAX_RESULTS)
+    collect_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = grid_search(engine, candidates, analyses, relevant_lists, weights, pool_sizes, policies, mmr_lambdas)
+    grid_s = time.perf_counter() - start
+    print(f"Scored {len(rows)} combinations over {len(queries)} queries in {grid_s:.2f}s "
+          f"(retrieval and analysis {collect_s:.2f}s)")
+
+    current = next((r for r in rows if r["pool_size"] == engine.candidate_pool
+                    and r["balance"] == engine.balance_policy
+                    and np.isclose(r["mmr_lambda"], engine.mmr_lambda)
+                    and np.isclose(r["vector_weight"], engine.vector_weight)), None)
+    # Ties keep the current settings, then go to the smaller (cheaper) pool, no MMR and the earlier weight
+    best = max(rows, key=lambda r: (r[metric], r is current, -r["pool_size"], r["mmr_lambda"]))
+
+    print(f"\nTop settings by {metric}:")
+    for r in sorted(rows, key=lambda r: (-r[metric], r["pool_size"]))[:10]:
+        print(f"  w={r['vector_weight']:.2f} pool={r['pool_size']:<4} balance={r['balance']:<14} mmr={r['mmr_lambda']:.2f} "
+              f"recall@10={r['recall@10']:.4f} map@10={r['map@10']:.4f} ndcg@10={r['ndcg@10']:.4f}")
+    if current:
+        print(f"Current settings: {metric}={current[metric]:.4f}")
+
+    config = {
+        "vector_weight": best["vector_weight"],
+        "pool_size": best["pool_size"],
+        "balance": best["balance"],
+        "mmr_lambda": best["mmr_lambda"],
+        "metric": metric,
+        "score": best[metric],
+        "num_queries": len(queries)
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(config, f, indent=2)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    with open(GRID_FILE, 'w') as f:
+        json.dump(rows, f, indent=2)
+    print(f"Saved {config} to {output} (full grid in {GRID_FILE})")
+    return config
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grid search re-ranking weights, pool size and balancing on labeled queries.")
+    parser.add_argument("--labeled", default=LABELED_DATA, help="CSV with 'query' and pipe-separated 'relevant_assessments'")
+    parser.add_argument("--weights", default=None, help="Comma-separated vector weights (default 0.0..1.0 step 0.05)")
+    parser.add_argument("--pool-sizes", default="10,20,30,50", help="Comma-separated candidate pool sizes")
+    parser.add_argument("--policies", default=",".join(BALANCE_POLICIES), help="Comma-separated balancing policies")
+    parser.add_argument("--mmr-lambdas", default="1.0,0.9,0.8,0.7,0.5",
+                        help="Comma-separated MMR trade-offs (1.0 = no diversity re-ranking)")
+    parser.add_argument("--metric", default="recall@10", help="recall@10, map@10, ndcg@10 or mrr@10")
+    parser.add_argument("--output", default=RERANK_CONFIG_FILE, help="Where to write the chosen config")
+    parser.add_argument("--workers", type=int, default=16, help="Concurrent query analyses")
+    parser.add_argument("--analyzer", default=None, help="Analyzer mode override: gemini, local or auto")
+    args = parser.parse_args()
+    tune(
+        args.labeled,
+        weights=[float(w) for w in args.weights.split(",")] if args.weights else None,
+        pool_sizes=[int(p) for p in args.pool_sizes.split(",")],
+        policies=args.policies.split(","),
+        mmr_lambdas=[float(l) for l in args.mmr_lambdas.split(",")],
+        metric=args.metric,
+        output=args.output,
+        workers=args.workers,
+        analyzer_mode=args.analyzer
+    )